@@ -15,8 +15,15 @@
 ##
 
 import atexit
+import bisect
+import hashlib
 import json
+import logging
+import mmap
 import os
+import pickle
+import stat
+import sys
 import tempfile
 import zipfile
 
@@ -25,16 +32,52 @@ import botocore.loaders
 from botocore.exceptions import DataNotFoundError
 from collections import OrderedDict
 
+from aurora_echo.echo_cache import atomic_write, cache_dir
+from aurora_echo.echo_const import MODEL_CACHE_ENVVAR
+
+logger = logging.getLogger(__name__)
+
+# bump to ignore every model cached by an older version of this code
+MODEL_CACHE_FORMAT = 1
+MODEL_CACHE_PICKLE_PROTOCOL = 4
+
+# where botocore keeps its CA bundle, depending on the version
+CA_BUNDLE_PATHS = ('botocore/vendored/requests/cacert.pem', 'botocore/cacert.pem')
+
 EGG = None
+EGG_NAMES = []  # every name in the egg, sorted so prefix lookups can bisect instead of scanning
+EGG_API_INDEX = {}  # service name -> api version -> set of type names (service-2, paginators-1, ...)
 try:
     egg_path = os.path.dirname(os.path.dirname(__file__))
     EGG = zipfile.ZipFile(egg_path, 'r')
-    EGG_DIRS = set([os.path.split(x)[0] for x in EGG.namelist() if '/' in x])
-    EGG_API_PATHS = [x for x in EGG_DIRS if 'botocore/data/' in x]
-    EGG_API_PATHS.extend([x for x in EGG_DIRS if 'boto3/data/' in x])
+    EGG_NAMES = sorted(EGG.namelist())
+    for name in EGG_NAMES:
+        for data_path in ('botocore/data/', 'boto3/data/'):
+            if name.startswith(data_path):
+                # <service>/<api version>/<type name>[.<extras>].json
+                parts = name[len(data_path):].split('/')
+                if len(parts) == 3:
+                    service_name, api_version, file_name = parts
+                    type_name = file_name.split('.', 1)[0]
+                    EGG_API_INDEX.setdefault(service_name, {}).setdefault(api_version, set()).add(type_name)
 except Exception:
     pass
 
+MODEL_CACHE_DIR = None  # parsed models from this egg, for this python, are kept here between runs
+if EGG and os.environ.get(MODEL_CACHE_ENVVAR, '1') != '0':
+    # keyed by the egg's contents, as recorded in its central directory, so a new build never sees an old model
+    egg_hash = hashlib.sha1()
+    for info in EGG.infolist():
+        egg_hash.update('{}:{:08x}:{}\n'.format(info.filename, info.CRC, info.file_size).encode('UTF-8'))
+    egg_hash.update('python {}.{} format {}'.format(sys.version_info[0], sys.version_info[1], MODEL_CACHE_FORMAT).encode('UTF-8'))
+    MODEL_CACHE_DIR = os.path.join(cache_dir(), 'models', egg_hash.hexdigest())
+
+
+def egg_has_prefix(prefix: str):
+    """True if any name in the egg starts with prefix, in O(log n)"""
+    i = bisect.bisect_left(EGG_NAMES, prefix)
+    return i < len(EGG_NAMES) and EGG_NAMES[i].startswith(prefix)
+
 
 class JSONFileLoader2(object):
 
@@ -53,8 +96,7 @@ class JSONFileLoader2(object):
         :return: True if file path exists, False otherwise.
 
         """
-        # TODO fix? seems inconsistent with .format usage pattern. Also cast as str?
-        return any(x.startswith("%s" % file_path) for x in EGG.namelist())
+        return egg_has_prefix(str(file_path))
 
     def load_file(self, file_path: str):
         """Attempt to load the file path.
@@ -68,9 +110,77 @@ class JSONFileLoader2(object):
         """
         # everything is inside the egg now, so load from there
         full_path = file_path + '.json'
-        content = EGG.read(full_path).decode('UTF-8')
+        data = load_cached_model(full_path)
+        if data is None:
+            content = EGG.read(full_path).decode('UTF-8')
+            data = json.loads(content, object_pairs_hook=OrderedDict)
+            store_cached_model(full_path, data)
+
+        return data
+
+
+def cached_model_path(full_path: str):
+    return os.path.join(MODEL_CACHE_DIR, full_path.replace('/', '__') + '.pickle')
+
+
+def is_private(st: os.stat_result):
+    """True if nobody but us can change it: it's ours, and neither its group nor anyone else can write to it"""
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
 
-        return json.loads(content, object_pairs_hook=OrderedDict)
+def dirs_are_private(*paths: str):
+    """
+    True if every one of the dirs exists and nobody else can write to it. The cache dir can be anywhere
+    (AURORA_ECHO_CACHE_DIR), and os.makedirs doesn't change the mode of one that exists.
+    """
+    for path in paths:
+        try:
+            if not is_private(os.stat(path)):
+                logger.debug('Not using %s, others can write to it', path)
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def model_cache_dir_is_private():
+    """Unpickling runs whatever code the pickle says to, so only trust models from a cache nobody else can write to"""
+    return dirs_are_private(MODEL_CACHE_DIR, os.path.dirname(MODEL_CACHE_DIR), cache_dir())
+
+
+def load_cached_model(full_path: str):
+    """
+    Load a model we parsed on an earlier run, or None if there isn't a usable one. Unpickling a memory-mapped file
+    is a lot quicker than parsing the JSON again, several megabytes of it for some services.
+    """
+    if not MODEL_CACHE_DIR or not model_cache_dir_is_private():
+        return None
+    path = cached_model_path(full_path)
+    try:
+        with open(path, 'rb') as f:
+            if not is_private(os.fstat(f.fileno())):  # the file we actually opened, symlinks followed
+                logger.debug('Ignoring cached model %s, others can write to it', path)
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return pickle.loads(mapped)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # corrupt, truncated, or written by something we can't read; parse the JSON and write it again
+        logger.debug('Ignoring cached model %s: %r', path, e)
+        return None
+
+
+def store_cached_model(full_path: str, data):
+    if not MODEL_CACHE_DIR:
+        return
+    try:
+        os.makedirs(MODEL_CACHE_DIR, mode=0o700, exist_ok=True)
+        if not model_cache_dir_is_private():
+            return  # we'd never load it
+        atomic_write(cached_model_path(full_path), pickle.dumps(data, protocol=MODEL_CACHE_PICKLE_PROTOCOL))
+    except OSError as e:
+        logger.debug('Unable to cache model %s: %r', full_path, e)  # just slower next time
 
 
 @botocore.loaders.instance_cache
@@ -111,14 +221,11 @@ def list_available_services(self, type_name: str):
         be sorted.
     """
 
-    # search for available services, pulled from the egg
+    # search for available services, pulled from the egg's index
     services = set()
-    for api_path in EGG_API_PATHS:
-        api_version = api_path.replace('botocore/data/', '').replace('boto3/data/', '').split('/')
-        if len(api_version) == 2:
-            full_path = os.path.join(api_path, type_name)
-            if self.file_loader.exists(full_path):
-                services.add(api_version[0])
+    for service_name, api_versions in EGG_API_INDEX.items():
+        if any(type_name in type_names for type_names in api_versions.values()):
+            services.add(service_name)
 
     return sorted(services)
 
@@ -135,19 +242,11 @@ def list_api_versions(self, service_name: str, type_name: str):
         :return: A list of API version strings in sorted order.
 
     """
-    known_api_versions = set()
-    for api_path in EGG_API_PATHS:
-        if service_name in api_path.split('/'):
-            api_version = api_path.replace('botocore/data/', '').replace('boto3/data/', '').split('/')
-            if len(api_version) == 2:
-                full_path = os.path.join(api_path, type_name)
-                # Only add to the known_api_versions if the directory
-                # contains a service-2, paginators-1, etc. file corresponding
-                # to the type_name passed in.
-                if self.file_loader.exists(full_path):
-                    known_api_versions.add(api_version[1])
+    # Only count versions that have a service-2, paginators-1, etc. file corresponding
+    # to the type_name passed in.
+    api_versions = EGG_API_INDEX.get(service_name, {})
+    known_api_versions = set(api_version for api_version, type_names in api_versions.items() if type_name in type_names)
     if not known_api_versions:
-        # raise Exception('service_name: {0}, type_name: {1}'.format(service_name, type_name))
         raise DataNotFoundError(data_path=service_name)
     return sorted(known_api_versions)
 
@@ -162,13 +261,49 @@ def patch_ca_certs():
     # set the certificate to what requests bundles unless it's already overridden
     ca_bundle = os.environ.get('REQUESTS_CA_BUNDLE')
     if ca_bundle is None:
-        # extract the cacerts.pem into a temp directory
-        cert_dir = tempfile.mkdtemp(prefix='cacerts')
-        cert_file = os.path.join(cert_dir, 'cacerts.pem')
-        with open(cert_file, 'wb') as cf:
-            cf.write(EGG.read('botocore/vendored/requests/cacert.pem'))
+        bundle_name = next((name for name in CA_BUNDLE_PATHS if name in EGG.NameToInfo), None)
+        if bundle_name is None:
+            logger.warning('No CA bundle found in %s, leaving it to botocore to find one', EGG.filename)
+            return
+        try:
+            cert_file = extract_ca_certs(bundle_name)
+        except OSError:
+            cert_file = None
+        if cert_file is None:
+            # can't use the cache dir, so extract the cacerts.pem into a temp directory just for this run
+            cert_dir = tempfile.mkdtemp(prefix='cacerts')
+            cert_file = os.path.join(cert_dir, 'cacerts.pem')
+            with open(cert_file, 'wb') as cf:
+                cf.write(EGG.read(bundle_name))
+            atexit.register(clean_ca_certs, cert_dir)
         os.environ['REQUESTS_CA_BUNDLE'] = cert_file
-        atexit.register(clean_ca_certs, cert_dir)
+
+
+def extract_ca_certs(bundle_name: str):
+    """
+    Extract the bundle once into the cache dir, named after its CRC and size from the egg's central directory, and
+    reuse it on every later run. Whoever can change the bundle can intercept every AWS call, so an existing file is
+    only trusted if nobody else can write to it or its dir, and it's byte for byte what's in the egg.
+
+    :return: the bundle's path, or None if the cache dir isn't safe to keep it in
+    """
+    info = EGG.getinfo(bundle_name)
+    bundle = EGG.read(bundle_name)
+    cert_dir = os.path.join(cache_dir(), 'certs')
+    cert_file = os.path.join(cert_dir, 'cacerts-{:08x}-{}.pem'.format(info.CRC, info.file_size))
+
+    os.makedirs(cert_dir, mode=0o700, exist_ok=True)
+    if not dirs_are_private(cert_dir, cache_dir()):
+        return None
+    try:
+        with open(cert_file, 'rb') as cf:
+            if is_private(os.fstat(cf.fileno())) and cf.read() == bundle:
+                return cert_file
+    except FileNotFoundError:
+        pass
+
+    atomic_write(cert_file, bundle)  # a new file from mkstemp, so only we can write to it
+    return cert_file
 
 
 def clean_ca_certs(cert_dir):
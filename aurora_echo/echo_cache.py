@@ -0,0 +1,135 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from aurora_echo.echo_const import CACHE_DIR_ENVVAR
+
+logger = logging.getLogger(__name__)
+
+
+def cache_dir():
+    """
+    Where aurora-echo keeps files between runs: $AURORA_ECHO_CACHE_DIR, else the XDG cache dir.
+    """
+    path = os.environ.get(CACHE_DIR_ENVVAR)
+    if not path:
+        xdg_cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(xdg_cache_home, 'aurora-echo')
+    return path
+
+
+def atomic_write(path: str, content: bytes):
+    """
+    Write to a temp file next to path and rename it into place, so readers see either the old file or the new one.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def decode_value(obj: dict):
+    if '__datetime__' in obj:
+        from dateutil.parser import parse  # only needed on a cache hit
+        return parse(obj['__datetime__'])
+    return obj
+
+
+class InventoryCache(object):
+    """
+     Managed instance search results shared between runs, one file per account, region and stage tag.
+
+     Entries are written atomically and older than ttl seconds are ignored. A file lock is held while an entry is
+     checked and refreshed, so parallel jobs wait for the one doing the search and then reuse its result instead of
+     all searching at once. Anything that changes a managed instance must invalidate its entry.
+    """
+
+    def __init__(self, ttl: float, directory: str = None):
+        self.ttl = ttl
+        self.directory = os.path.join(directory or cache_dir(), 'inventory')
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def entry_path(self, account_number: str, region: str, stage_tag: str):
+        key = hashlib.sha1('{}:{}:{}'.format(account_number, region, stage_tag).encode('UTF-8')).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    @contextmanager
+    def locked(self, path: str):
+        with open(path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, path: str):
+        """
+        :return: the cached [(instance, stage)] list, or None if there's no usable entry
+        """
+        try:
+            with open(path, 'rb') as f:
+                entry = json.loads(f.read().decode('UTF-8'), object_hook=decode_value)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.debug('Ignoring unreadable inventory cache entry %s', path)
+            return None
+
+        age = time.time() - entry['created']
+        if age > self.ttl:
+            logger.debug('Inventory cache entry %s expired %.0fs ago', path, age - self.ttl)
+            return None
+        return [(instance, stage) for instance, stage in entry['instances']]
+
+    def store(self, path: str, managed_instances_and_tags: list):
+        entry = {'created': time.time(), 'instances': managed_instances_and_tags}
+        atomic_write(path, json.dumps(entry, default=encode_value).encode('UTF-8'))
+
+    def invalidate(self, account_number: str, region: str, stage_tag: str):
+        path = self.entry_path(account_number, region, stage_tag)
+        with self.locked(path):
+            try:
+                os.remove(path)
+                logger.debug('Invalidated inventory cache entry %s', path)
+            except FileNotFoundError:
+                pass
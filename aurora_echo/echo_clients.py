@@ -0,0 +1,163 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+One place to get AWS clients from.
+
+Nothing is built until it's first asked for: the boto3 session is created on the first get_client call and each
+client on the first call for its service, region and role, then reused for the rest of the process. Clients are built
+with the botocore Config set through configure_clients (pool size, timeouts, retries and so on) at the time, and each
+has its own connection pool, so e.g. one region being throttled doesn't hold up calls to another.
+
+Clients for a role_arn use credentials from assuming that role with the default credentials, refreshed before they
+expire. The role is assumed under a lock of its own rather than the registry's, so a slow STS call for one role doesn't
+hold up clients for any other.
+
+Functions passed to add_client_hook are called with every client and the role_arn it was built for, e.g. to register
+handlers for its botocore events.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# botocore's own default connection pool size, we never shrink the pool below it
+BOTOCORE_DEFAULT_POOL_CONNECTIONS = 10
+
+_lock = threading.RLock()  # boto3 sessions are not safe to create clients from concurrently
+_sessions = {}  # role ARN, or None for the default credentials -> boto3 session
+_session_locks = {}  # role ARN -> lock held while assuming it
+_clients = {}  # (service_name, region_name, role_arn) -> client
+_config_kwargs = {}
+_client_hooks = []
+
+
+def configure_clients(**config_kwargs):
+    """
+    Set botocore.config.Config options for clients, e.g. max_pool_connections, connect_timeout, read_timeout or
+    retries. Options accumulate across calls. They only apply to clients built from now on: ones already built are
+    kept as they are, since other threads may be using them and the hooks have already been registered on them.
+    """
+    with _lock:
+        if all(_config_kwargs.get(k) == v for k, v in config_kwargs.items()):
+            return
+        _config_kwargs.update(config_kwargs)
+        logger.debug('Client configuration changed to %r, for clients built from now on', _config_kwargs)
+
+
+def ensure_pool_connections(count: int):
+    """
+    Make sure clients can hold at least count HTTP connections, e.g. for that many threads sharing one client. Call it
+    before asking for the clients: one already built keeps its pool, and just doesn't keep any connections past it.
+    """
+    with _lock:
+        current = _config_kwargs.get('max_pool_connections', BOTOCORE_DEFAULT_POOL_CONNECTIONS)
+        if count > current:
+            configure_clients(max_pool_connections=count)
+
+
+def add_client_hook(hook):
+    """
+    Call hook(client, role_arn) for every client already created, and for each one created from now on.
+    """
+    with _lock:
+        _client_hooks.append(hook)
+        for (_, _, role_arn), client in _clients.items():
+            hook(client, role_arn)
+
+
+def get_session(role_arn: str = None):
+    with _lock:
+        session = _sessions.get(role_arn)
+        if session is not None:
+            return session
+        import aurora_echo.boto_monkey  # noqa: F401 teaches botocore to load its data from inside the eggsecutable
+        import boto3.session
+        if role_arn is None:
+            session = _sessions[role_arn] = boto3.session.Session()
+            return session
+        session_lock = _session_locks.setdefault(role_arn, threading.Lock())
+
+    with session_lock:
+        with _lock:
+            session = _sessions.get(role_arn)
+        if session is None:
+            session = boto3.session.Session(botocore_session=assume_role_session(role_arn))
+            with _lock:
+                _sessions[role_arn] = session
+        return session
+
+
+def assume_role_session(role_arn: str):
+    """
+    :return: a botocore session using credentials for role_arn, which it renews itself as they're about to expire
+    """
+    import botocore.session
+    from botocore.credentials import CredentialProvider, CredentialResolver, RefreshableCredentials
+
+    def assume_role():
+        logger.debug('Assuming role %s', role_arn)
+        credentials = get_client('sts').assume_role(RoleArn=role_arn, RoleSessionName='aurora-echo')['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat(),
+        }
+
+    class AssumeRoleProvider(CredentialProvider):
+        METHOD = 'assume-role'
+
+        def load(self):
+            return RefreshableCredentials.create_from_metadata(assume_role(), assume_role, self.METHOD)
+
+    botocore_session = botocore.session.Session()
+    botocore_session.register_component('credential_provider', CredentialResolver([AssumeRoleProvider()]))
+    botocore_session.get_credentials()  # assume the role now, rather than when the first client is made under _lock
+    return botocore_session
+
+
+def get_client(service_name: str, region_name: str = None, role_arn: str = None):
+    """
+    :param region_name: None uses the region from the environment/AWS config, as boto3 does
+    :param role_arn: a role to assume for this client, None for the default credentials
+    """
+    key = (service_name, region_name, role_arn)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+
+    session = get_session(role_arn)  # outside _lock, it may have to assume the role first
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            from botocore.config import Config
+            logger.debug('Creating %s client for region %s, role %s', service_name, region_name, role_arn)
+            client = session.client(service_name, region_name=region_name, config=Config(**_config_kwargs))
+            for hook in _client_hooks:
+                hook(client, role_arn)
+            _clients[key] = client
+        return client
@@ -22,21 +22,19 @@
 # THE SOFTWARE.
 ##
 
-import json
 from datetime import datetime, timezone
 
-import boto3
 import click
 
-from aurora_echo.echo_const import ECHO_CLONE_STAGE, ECHO_CLONE_COMMAND
-from aurora_echo.echo_util import EchoUtil, log_prefix_factory, validate_input_param
+from aurora_echo.echo_const import ECHO_CLONE_STAGE, ECHO_CLONE_COMMAND, DEFAULT_TAG_WORKERS, TAG_WORKERS_ENVVAR, \
+    DEFAULT_PAGE_SIZE, PAGE_SIZE_ENVVAR, DEFAULT_CACHE_TTL, CACHE_TTL_ENVVAR
+from aurora_echo.echo_log import CommandLogger
+from aurora_echo.echo_util import EchoUtil, validate_input_param
 from aurora_echo.entry import root
 
-rds = boto3.client('rds')
-
 today_string = '{0:%Y-%m-%d}'.format(datetime.now(timezone.utc))
 
-log_prefix = log_prefix_factory(ECHO_CLONE_COMMAND)
+log = CommandLogger(ECHO_CLONE_COMMAND)
 
 
 def collect_clone_params(source_cluster_name: str, new_cluster_name: str, db_subnet_group_name: str,
@@ -104,28 +102,30 @@ def collect_instance_params(cluster_identifier: str, new_instance_name: str, eng
     return params
 
 
-def create_clone_cluster_and_instance(clone_params: dict, instance_params: dict, interactive: bool):
-    click.echo('{} Clone settings:'.format(log_prefix()))
-    click.echo(json.dumps(clone_params, indent=4, sort_keys=True))
+def create_clone_cluster_and_instance(clone_params: dict, instance_params: dict, interactive: bool, util: EchoUtil, managed_name: str):
+    log.payload('Clone settings:', clone_params, prompting=interactive)
 
     if interactive:
-        click.confirm('{} Ready to create cluster clone and instance with these settings?'.format(log_prefix()), abort=True)  # exits entirely if no
+        click.confirm('{} Ready to create cluster clone and instance with these settings?'.format(log.prefix()), abort=True)  # exits entirely if no
 
-    click.echo('{} Creating copy-on-write clone...'.format(log_prefix()))
-    response = rds.restore_db_cluster_to_point_in_time(**clone_params)
+    log.info('Creating copy-on-write clone...')
+    response = util.rds.restore_db_cluster_to_point_in_time(**clone_params)
 
     # don't assume the cluster name came back exactly the same; use the one we received from aws
     cluster_identifier = response['DBCluster']['DBClusterIdentifier']
     instance_params['DBClusterIdentifier'] = cluster_identifier
-    response = rds.create_db_instance(**instance_params)
+    try:
+        response = util.rds.create_db_instance(**instance_params)
+    finally:
+        util.invalidate_inventory(managed_name)
 
-    click.echo('{} Success! Clone and instance created.'.format(log_prefix()))
-    click.echo(json.dumps(response, indent=4, sort_keys=True))
+    log.payload('Success! Clone and instance created.', response)
 
 
 @root.command()
 @click.option('--aws-account-number', '-a', callback=validate_input_param, required=True)
 @click.option('--region', '-r', callback=validate_input_param, required=True)
+@click.option('--assume-role', '-ar', default=None)
 @click.option('--source-cluster-name', '-s', callback=validate_input_param, required=True)
 @click.option('--managed-name', '-n', callback=validate_input_param, required=True)
 @click.option('--db-subnet-group-name', '-sub', callback=validate_input_param, required=True)
@@ -138,10 +138,24 @@ def create_clone_cluster_and_instance(clone_params: dict, instance_params: dict,
 @click.option('--interactive', '-i', default=True, type=bool)
 @click.option('--db-parameter-group-name', '-pgn')
 @click.option('--suffix', '-sf', default=None)
-def clone(aws_account_number: str, region: str, source_cluster_name: str, managed_name: str, db_subnet_group_name: str, db_instance_class: str,
-          engine: str, availability_zone: str, vpc_security_group_id: list, tag: list, minimum_age_hours: int, interactive: bool, db_parameter_group_name: str, suffix: str):
-    click.echo('{} Starting aurora-echo for {}'.format(log_prefix(), managed_name))
-    util = EchoUtil(region, aws_account_number)
+@click.option('--tag-workers', '-w', default=DEFAULT_TAG_WORKERS, type=click.IntRange(min=1), envvar=TAG_WORKERS_ENVVAR)
+@click.option('--page-size', '-ps', default=DEFAULT_PAGE_SIZE, type=click.IntRange(20, 100), envvar=PAGE_SIZE_ENVVAR)
+@click.option('--cache-ttl', default=DEFAULT_CACHE_TTL, type=click.FloatRange(min=0), envvar=CACHE_TTL_ENVVAR)
+def clone(aws_account_number: str, region: str, assume_role: str, source_cluster_name: str, managed_name: str, db_subnet_group_name: str, db_instance_class: str,
+          engine: str, availability_zone: str, vpc_security_group_id: list, tag: list, minimum_age_hours: int, interactive: bool, db_parameter_group_name: str, suffix: str,
+          tag_workers: int, page_size: int, cache_ttl: float):
+    util = EchoUtil(region, aws_account_number, tag_workers, page_size, cache_ttl, role_arn=assume_role)
+    return run_clone(util, managed_name, source_cluster_name, db_subnet_group_name, db_instance_class, engine, availability_zone,
+                     vpc_security_group_id, tag, minimum_age_hours, interactive, db_parameter_group_name, suffix)
+
+
+def run_clone(util: EchoUtil, managed_name: str, source_cluster_name: str, db_subnet_group_name: str, db_instance_class: str, engine: str,
+              availability_zone: str, vpc_security_group_id: list, tag: list, minimum_age_hours: int, interactive: bool,
+              db_parameter_group_name: str, suffix: str):
+    """
+    :return: True if a clone and instance were created
+    """
+    log.info('Starting aurora-echo for {}', managed_name)
     if not util.instance_too_new(managed_name, minimum_age_hours):
 
         restore_cluster_name = managed_name + '-' + today_string
@@ -157,7 +171,8 @@ def clone(aws_account_number: str, region: str, source_cluster_name: str, manage
         # collect parameters up front so we only have to prompt the user once
         cluster_params = collect_clone_params(source_cluster_name, restore_cluster_name, db_subnet_group_name, vpc_security_group_id, tag_set)
         instance_params = collect_instance_params(restore_cluster_name, restore_cluster_name, engine, db_instance_class, availability_zone, tag_set, db_parameter_group_name)  # instance and cluster names are the same
-        create_clone_cluster_and_instance(cluster_params, instance_params, interactive)
+        create_clone_cluster_and_instance(cluster_params, instance_params, interactive, util, managed_name)
+        return True
 
     else:
-        click.echo('{} Found managed instance created less than {} hours ago. Not proceeding.'.format(log_prefix(), minimum_age_hours))
+        log.info('Found managed instance created less than {} hours ago. Not proceeding.', minimum_age_hours)
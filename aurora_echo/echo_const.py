@@ -38,3 +38,78 @@ ECHO_PROMOTE_STAGE = 'promoted'
 
 ECHO_RETIRE_COMMAND = 'retire'
 ECHO_RETIRE_STAGE = 'retired'
+DEFAULT_RETIRE_WORKERS = 8  # instances and clusters retire --all deletes and polls at the same time
+
+ECHO_CYCLE_COMMAND = 'cycle'  # new/clone -> modify -> promote -> retire in one go
+
+ECHO_FLEET_COMMAND = 'fleet'  # any of the above for every managed name in a config file
+DEFAULT_FLEET_WORKERS = 4
+
+# which snapshot new and cycle restore from: the newest of any kind, or the newest automated or manual one. The last two
+# are also RDS's SnapshotType values, so they're filtered on server side
+SNAPSHOT_POLICY_NEWEST = 'newest'
+SNAPSHOT_POLICY_AUTOMATED = 'automated'
+SNAPSHOT_POLICY_MANUAL = 'manual'
+SNAPSHOT_POLICIES = (SNAPSHOT_POLICY_NEWEST, SNAPSHOT_POLICY_AUTOMATED, SNAPSHOT_POLICY_MANUAL)
+
+# concurrency for tag lookups while scanning for managed instances
+DEFAULT_TAG_WORKERS = 8
+TAG_WORKERS_ENVVAR = 'AURORA_ECHO_TAG_WORKERS'
+
+# how managed instances are discovered: ask the tagging API for our stage tag, or scan every instance's tags
+DISCOVERY_TAGGING = 'tagging'
+DISCOVERY_SCAN = 'scan'
+
+# records per describe_db_instances/get_resources page while searching for managed instances (RDS allows 20-100)
+DEFAULT_PAGE_SIZE = 100
+PAGE_SIZE_ENVVAR = 'AURORA_ECHO_PAGE_SIZE'
+
+# optional on-disk cache of managed instance searches, shared between runs. Disabled unless given a TTL
+DEFAULT_CACHE_TTL = 0
+CACHE_TTL_ENVVAR = 'AURORA_ECHO_CACHE_TTL'
+CACHE_DIR_ENVVAR = 'AURORA_ECHO_CACHE_DIR'
+
+# set to 0 to stop the eggsecutable caching parsed service models under the cache dir
+MODEL_CACHE_ENVVAR = 'AURORA_ECHO_MODEL_CACHE'
+
+# how long --wait, and cycle at each stage, will wait for RDS before giving up
+DEFAULT_WAIT_TIMEOUT_MINUTES = 120
+
+# where to write a JSON summary of every AWS call a run made, as --metrics-out does
+METRICS_OUT_ENVVAR = 'AURORA_ECHO_METRICS_OUT'
+
+# error codes AWS services use to say slow down, RDS and Route 53 included
+THROTTLE_ERROR_CODES = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException', 'TooManyRequestsException',
+    'RequestLimitExceeded', 'RequestThrottled', 'PriorRequestNotComplete', 'SlowDown', 'BandwidthLimitExceeded',
+])
+
+# most requests per second to send to each region and account (just each account for Route 53), shared by every
+# thread and client in the process. Keyed by service, or by service.Operation for an operation that gets a limit of
+# its own. Throttling slows this down for a while
+DEFAULT_RATE_LIMITS = {
+    'rds': 20,
+    'resourcegroupstaggingapi': 10,
+    'route53': 5,  # Route 53 allows 5 requests per second per account
+}
+RATE_LIMIT_ENVVAR = 'AURORA_ECHO_RATE_LIMIT'
+
+# retries allowed across the whole process, as a fraction of calls that succeeded, so that when AWS is throttling
+# everyone retries don't pile on top of it. Every request is tried at most RETRY_MAX_ATTEMPTS times
+DEFAULT_RETRY_BUDGET = 0.1
+RETRY_BUDGET_ENVVAR = 'AURORA_ECHO_RETRY_BUDGET'
+RETRY_MAX_ATTEMPTS = 5
+
+# how the commands log: level, text for people or one JSON object per line for log shippers, and whether to leave
+# out request/response payloads
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+DEFAULT_LOG_LEVEL = 'info'
+LOG_LEVEL_ENVVAR = 'AURORA_ECHO_LOG_LEVEL'
+LOG_FORMAT_TEXT = 'text'
+LOG_FORMAT_JSON = 'json'
+LOG_FORMATS = (LOG_FORMAT_TEXT, LOG_FORMAT_JSON)
+LOG_FORMAT_ENVVAR = 'AURORA_ECHO_LOG_FORMAT'
+QUIET_ENVVAR = 'AURORA_ECHO_QUIET'
+
+# exit status of a run that stopped part way, e.g. cycle timing out while waiting on RDS. Run it again to carry on
+EXIT_RESUMABLE = 3
@@ -0,0 +1,222 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+import time
+
+import click
+
+from aurora_echo import echo_clone, echo_new
+from aurora_echo.echo_const import ECHO_CYCLE_COMMAND, ECHO_NEW_STAGE, ECHO_MODIFY_STAGE, ECHO_PROMOTE_STAGE, \
+    ECHO_RETIRE_STAGE, DEFAULT_TAG_WORKERS, TAG_WORKERS_ENVVAR, DEFAULT_PAGE_SIZE, PAGE_SIZE_ENVVAR, DEFAULT_CACHE_TTL, \
+    CACHE_TTL_ENVVAR, DEFAULT_WAIT_TIMEOUT_MINUTES, SNAPSHOT_POLICY_NEWEST, SNAPSHOT_POLICIES
+from aurora_echo.echo_modify import modify_iam
+from aurora_echo.echo_promote import longest_ttl, update_dns, validate_record_sets
+from aurora_echo.echo_retire import delete_instance, delete_orphaned_clusters, find_orphaned_clusters
+from aurora_echo.echo_log import CommandLogger
+from aurora_echo.echo_util import EchoUtil, validate_input_param
+from aurora_echo.echo_wait import progress_reporter, wait_for_cluster_available, wait_for_instance_available
+from aurora_echo.entry import root
+
+log = CommandLogger(ECHO_CYCLE_COMMAND)
+
+
+def create_instance(util: EchoUtil, managed_name: str, cluster_snapshot_name: str, snapshot_policy: str,
+                    min_snapshot_age_hours: float, source_cluster_name: str, db_subnet_group_name: str,
+                    db_instance_class: str, engine: str, availability_zone: str, vpc_security_group_id: tuple, tag: tuple,
+                    db_parameter_group_name: str, suffix: str, interactive: bool):
+    """
+    Restore from the latest snapshot of cluster_snapshot_name that the snapshot policy allows, or clone
+    source_cluster_name, just like new and clone do
+
+    :return: the identifier of the new instance, or None if there was no snapshot to restore from
+    """
+    restore_cluster_name = managed_name + '-' + echo_new.today_string
+    if suffix is not None:
+        restore_cluster_name += '-' + suffix
+
+    tag_set = util.construct_managed_tag_set(managed_name, ECHO_NEW_STAGE)
+    user_tags = util.construct_user_tag_set(tag)
+    if user_tags:
+        tag_set.extend(user_tags)
+
+    # instance and cluster names are the same
+    instance_params = echo_clone.collect_instance_params(restore_cluster_name, restore_cluster_name, engine, db_instance_class,
+                                                         availability_zone, tag_set, db_parameter_group_name)
+
+    if cluster_snapshot_name:
+        cluster_snapshot_identifier = echo_new.find_snapshot(cluster_snapshot_name, util, snapshot_policy,
+                                                             min_snapshot_age_hours)
+        if not cluster_snapshot_identifier:
+            log.info('No cluster snapshots found with name {}. Not proceeding.', cluster_snapshot_name)
+            return None
+        cluster_params = echo_new.collect_cluster_params(cluster_snapshot_identifier, restore_cluster_name, db_subnet_group_name,
+                                                         engine, vpc_security_group_id, tag_set)
+        echo_new.create_cluster_and_instance(cluster_params, instance_params, interactive, util, managed_name)
+    else:
+        clone_params = echo_clone.collect_clone_params(source_cluster_name, restore_cluster_name, db_subnet_group_name,
+                                                       vpc_security_group_id, tag_set)
+        echo_clone.create_clone_cluster_and_instance(clone_params, instance_params, interactive, util, managed_name)
+
+    return instance_params['DBInstanceIdentifier']
+
+
+def wait_until_ready(util: EchoUtil, instance_identifier: str, timeout: float):
+    """
+    Wait for the instance and then its cluster to be available.
+    :return: the refreshed instance, with its Endpoint
+    """
+    log.info('Waiting for instance {} to be available...', instance_identifier)
+    instance = wait_for_instance_available(util, instance_identifier, timeout, progress_reporter(log))
+    log.info('Waiting for cluster {} to be available...', instance['DBClusterIdentifier'])
+    wait_for_cluster_available(util, instance['DBClusterIdentifier'], timeout, progress_reporter(log))
+    return instance
+
+
+@root.command()
+@click.option('--aws-account-number', '-a', callback=validate_input_param, required=True)
+@click.option('--region', '-r', callback=validate_input_param, required=True)
+@click.option('--assume-role', '-ar', default=None)
+@click.option('--managed-name', '-n', callback=validate_input_param, required=True)
+@click.option('--cluster-snapshot-name', '-ss')
+@click.option('--snapshot-policy', default=SNAPSHOT_POLICY_NEWEST, type=click.Choice(SNAPSHOT_POLICIES))
+@click.option('--min-snapshot-age-hours', default=0, type=click.FloatRange(min=0))
+@click.option('--source-cluster-name', '-sc')
+@click.option('--db-subnet-group-name', '-sub', callback=validate_input_param, required=True)
+@click.option('--db-instance-class', '-c', callback=validate_input_param, required=True)
+@click.option('--engine', '-e', default='aurora')
+@click.option('--availability-zone', '-az')
+@click.option('--vpc-security-group-id', '-sg', multiple=True)
+@click.option('--tag', '-t', multiple=True)
+@click.option('--minimum-age-hours', '-h', default=20, type=float)
+@click.option('--db-parameter-group-name', '-pgn')
+@click.option('--suffix', '-sf', default=None)
+@click.option('--iam-role-name', '-iam', default=None, multiple=True)
+@click.option('--hosted-zone-id', '-z', callback=validate_input_param, multiple=True, required=True)
+@click.option('--record-set', '-rs', callback=validate_record_sets, multiple=True, required=True)
+@click.option('--ttl', default=60)
+@click.option('--stage-timeout-minutes', default=DEFAULT_WAIT_TIMEOUT_MINUTES, type=click.FloatRange(min=0))
+@click.option('--interactive', '-i', default=True, type=bool)
+@click.option('--tag-workers', '-w', default=DEFAULT_TAG_WORKERS, type=click.IntRange(min=1), envvar=TAG_WORKERS_ENVVAR)
+@click.option('--page-size', '-ps', default=DEFAULT_PAGE_SIZE, type=click.IntRange(20, 100), envvar=PAGE_SIZE_ENVVAR)
+@click.option('--cache-ttl', default=DEFAULT_CACHE_TTL, type=click.FloatRange(min=0), envvar=CACHE_TTL_ENVVAR)
+def cycle(aws_account_number: str, region: str, assume_role: str, managed_name: str, cluster_snapshot_name: str,
+          snapshot_policy: str, min_snapshot_age_hours: float, source_cluster_name: str, db_subnet_group_name: str,
+          db_instance_class: str, engine: str, availability_zone: str, vpc_security_group_id: tuple, tag: tuple,
+          minimum_age_hours: float, db_parameter_group_name: str, suffix: str, iam_role_name: tuple, hosted_zone_id: tuple,
+          record_set: list, ttl: int, stage_timeout_minutes: float, interactive: bool, tag_workers: int, page_size: int,
+          cache_ttl: float):
+    util = EchoUtil(region, aws_account_number, tag_workers, page_size, cache_ttl, role_arn=assume_role)
+    return run_cycle(util, managed_name, cluster_snapshot_name, snapshot_policy, min_snapshot_age_hours, source_cluster_name,
+                     db_subnet_group_name, db_instance_class, engine, availability_zone, vpc_security_group_id, tag,
+                     minimum_age_hours, db_parameter_group_name, suffix, iam_role_name, hosted_zone_id, record_set, ttl,
+                     stage_timeout_minutes, interactive)
+
+
+def run_cycle(util: EchoUtil, managed_name: str, cluster_snapshot_name: str, snapshot_policy: str,
+              min_snapshot_age_hours: float, source_cluster_name: str, db_subnet_group_name: str, db_instance_class: str,
+              engine: str, availability_zone: str, vpc_security_group_id: tuple, tag: tuple, minimum_age_hours: float,
+              db_parameter_group_name: str, suffix: str, iam_role_name: tuple, hosted_zone_id: tuple, record_set: list,
+              ttl: int, stage_timeout_minutes: float, interactive: bool):
+    """
+    Take managed_name through every stage that's left, resuming from whatever the tags say a previous run got to.
+
+    A WaitTimeout exits with EXIT_RESUMABLE; every step is recorded in the stage tags, so the next run picks up from there.
+    Retiring is the exception, since the instance's tags go with it, so it tags the cluster as well and carries on
+    with whatever is left of the two; see delete_instance and find_orphaned_clusters.
+
+    :return: True if any stage was carried out
+    """
+    if bool(cluster_snapshot_name) == bool(source_cluster_name):
+        raise click.UsageError('Pass exactly one of --cluster-snapshot-name or --source-cluster-name')
+
+    log.info('Starting aurora-echo for {}', managed_name)
+
+    # click doesn't allow mismatches between option and parameter names, so just for clarity
+    iam_role_names = iam_role_name
+    hosted_zone_ids = hosted_zone_id
+    record_sets = record_set
+    stage_timeout = stage_timeout_minutes * 60
+
+    progressed = False
+    instance = util.find_instance_in_stage(managed_name, ECHO_MODIFY_STAGE)
+    if instance:
+        log.info('Resuming with modified instance: {}', instance['DBInstanceIdentifier'])
+    else:
+        instance = util.find_instance_in_stage(managed_name, ECHO_NEW_STAGE)
+        if instance:
+            log.info('Resuming with new instance: {}', instance['DBInstanceIdentifier'])
+            instance_identifier = instance['DBInstanceIdentifier']
+        elif util.instance_too_new(managed_name, minimum_age_hours):
+            log.info('Found managed instance created less than {} hours ago. Not creating another.', minimum_age_hours)
+            instance_identifier = None
+        else:
+            instance_identifier = create_instance(util, managed_name, cluster_snapshot_name, snapshot_policy,
+                                                  min_snapshot_age_hours, source_cluster_name, db_subnet_group_name,
+                                                  db_instance_class, engine, availability_zone, vpc_security_group_id, tag,
+                                                  db_parameter_group_name, suffix, interactive)
+
+        if instance_identifier:
+            instance = wait_until_ready(util, instance_identifier, stage_timeout)
+            modify_iam(instance['DBClusterIdentifier'], iam_role_names, interactive, util)
+            log.info('Updating tag for modified instance: {}', instance_identifier)
+            util.add_stage_tag(managed_name, instance, ECHO_MODIFY_STAGE)
+            progressed = True
+
+    just_retired = False
+    if instance:
+        # look again rather than trust the tags: the endpoint only shows up once the instance is available
+        instance = wait_until_ready(util, instance['DBInstanceIdentifier'], stage_timeout)
+        update_dns(hosted_zone_ids, record_sets, instance['Endpoint']['Address'], ttl, interactive, util, stage_timeout)
+
+        old_promoted_instance = util.find_instance_in_stage(managed_name, ECHO_PROMOTE_STAGE)
+        if old_promoted_instance:
+            log.info('Retiring old instance: {}', old_promoted_instance['DBInstanceIdentifier'])
+            util.add_stage_tag(managed_name, old_promoted_instance, ECHO_RETIRE_STAGE)
+            just_retired = True
+
+        log.info('Updating tag for promoted instance: {}', instance['DBInstanceIdentifier'])
+        util.add_stage_tag(managed_name, instance, ECHO_PROMOTE_STAGE)
+        progressed = True
+
+    retired_instance = util.find_instance_in_stage(managed_name, ECHO_RETIRE_STAGE)
+    if retired_instance:
+        if just_retired:
+            # clients may still have the old address cached, give them a full TTL to pick up the new one
+            dns_ttl = longest_ttl(record_sets, ttl)
+            log.info('Waiting {} seconds for DNS to catch up before retiring {}', dns_ttl, retired_instance['DBInstanceIdentifier'])
+            time.sleep(dns_ttl)
+        log.info('Found instance ready for retirement: {}', retired_instance['DBInstanceIdentifier'])
+        delete_instance(retired_instance, interactive, util, managed_name, stage_timeout, wait_for_cluster=True)
+        progressed = True
+
+    # clusters an earlier run got as far as emptying before it was stopped
+    orphaned_clusters = find_orphaned_clusters(util, managed_name, [retired_instance] if retired_instance else [])
+    if orphaned_clusters:
+        log.info('Found {} clusters whose instance was already retired: {}', len(orphaned_clusters),
+                 ', '.join(cluster['DBClusterIdentifier'] for cluster in orphaned_clusters))
+        delete_orphaned_clusters(orphaned_clusters, interactive, util, stage_timeout, wait_for_cluster=True)
+        progressed = True
+
+    log.info('Done!')
+    return progressed
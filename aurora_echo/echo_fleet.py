@@ -0,0 +1,306 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+Run one command for every managed name in a fleet config file, e.g.
+
+    {
+        "defaults": {
+            "aws-account-number": "123456789012",
+            "region": "us-east-1",
+            "db-subnet-group-name": "development",
+            "db-instance-class": "db.r4.large"
+        },
+        "databases": [
+            {
+                "managed-name": "orders",
+                "cluster-snapshot-name": "orders-production",
+                "promote": {"hosted-zone-id": "Z1D633PJN98FT9", "record-set": ["orders-db.dev.example.com"]}
+            },
+            {
+                "managed-name": "users",
+                "cluster-snapshot-name": "users-production",
+                "iam-role-name": "users-s3-import"
+            }
+        ]
+    }
+
+Options go by their long names, with dashes or underscores, e.g. all or retire-all for retire --all. Each entry
+inherits the defaults, and a section named after a command only applies to that command. Options only another command
+takes are ignored, so one entry can hold what every command needs, but one no command takes (or, in a command's own
+section, that the command doesn't take) is an error rather than a typo that's quietly dropped. YAML works too if PyYAML
+is installed.
+
+An entry can list several regions, and several roles to assume (assume-role), to run in every one of them. Each
+account and region is a target with its own EchoUtil, clients and workers, and all the managed names in it are searched
+for together in a single pass. Targets run in parallel and their results go into one summary.
+"""
+
+import importlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from aurora_echo.echo_clients import ensure_pool_connections
+from aurora_echo.echo_const import ECHO_FLEET_COMMAND, DEFAULT_FLEET_WORKERS, DEFAULT_TAG_WORKERS, TAG_WORKERS_ENVVAR, \
+    DEFAULT_PAGE_SIZE, PAGE_SIZE_ENVVAR, DEFAULT_CACHE_TTL, CACHE_TTL_ENVVAR, EXIT_RESUMABLE
+from aurora_echo.echo_log import CommandLogger
+from aurora_echo.echo_util import EchoUtil
+from aurora_echo.echo_wait import WaitTimeout
+from aurora_echo.entry import root, LAZY_COMMANDS
+
+logger = logging.getLogger(__name__)
+
+log = CommandLogger(ECHO_FLEET_COMMAND)
+
+FLEET_COMMANDS = sorted(name for name in LAZY_COMMANDS if name != ECHO_FLEET_COMMAND)
+
+# options that go into building the EchoUtil rather than to run_<command>; fleet's own tag workers, page size and
+# cache TTL apply to every database
+UTIL_PARAMS = ('aws_account_number', 'region', 'assume_role', 'tag_workers', 'page_size', 'cache_ttl')
+
+RESULT_DONE = 'done'
+RESULT_SKIPPED = 'nothing to do'
+RESULT_FAILED = 'failed'
+
+
+def load_fleet_config(path: str):
+    with open(path) as config_file:
+        if path.endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except ImportError:
+                raise click.UsageError('PyYAML is needed to read {}. Install it, or use JSON instead.'.format(path))
+            config = yaml.safe_load(config_file)
+        else:
+            config = json.load(config_file)
+
+    if not isinstance(config, dict) or not isinstance(config.get('databases'), list):
+        raise click.UsageError('{} needs a list of "databases"'.format(path))
+    return config
+
+
+def option_names(command: click.Command):
+    """
+    :return: the parameter name for each way the command's options can be written in a config: their long names, with
+        dashes or underscores, and the parameter names themselves
+    """
+    names = {}
+    for param in command.params:
+        names[param.name] = param.name
+        for opt in param.opts:
+            if opt.startswith('--'):
+                names[opt[2:]] = names[opt[2:].replace('-', '_')] = param.name
+    return names
+
+
+def collect_entry_options(defaults: dict, entry: dict, command_name: str, commands: dict):
+    """
+    Merge an entry over the defaults, then each one's section for this command on top
+
+    :param commands: every command fleet can run, by name, to tell an option for another command from a typo
+    :return: options keyed by parameter name
+    """
+    names = option_names(commands[command_name])
+    other_names = set(name for other in commands.values() for name in option_names(other))
+    where = entry.get('managed-name') or entry.get('managed_name') or 'a database'
+
+    options = {}
+    for section, description, own in ((defaults, 'defaults', False),
+                                      (defaults.get(command_name) or {}, 'defaults for ' + command_name, True),
+                                      (entry, where, False),
+                                      (entry.get(command_name) or {}, '{} for {}'.format(where, command_name), True)):
+        for key, value in section.items():
+            if key in LAZY_COMMANDS:
+                continue  # a section of its own
+            if key in names:
+                options[names[key]] = value
+            elif own:
+                raise click.UsageError('{} has {}, which {} doesn\'t take'.format(description, key, command_name))
+            elif key not in other_names:
+                raise click.UsageError('{} has {}, which no command takes'.format(description, key))
+    return options
+
+
+def role_account(role_arn: str):
+    """:return: the account number from an IAM role ARN, arn:aws:iam::<account>:role/<name>"""
+    parts = role_arn.split(':')
+    if len(parts) != 6 or parts[2] != 'iam' or not parts[5].startswith('role/'):
+        raise click.UsageError('{} is not an IAM role ARN'.format(role_arn))
+    return parts[4]
+
+
+def expand_targets(options: dict):
+    """
+    Split an entry listing several regions and/or roles into one per region and role. The account is always the one
+    the role is in, when there is a role.
+
+    :return: [options]
+    """
+    regions = options.get('region')
+    roles = options.get('assume_role')
+    expanded = []
+    for region in regions if isinstance(regions, list) else [regions]:
+        for role in roles if isinstance(roles, list) else [roles]:
+            target_options = dict(options, region=region, assume_role=role)
+            if role:
+                target_options['aws_account_number'] = role_account(role)
+            expanded.append(target_options)
+    return expanded
+
+
+def describe_target(params: dict):
+    return '{}/{}'.format(params['aws_account_number'], params['region'])
+
+
+def parse_entry_options(command: click.Command, options: dict):
+    """
+    Run the options through the command's own parameter handling, as if they'd been given on the command line, so
+    they get the same defaults, types and validation.
+
+    :return: the command's params
+    """
+    for param in command.params:
+        if param.multiple and isinstance(options.get(param.name), str):
+            options[param.name] = [options[param.name]]  # a single value where a list was expected
+
+    if options.get('interactive'):
+        raise click.UsageError('fleet can\'t run interactively, remove interactive from {}'.format(options.get('managed_name')))
+    options['interactive'] = False
+
+    # a default_map stands in for the command line, keyed by parameter name
+    try:
+        ctx = command.make_context(command.name, [], default_map=options)
+    except click.UsageError as e:
+        raise click.UsageError('{}: {}'.format(options.get('managed_name') or 'unnamed database', e.format_message()))
+    return ctx.params
+
+
+def run_target(runner, util: EchoUtil, entries: list, max_workers: int):
+    """
+    Search for all of a target's managed names in one pass, then run them up to max_workers at a time
+    """
+    log.info('Searching for {} managed names in {}', len(entries), describe_target(entries[0]))
+    try:
+        util.discover_inventory([params['managed_name'] for params in entries])
+    except Exception as e:
+        # not fatal, each managed name will just search for itself and fail on its own if it has to
+        log.info('Unable to search all of {} at once: {}', describe_target(entries[0]), describe_error(e))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(entries))) as executor:
+        return list(executor.map(lambda params: run_entry(runner, util, params), entries))
+
+
+def run_entry(runner, util: EchoUtil, params: dict):
+    """
+    Run one managed name, catching whatever goes wrong so it doesn't stop the others
+
+    :return: a summary line's worth of result
+    """
+    started = time.monotonic()
+    try:
+        done = runner(util, **{key: value for key, value in params.items() if key not in UTIL_PARAMS})
+        status, error = (RESULT_DONE if done else RESULT_SKIPPED), None
+    except Exception as e:
+        logger.debug('%s failed', params['managed_name'], exc_info=True)
+        status, error = RESULT_FAILED, e
+    return {
+        'managed_name': params['managed_name'],
+        'target': describe_target(params),
+        'status': status,
+        'elapsed': time.monotonic() - started,
+        'error': error,
+    }
+
+
+def describe_error(error: Exception):
+    if isinstance(error, click.ClickException):
+        return error.format_message()
+    return str(error) or error.__class__.__name__
+
+
+def echo_summary(results: list):
+    log.info('Summary:')
+    name_width = max(len(result['managed_name']) for result in results)
+    target_width = max(len(result['target']) for result in results)
+    for result in results:
+        line = '  {:<{name_width}}  {:<{target_width}}  {:<13}  {:>7.1f}s'.format(
+            result['managed_name'], result['target'], result['status'], result['elapsed'], name_width=name_width, target_width=target_width)
+        if result['error']:
+            line += '  ' + describe_error(result['error'])
+        log.info('{}', line)
+
+    counts = [(status, sum(1 for result in results if result['status'] == status))
+              for status in (RESULT_DONE, RESULT_SKIPPED, RESULT_FAILED)]
+    log.info('{}', ', '.join('{} {}'.format(count, status) for status, count in counts))
+
+
+@root.command()
+@click.argument('command_name', metavar='COMMAND', type=click.Choice(FLEET_COMMANDS))
+@click.option('--config', '-f', required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--max-workers', '-j', default=DEFAULT_FLEET_WORKERS, type=click.IntRange(min=1))
+@click.option('--tag-workers', '-w', default=DEFAULT_TAG_WORKERS, type=click.IntRange(min=1), envvar=TAG_WORKERS_ENVVAR)
+@click.option('--page-size', '-ps', default=DEFAULT_PAGE_SIZE, type=click.IntRange(20, 100), envvar=PAGE_SIZE_ENVVAR)
+@click.option('--cache-ttl', default=DEFAULT_CACHE_TTL, type=click.FloatRange(min=0), envvar=CACHE_TTL_ENVVAR)
+def fleet(command_name: str, config: str, max_workers: int, tag_workers: int, page_size: int, cache_ttl: float):
+    log.info('Starting aurora-echo {} for the fleet in {}', command_name, config)
+    commands = {name: getattr(importlib.import_module(LAZY_COMMANDS[name]), name) for name in FLEET_COMMANDS}
+    command = commands[command_name]
+    runner = getattr(importlib.import_module(LAZY_COMMANDS[command_name]), 'run_' + command_name)
+
+    # check every entry before doing anything, so a typo doesn't leave the fleet half done
+    fleet_config = load_fleet_config(config)
+    defaults = fleet_config.get('defaults') or {}
+    entries = [parse_entry_options(command, options)
+               for entry in fleet_config['databases']
+               for options in expand_targets(collect_entry_options(defaults, entry, command_name, commands))]
+    if not entries:
+        log.info('No databases in {}, nothing to do', config)
+        return
+
+    targets = {}  # (account, region, role) -> [params], each target with its own EchoUtil, clients and workers
+    for params in entries:
+        target = (params['aws_account_number'], params['region'], params['assume_role'])
+        if any(other['managed_name'] == params['managed_name'] for other in targets.get(target, [])):
+            raise click.UsageError('{} is in {} more than once for {}'.format(params['managed_name'], config, describe_target(params)))
+        targets.setdefault(target, []).append(params)
+    ensure_pool_connections(max_workers)
+
+    # targets don't wait on each other, so one being slow or throttled only holds up its own managed names
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = [executor.submit(run_target, runner, EchoUtil(region, account, tag_workers, page_size, cache_ttl, role_arn=role),
+                                   target_entries, max_workers)
+                   for (account, region, role), target_entries in targets.items()]
+        results = [result for future in futures for result in future.result()]
+
+    echo_summary(results)
+    failures = [result for result in results if result['status'] == RESULT_FAILED]
+    if failures:
+        error = click.ClickException('{} of {} managed names failed'.format(len(failures), len(results)))
+        if all(isinstance(result['error'], WaitTimeout) for result in failures):
+            error.exit_code = EXIT_RESUMABLE  # nothing went wrong that running it again won't carry on from
+        raise error
@@ -0,0 +1,171 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+What the commands tell the user, through the standard logging module.
+
+Each command logs through a CommandLogger. Messages take str.format style arguments and are only formatted if their
+level is enabled, and request/response payloads are handed over as data, so they're only serialized if something is
+actually going to be written. configure sets up the one handler, on the aurora_echo logger, for either:
+
+    text   2017-01-02 03:04:05 UTC [promote] Done!, with payloads pretty-printed below the line
+    json   one JSON object per line: time, level, command, message and data
+
+In quiet mode payloads are left out entirely, unless they're needed to answer a confirmation prompt.
+"""
+
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+
+from aurora_echo.echo_const import LOG_FORMAT_TEXT, LOG_FORMAT_JSON
+
+ROOT_LOGGER = 'aurora_echo'
+
+_settings = {'quiet': False}
+_handler = None
+
+
+class Message(object):
+    """A str.format message that isn't formatted until it's needed"""
+
+    def __init__(self, fmt: str, args: tuple):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        return self.fmt.format(*self.args) if self.args else self.fmt
+
+
+class TimestampCache(object):
+    """
+    The same timestamp text for every line logged within the same second, formatted once per second rather than once
+    per line
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self._cached = (None, None)  # (second, text), swapped as one so threads never see a mismatched pair
+
+    def __call__(self, created: float):
+        second = int(created)
+        cached_second, text = self._cached
+        if cached_second != second:
+            text = datetime.fromtimestamp(second, timezone.utc).strftime(self.fmt)
+            self._cached = (second, text)
+        return text
+
+
+text_timestamp = TimestampCache('%Y-%m-%d %H:%M:%S UTC')
+json_timestamp = TimestampCache('%Y-%m-%dT%H:%M:%SZ')
+
+
+def record_command(record: logging.LogRecord):
+    """The command a record came from, or for our other modules' logging, e.g. echo_util, the module"""
+    return getattr(record, 'command', None) or record.name.rsplit('.', 1)[-1]
+
+
+class TextFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord):
+        level = '' if record.levelno == logging.INFO else record.levelname + ': '
+        text = '{} [{}] {}{}'.format(text_timestamp(record.created), record_command(record), level, record.getMessage())
+        data = getattr(record, 'data', None)
+        if data is not None:
+            text += '\n' + json.dumps(data, indent=4, sort_keys=True, default=str)
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord):
+        line = {
+            'time': json_timestamp(record.created),
+            'level': record.levelname.lower(),
+            'command': record_command(record),
+            'message': record.getMessage(),
+        }
+        data = getattr(record, 'data', None)
+        if data is not None:
+            line['data'] = data
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+class CommandLogger(object):
+    """
+    Logs on behalf of one command, e.g. log.info('Found instance {}', identifier)
+    """
+
+    def __init__(self, command_name: str):
+        self.command_name = command_name
+        self.logger = logging.getLogger('{}.{}'.format(ROOT_LOGGER, command_name))
+        self.extra = {'command': command_name}
+
+    def log(self, level: int, fmt: str, *args, data=None):
+        if self.logger.isEnabledFor(level):
+            extra = self.extra if data is None else dict(self.extra, data=data)
+            self.logger.log(level, Message(fmt, args), extra=extra)
+
+    def debug(self, fmt: str, *args):
+        self.log(logging.DEBUG, fmt, *args)
+
+    def info(self, fmt: str, *args):
+        self.log(logging.INFO, fmt, *args)
+
+    def warning(self, fmt: str, *args):
+        self.log(logging.WARNING, fmt, *args)
+
+    def payload(self, message: str, data, prompting: bool = False):
+        """
+        Log a message along with a request or response, which is left out in quiet mode.
+
+        :param prompting: the user is about to be asked to confirm the request, so show it anyway
+        """
+        self.log(logging.INFO, message, data=data if prompting or not _settings['quiet'] else None)
+
+    def prefix(self):
+        """:return: what lines are prefixed with in text format, e.g. for prompts"""
+        return '{} [{}]'.format(text_timestamp(time.time()), self.command_name)
+
+
+def configure(level: int = logging.INFO, log_format: str = LOG_FORMAT_TEXT, quiet: bool = False):
+    """
+    Send everything aurora_echo logs at level or above to stdout, replacing what an earlier call set up.
+    """
+    global _handler
+    root_logger = logging.getLogger(ROOT_LOGGER)
+    if _handler is not None:
+        root_logger.removeHandler(_handler)
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(JsonFormatter() if log_format == LOG_FORMAT_JSON else TextFormatter())
+    root_logger.addHandler(_handler)
+    root_logger.setLevel(level)
+    root_logger.propagate = False  # already written, don't let a root handler write it again
+    _settings['quiet'] = quiet
@@ -0,0 +1,185 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+Counts and timings for every AWS call, taken from botocore's own events.
+
+Once enabled, every client from echo_clients reports to one Metrics: before-call and after-call give each operation's
+call count and latency (retries included), and how many retries it needed; needs-retry sees every attempt, so it
+counts the throttled ones. The summary can be written out as JSON, or as a table showing where the wall time went.
+"""
+
+import bisect
+import json
+import threading
+import time
+
+import click
+
+from aurora_echo import echo_clients
+from aurora_echo.echo_const import THROTTLE_ERROR_CODES
+
+# upper bounds, in seconds, of the latency histogram buckets. Anything slower goes in a last, unbounded one
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTEXT_KEY = 'aurora_echo_metrics'  # where before-call leaves the operation and start time for after-call
+
+_lock = threading.Lock()
+_metrics = None
+
+
+class OperationMetrics(object):
+    """Everything recorded for one operation, e.g. rds.DescribeDBInstances"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record_call(self, seconds: float, error: bool, retries: int):
+        self.calls += 1
+        self.errors += bool(error)
+        self.retries += retries
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def to_dict(self):
+        bucket_names = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'total_seconds': round(self.total_seconds, 6),
+            'mean_seconds': round(self.total_seconds / self.calls, 6) if self.calls else None,
+            'max_seconds': round(self.max_seconds, 6),
+            'latency_histogram': dict(zip(bucket_names, self.histogram)),  # seconds, each bucket is up to its name
+        }
+
+
+class Metrics(object):
+    """
+    Handlers for botocore's call events, and what they've recorded. Clients are shared between threads, so every
+    update is made under a lock.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self.operations = {}  # 'service.Operation' -> OperationMetrics
+
+    def register(self, client, role_arn: str = None):
+        events = client.meta.events
+        # unique ids so a client that's registered again doesn't count everything twice
+        events.register('before-call', self.before_call, unique_id='aurora-echo-metrics-before-call')
+        events.register('after-call', self.after_call, unique_id='aurora-echo-metrics-after-call')
+        events.register('after-call-error', self.after_call_error, unique_id='aurora-echo-metrics-after-call-error')
+        events.register('needs-retry', self.needs_retry, unique_id='aurora-echo-metrics-needs-retry')
+
+    def operation(self, name: str):
+        metrics = self.operations.get(name)
+        if metrics is None:
+            metrics = self.operations[name] = OperationMetrics()
+        return metrics
+
+    def before_call(self, model, context, **kwargs):
+        context[CONTEXT_KEY] = (operation_name(model), time.monotonic())
+
+    def after_call(self, http_response, parsed, context, **kwargs):
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        self.finish_call(context, http_response.status_code >= 300, retries)
+
+    def after_call_error(self, context, **kwargs):
+        # the request itself failed, e.g. couldn't connect, so there's no response
+        self.finish_call(context, True, 0)
+
+    def finish_call(self, context: dict, error: bool, retries: int):
+        name, started = context.pop(CONTEXT_KEY, (None, None))
+        if name is None:
+            return  # started before metrics were enabled
+        seconds = time.monotonic() - started
+        with self._lock:
+            self.operation(name).record_call(seconds, error, retries)
+
+    def needs_retry(self, response, operation, **kwargs):
+        if response is not None and response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            with self._lock:
+                self.operation(operation_name(operation)).throttles += 1
+
+    def summary(self, command: str):
+        with self._lock:
+            operations = {name: metrics.to_dict() for name, metrics in sorted(self.operations.items())}
+        return {
+            'command': command,
+            'wall_seconds': round(time.monotonic() - self.started, 6),
+            'operations': operations,
+        }
+
+    def write(self, path: str, command: str):
+        with open(path, 'w') as f:
+            json.dump(self.summary(command), f, indent=4, sort_keys=True)
+            f.write('\n')
+
+    def echo_table(self, command: str):
+        """
+        Print each operation's calls, retries and time to stderr, slowest in total first. Calls made from several
+        threads at once overlap, so the percentages of wall time can add up to more than 100.
+        """
+        summary = self.summary(command)
+        wall_seconds = summary['wall_seconds']
+        operations = sorted(summary['operations'].items(), key=lambda item: item[1]['total_seconds'], reverse=True)
+
+        click.echo('{} took {:.1f}s, {} AWS calls'.format(
+            command, wall_seconds, sum(metrics['calls'] for _, metrics in operations)), err=True)
+        click.echo('  {:<45} {:>6} {:>7} {:>9} {:>9} {:>9} {:>9} {:>6}'.format(
+            'operation', 'calls', 'retries', 'throttles', 'total s', 'mean ms', 'max ms', 'wall%'), err=True)
+        for name, metrics in operations:
+            click.echo('  {:<45} {:>6} {:>7} {:>9} {:>9.2f} {:>9.1f} {:>9.1f} {:>6.1f}'.format(
+                name, metrics['calls'], metrics['retries'], metrics['throttles'], metrics['total_seconds'],
+                (metrics['mean_seconds'] or 0) * 1000, metrics['max_seconds'] * 1000,
+                100 * metrics['total_seconds'] / wall_seconds if wall_seconds else 0), err=True)
+
+
+def operation_name(model):
+    """:return: e.g. rds.DescribeDBInstances for a botocore OperationModel"""
+    return '{}.{}'.format(model.service_model.service_name, model.name)
+
+
+def enable():
+    """
+    Start recording every call made by clients from echo_clients, those already created included.
+
+    :return: the process's Metrics
+    """
+    global _metrics
+    with _lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            echo_clients.add_client_hook(_metrics.register)
+        return _metrics
@@ -22,20 +22,19 @@
 # THE SOFTWARE.
 ##
 
-
-import boto3
 import click
 
-from aurora_echo.echo_const import ECHO_NEW_STAGE, ECHO_MODIFY_COMMAND, ECHO_MODIFY_STAGE
-from aurora_echo.echo_util import EchoUtil, log_prefix_factory, validate_input_param
+from aurora_echo.echo_const import ECHO_NEW_STAGE, ECHO_MODIFY_COMMAND, ECHO_MODIFY_STAGE, DEFAULT_TAG_WORKERS, TAG_WORKERS_ENVVAR, \
+    DEFAULT_PAGE_SIZE, PAGE_SIZE_ENVVAR, DEFAULT_CACHE_TTL, CACHE_TTL_ENVVAR, DEFAULT_WAIT_TIMEOUT_MINUTES
+from aurora_echo.echo_log import CommandLogger
+from aurora_echo.echo_util import EchoUtil, validate_input_param
+from aurora_echo.echo_wait import progress_reporter, wait_for_cluster_available, wait_for_instance_available
 from aurora_echo.entry import root
 
-rds = boto3.client('rds')
-
-log_prefix = log_prefix_factory(ECHO_MODIFY_COMMAND)
+log = CommandLogger(ECHO_MODIFY_COMMAND)
 
 
-def is_cluster_available(cluster_identifier: str):
+def is_cluster_available(cluster_identifier: str, util: EchoUtil):
     """
     Look up the cluster and make sure it's not currently being created,
     as we will not be able to modify it yet
@@ -43,11 +42,20 @@ def is_cluster_available(cluster_identifier: str):
     return if cluster is available for modification
     """
 
-    response = rds.describe_db_clusters(DBClusterIdentifier=cluster_identifier)
+    response = util.rds.describe_db_clusters(DBClusterIdentifier=cluster_identifier)
     cluster_map = response['DBClusters'][0]  # we got the cluster from the instance, so assume it exists
     return cluster_map['Status'] == 'available'
 
 
+def wait_until_modifiable(instance: dict, timeout: float, util: EchoUtil):
+    """
+    Wait for the instance and its cluster to finish being created
+    """
+    log.info('Waiting for instance {} and its cluster to be available...', instance['DBInstanceIdentifier'])
+    wait_for_instance_available(util, instance['DBInstanceIdentifier'], timeout, progress_reporter(log))
+    wait_for_cluster_available(util, instance['DBClusterIdentifier'], timeout, progress_reporter(log))
+
+
 def modify_iam(cluster_identifier: str, iam_role_names: tuple, interactive: bool, util: EchoUtil):
     """
     Update the IAM role on the cluster
@@ -60,30 +68,44 @@ def modify_iam(cluster_identifier: str, iam_role_names: tuple, interactive: bool
         for iam_name in iam_role_names:
             arn = util.construct_iam_arn(iam_name)
             iam_role_arn_list.append(arn)
-            click.echo('{} IAM: {}'.format(log_prefix(), arn))
+            log.info('IAM: {}', arn)
 
         # pop out of the loop to ask if this is all good
         if interactive:
-            click.confirm('{} Ready to modify cluster with these settings?'.format(log_prefix()), abort=True)  # exits entirely if no
+            click.confirm('{} Ready to modify cluster with these settings?'.format(log.prefix()), abort=True)  # exits entirely if no
 
-        click.echo('{} Adding IAM to cluster...'.format(log_prefix()))
+        log.info('Adding IAM to cluster...')
 
         for iam_role_arn in iam_role_arn_list:
-            rds.add_role_to_db_cluster(DBClusterIdentifier=cluster_identifier, RoleArn=iam_role_arn)
+            util.rds.add_role_to_db_cluster(DBClusterIdentifier=cluster_identifier, RoleArn=iam_role_arn)
     else:
         # even if they didn't want an IAM added, it still successfully passed through this stage
-        click.echo('{} No IAM roles provided. Nothing to do! {}'.format(log_prefix(), cluster_identifier))
+        log.info('No IAM roles provided. Nothing to do! {}', cluster_identifier)
 
 
 @root.command()
 @click.option('--aws-account-number', '-a', callback=validate_input_param, required=True)
 @click.option('--region', '-r', callback=validate_input_param, required=True)
+@click.option('--assume-role', '-ar', default=None)
 @click.option('--managed-name', '-n', callback=validate_input_param, required=True)
 @click.option('--iam-role-name', '-iam', default=None, multiple=True)
 @click.option('--interactive', '-i', default=True, type=bool)
-def modify(aws_account_number: str, region: str, managed_name: str, iam_role_name: tuple, interactive: bool):
-    click.echo('{} Starting aurora-echo for {}'.format(log_prefix(), managed_name))
-    util = EchoUtil(region, aws_account_number)
+@click.option('--wait', is_flag=True)
+@click.option('--wait-timeout-minutes', default=DEFAULT_WAIT_TIMEOUT_MINUTES, type=click.FloatRange(min=0))
+@click.option('--tag-workers', '-w', default=DEFAULT_TAG_WORKERS, type=click.IntRange(min=1), envvar=TAG_WORKERS_ENVVAR)
+@click.option('--page-size', '-ps', default=DEFAULT_PAGE_SIZE, type=click.IntRange(20, 100), envvar=PAGE_SIZE_ENVVAR)
+@click.option('--cache-ttl', default=DEFAULT_CACHE_TTL, type=click.FloatRange(min=0), envvar=CACHE_TTL_ENVVAR)
+def modify(aws_account_number: str, region: str, assume_role: str, managed_name: str, iam_role_name: tuple, interactive: bool,
+           wait: bool, wait_timeout_minutes: float, tag_workers: int, page_size: int, cache_ttl: float):
+    util = EchoUtil(region, aws_account_number, tag_workers, page_size, cache_ttl, role_arn=assume_role)
+    return run_modify(util, managed_name, iam_role_name, interactive, wait, wait_timeout_minutes)
+
+
+def run_modify(util: EchoUtil, managed_name: str, iam_role_name: tuple, interactive: bool, wait: bool, wait_timeout_minutes: float):
+    """
+    :return: True if an instance was modified
+    """
+    log.info('Starting aurora-echo for {}', managed_name)
 
     # click doesn't allow mismatches between option and parameter names, so just for clarity, this is a tuple
     iam_role_names = iam_role_name
@@ -93,16 +115,20 @@ def modify(aws_account_number: str, region: str, managed_name: str, iam_role_nam
 
         cluster_identifier = found_instance['DBClusterIdentifier']
 
-        if is_cluster_available(cluster_identifier):
-            click.echo('{} Instance has modifiable cluster: {}'.format(log_prefix(), cluster_identifier))
+        if wait:
+            wait_until_modifiable(found_instance, wait_timeout_minutes * 60, util)
+
+        if is_cluster_available(cluster_identifier, util):
+            log.info('Instance has modifiable cluster: {}', cluster_identifier)
 
             modify_iam(cluster_identifier, iam_role_names, interactive, util)
 
-            click.echo('{} Updating tag for modified instance: {}'.format(log_prefix(), found_instance['DBInstanceIdentifier']))
+            log.info('Updating tag for modified instance: {}', found_instance['DBInstanceIdentifier'])
             util.add_stage_tag(managed_name, found_instance, ECHO_MODIFY_STAGE)
 
-            click.echo('{} Done!'.format(log_prefix()))
+            log.info('Done!')
+            return True
         else:
-            click.echo('{} Cluster {} does not have status \'available\'. Not proceeding.'.format(log_prefix(), cluster_identifier))
+            log.info('Cluster {} does not have status \'available\'. Not proceeding.', cluster_identifier)
     else:
-        click.echo('{} No instance found in stage {}. Not proceeding.'.format(log_prefix(), ECHO_NEW_STAGE))
+        log.info('No instance found in stage {}. Not proceeding.', ECHO_NEW_STAGE)
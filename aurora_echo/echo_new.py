@@ -22,33 +22,57 @@
 # THE SOFTWARE.
 ##
 
-import json
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
-import boto3
 import click
 
-from aurora_echo.echo_const import ECHO_NEW_STAGE, ECHO_NEW_COMMAND
-from aurora_echo.echo_util import EchoUtil, log_prefix_factory, validate_input_param
+from aurora_echo.echo_const import ECHO_NEW_STAGE, ECHO_NEW_COMMAND, DEFAULT_TAG_WORKERS, TAG_WORKERS_ENVVAR, \
+    DEFAULT_PAGE_SIZE, PAGE_SIZE_ENVVAR, DEFAULT_CACHE_TTL, CACHE_TTL_ENVVAR, SNAPSHOT_POLICY_NEWEST, SNAPSHOT_POLICIES
+from aurora_echo.echo_log import CommandLogger
+from aurora_echo.echo_util import EchoUtil, validate_input_param
 from aurora_echo.entry import root
 
-rds = boto3.client('rds')
-
 today_string = '{0:%Y-%m-%d}'.format(datetime.now(timezone.utc))
 
-log_prefix = log_prefix_factory(ECHO_NEW_COMMAND)
+log = CommandLogger(ECHO_NEW_COMMAND)
+
+
+def iter_snapshots(cluster_name: str, util: EchoUtil, snapshot_type: str = None):
+    """
+    Lazily yield every snapshot of the cluster, a page at a time.
+
+    :param snapshot_type: only ask RDS for snapshots of this SnapshotType, e.g. automated or manual
+    """
+    params = {'DBClusterIdentifier': cluster_name}
+    if snapshot_type:
+        params['SnapshotType'] = snapshot_type
+    paginator = util.rds.get_paginator('describe_db_cluster_snapshots')
+    for page in paginator.paginate(PaginationConfig={'PageSize': util.page_size}, **params):
+        yield from page['DBClusterSnapshots']
 
 
-def find_snapshot(cluster_name: str):
+def find_snapshot(cluster_name: str, util: EchoUtil, snapshot_policy: str = SNAPSHOT_POLICY_NEWEST,
+                  min_snapshot_age_hours: float = 0):
+    """
+    Find the newest available snapshot of the cluster, keeping only the newest seen so far as the pages go by.
 
-    response = rds.describe_db_cluster_snapshots(DBClusterIdentifier=cluster_name)
-    snapshot_list = response['DBClusterSnapshots']
-    # sort/filter by newest and available
-    available_snapshots = [snap for snap in snapshot_list if snap['Status'] == 'available' and snap.get('SnapshotCreateTime')]
-    sorted_snapshot_list = sorted(available_snapshots, key=lambda snap: snap['SnapshotCreateTime'], reverse=True)
-    if sorted_snapshot_list:
-        chosen_cluster_snapshot = sorted_snapshot_list[0]
-        click.echo('{} Located cluster snapshot {}'.format(log_prefix(), chosen_cluster_snapshot['DBClusterSnapshotIdentifier']))
+    :param snapshot_policy: one of SNAPSHOT_POLICIES
+    :param min_snapshot_age_hours: ignore snapshots taken less than this many hours ago
+    :return: the snapshot's identifier, or None if none qualify
+    """
+    snapshot_type = None if snapshot_policy == SNAPSHOT_POLICY_NEWEST else snapshot_policy
+    latest_allowed = datetime.now(timezone.utc) - timedelta(hours=min_snapshot_age_hours)
+
+    chosen_cluster_snapshot = None
+    for snap in iter_snapshots(cluster_name, util, snapshot_type):
+        # snapshots still being taken have no SnapshotCreateTime yet
+        create_time = snap.get('SnapshotCreateTime')
+        if snap['Status'] == 'available' and create_time and create_time <= latest_allowed and \
+                (chosen_cluster_snapshot is None or create_time > chosen_cluster_snapshot['SnapshotCreateTime']):
+            chosen_cluster_snapshot = snap
+
+    if chosen_cluster_snapshot:
+        log.info('Located cluster snapshot {}', chosen_cluster_snapshot['DBClusterSnapshotIdentifier'])
         return chosen_cluster_snapshot['DBClusterSnapshotIdentifier']
 
 
@@ -109,30 +133,31 @@ def collect_instance_params(cluster_identifier: str, new_instance_name: str, eng
     return params
 
 
-def create_cluster_and_instance(cluster_params: dict, instance_params: dict, interactive: bool):
-    click.echo('{} Cluster settings:'.format(log_prefix()))
-    click.echo(json.dumps(cluster_params, indent=4, sort_keys=True))
-    click.echo('\n{} Instance settings:'.format(log_prefix()))
-    click.echo(json.dumps(instance_params, indent=4, sort_keys=True))
+def create_cluster_and_instance(cluster_params: dict, instance_params: dict, interactive: bool, util: EchoUtil, managed_name: str):
+    log.payload('Cluster settings:', cluster_params, prompting=interactive)
+    log.payload('Instance settings:', instance_params, prompting=interactive)
 
     if interactive:
-        click.confirm('{} Ready to create cluster and instance with these settings?'.format(log_prefix()), abort=True)  # exits entirely if no
+        click.confirm('{} Ready to create cluster and instance with these settings?'.format(log.prefix()), abort=True)  # exits entirely if no
 
-    click.echo('{} Creating cluster and instance...'.format(log_prefix()))
-    response = rds.restore_db_cluster_from_snapshot(**cluster_params)
+    log.info('Creating cluster and instance...')
+    response = util.rds.restore_db_cluster_from_snapshot(**cluster_params)
 
     # don't assume the cluster name came back exactly the same; use the one we received from aws
     cluster_identifier = response['DBCluster']['DBClusterIdentifier']
     instance_params['DBClusterIdentifier'] = cluster_identifier
-    response = rds.create_db_instance(**instance_params)
+    try:
+        response = util.rds.create_db_instance(**instance_params)
+    finally:
+        util.invalidate_inventory(managed_name)
 
-    click.echo('{} Success! Cluster and instance created.'.format(log_prefix()))
-    click.echo(json.dumps(response, indent=4, sort_keys=True))
+    log.payload('Success! Cluster and instance created.', response)
 
 
 @root.command()
 @click.option('--aws-account-number', '-a', callback=validate_input_param, required=True)
 @click.option('--region', '-r', callback=validate_input_param, required=True)
+@click.option('--assume-role', '-ar', default=None)
 @click.option('--cluster-snapshot-name', '-s', callback=validate_input_param, required=True)
 @click.option('--managed-name', '-n', callback=validate_input_param, required=True)
 @click.option('--db-subnet-group-name', '-sub', callback=validate_input_param, required=True)
@@ -142,15 +167,31 @@ def create_cluster_and_instance(cluster_params: dict, instance_params: dict, int
 @click.option('--vpc-security-group-id', '-sg', multiple=True)
 @click.option('--tag', '-t', multiple=True)
 @click.option('--minimum-age-hours', '-h', default=20, type=float)
+@click.option('--snapshot-policy', default=SNAPSHOT_POLICY_NEWEST, type=click.Choice(SNAPSHOT_POLICIES))
+@click.option('--min-snapshot-age-hours', default=0, type=click.FloatRange(min=0))
 @click.option('--interactive', '-i', default=True, type=bool)
 @click.option('--suffix', '-sf', default=None)
-def new(aws_account_number: str, region: str, cluster_snapshot_name: str, managed_name: str, db_subnet_group_name: str, db_instance_class: str,
-        engine: str, availability_zone: str, vpc_security_group_id: list, tag: list, minimum_age_hours: int, interactive: bool, suffix: str):
-    click.echo('{} Starting aurora-echo for {}'.format(log_prefix(), managed_name))
-    util = EchoUtil(region, aws_account_number)
+@click.option('--tag-workers', '-w', default=DEFAULT_TAG_WORKERS, type=click.IntRange(min=1), envvar=TAG_WORKERS_ENVVAR)
+@click.option('--page-size', '-ps', default=DEFAULT_PAGE_SIZE, type=click.IntRange(20, 100), envvar=PAGE_SIZE_ENVVAR)
+@click.option('--cache-ttl', default=DEFAULT_CACHE_TTL, type=click.FloatRange(min=0), envvar=CACHE_TTL_ENVVAR)
+def new(aws_account_number: str, region: str, assume_role: str, cluster_snapshot_name: str, managed_name: str, db_subnet_group_name: str, db_instance_class: str,
+        engine: str, availability_zone: str, vpc_security_group_id: list, tag: list, minimum_age_hours: int, snapshot_policy: str,
+        min_snapshot_age_hours: float, interactive: bool, suffix: str, tag_workers: int, page_size: int, cache_ttl: float):
+    util = EchoUtil(region, aws_account_number, tag_workers, page_size, cache_ttl, role_arn=assume_role)
+    return run_new(util, managed_name, cluster_snapshot_name, db_subnet_group_name, db_instance_class, engine, availability_zone,
+                   vpc_security_group_id, tag, minimum_age_hours, snapshot_policy, min_snapshot_age_hours, interactive, suffix)
+
+
+def run_new(util: EchoUtil, managed_name: str, cluster_snapshot_name: str, db_subnet_group_name: str, db_instance_class: str, engine: str,
+            availability_zone: str, vpc_security_group_id: list, tag: list, minimum_age_hours: int, snapshot_policy: str,
+            min_snapshot_age_hours: float, interactive: bool, suffix: str):
+    """
+    :return: True if a cluster and instance were created
+    """
+    log.info('Starting aurora-echo for {}', managed_name)
     if not util.instance_too_new(managed_name, minimum_age_hours):
 
-        cluster_snapshot_identifier = find_snapshot(cluster_snapshot_name)
+        cluster_snapshot_identifier = find_snapshot(cluster_snapshot_name, util, snapshot_policy, min_snapshot_age_hours)
         if cluster_snapshot_identifier:
             restore_cluster_name = managed_name + '-' + today_string
 
@@ -165,8 +206,9 @@ def new(aws_account_number: str, region: str, cluster_snapshot_name: str, manage
             # collect parameters up front so we only have to prompt the user once
             cluster_params = collect_cluster_params(cluster_snapshot_identifier, restore_cluster_name, db_subnet_group_name, engine, vpc_security_group_id, tag_set)
             instance_params = collect_instance_params(restore_cluster_name, restore_cluster_name, engine, db_instance_class, availability_zone, tag_set)  # instance and cluster names are the same
-            create_cluster_and_instance(cluster_params, instance_params, interactive)
+            create_cluster_and_instance(cluster_params, instance_params, interactive, util, managed_name)
+            return True
         else:
-            click.echo('{} No cluster snapshots found with name {}. Not proceeding.'.format(log_prefix(), cluster_snapshot_name))
+            log.info('No cluster snapshots found with name {}. Not proceeding.', cluster_snapshot_name)
     else:
-        click.echo('{} Found managed instance created less than {} hours ago. Not proceeding.'.format(log_prefix(), minimum_age_hours))
+        log.info('Found managed instance created less than {} hours ago. Not proceeding.', minimum_age_hours)
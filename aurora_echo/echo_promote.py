@@ -22,106 +22,265 @@
 # THE SOFTWARE.
 ##
 
-import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
 import click
 
-from aurora_echo.echo_const import ECHO_MODIFY_STAGE, ECHO_PROMOTE_COMMAND, ECHO_PROMOTE_STAGE, ECHO_RETIRE_STAGE
-from aurora_echo.echo_util import EchoUtil, log_prefix_factory, validate_input_param
+from aurora_echo.echo_clients import ensure_pool_connections
+from aurora_echo.echo_const import ECHO_MODIFY_STAGE, ECHO_PROMOTE_COMMAND, ECHO_PROMOTE_STAGE, ECHO_RETIRE_STAGE, \
+    DEFAULT_TAG_WORKERS, TAG_WORKERS_ENVVAR, DEFAULT_PAGE_SIZE, PAGE_SIZE_ENVVAR, DEFAULT_CACHE_TTL, CACHE_TTL_ENVVAR, \
+    DEFAULT_WAIT_TIMEOUT_MINUTES
+from aurora_echo.echo_log import CommandLogger
+from aurora_echo.echo_util import EchoUtil, validate_input_param
+from aurora_echo.echo_wait import progress_reporter, wait_for_changes_insync, wait_for_instance_available
 from aurora_echo.entry import root
 
-rds = boto3.client('rds')
-route53 = boto3.client('route53')
+log = CommandLogger(ECHO_PROMOTE_COMMAND)
 
-log_prefix = log_prefix_factory(ECHO_PROMOTE_COMMAND)
 
+def normalize_record_name(record_set_name: str):
+    """
+    Route 53 names are case insensitive, come back fully qualified with a trailing dot, and have anything outside of
+    a-z, 0-9, - and _ escaped as \\ooo octal, e.g. *.example.com. is listed as \\052.example.com.
+    """
+    name = re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), record_set_name).lower()
+    return name if name.endswith('.') else name + '.'
 
-def find_record_set(hosted_zone_id: str, record_set_name: str):
 
-    paginator = route53.get_paginator('list_resource_record_sets')
-    response_iterator = paginator.paginate(HostedZoneId=hosted_zone_id)
+def record_set_list_order(name: str, record_type: str):
+    """
+    Roughly where Route 53 lists a record set: by name with the labels reversed and the trailing dot kept
+    (com.example.www.), compared as strings, then by type. Only used to guess which of several names to start listing
+    at, so the others turn up in the same listing; what's actually in a listing is all that's trusted.
+    """
+    return '.'.join(reversed(name.rstrip('.').split('.'))) + '.', record_type
 
-    for response in response_iterator:
-        for record_set in response['ResourceRecordSets']:
-            if record_set['Name'] == record_set_name:
-                return record_set
 
+# (hosted zone id, normalized name, type) -> record set, or None if there isn't one. Only lives as long as the process
+record_set_cache = {}
 
-def update_dns(hosted_zone_ids: tuple, record_set_name: str, cluster_endpoint: str, ttl: str, interactive: bool):
-    for hosted_zone in hosted_zone_ids:
-        record_set = find_record_set(hosted_zone, record_set_name)
+# how many record sets to list at a time when looking up several in a zone. Route 53 lists at most 300 at a time
+RECORD_SET_BATCH_MAX_ITEMS = 100
 
-        if record_set and record_set.get('ResourceRecords'):
-            click.echo('{} Found record set {} currently pointed at {}'
-                       .format(log_prefix(), record_set['Name'], record_set['ResourceRecords'][0]['Value']))
-        else:
-            click.echo('{} Inserting new record set {} in hosted zone {}'.format(log_prefix(), record_set_name, hosted_zone))
 
-        params = {
-            'HostedZoneId': hosted_zone,
-            'ChangeBatch': {
-                'Comment': 'Modified by Aurora Echo',
-                'Changes': [
+def find_record_sets(hosted_zone_id: str, wanted: list, util: EchoUtil):
+    """
+    Look up several record sets in a zone with as few listings as we can, rather than paging through the whole zone or
+    making one call per name. A listing starting at one of the names we want often holds the others too: record sets
+    promoted together tend to be neighbours, like dev-db and dev-db-ro.
+
+    Route 53 starts a listing at the name and type asked for, so that one is settled by whether it's there. Any other
+    is only settled by turning up in it, since where Route 53 would have listed a name that isn't there is up to its
+    own ordering; the rest start listings of their own.
+
+    :param wanted: (name, type) of each record set
+    :return: each record set, or None for any that don't exist, in the same order as wanted
+    """
+    keys = [(hosted_zone_id, normalize_record_name(name), record_type) for name, record_type in wanted]
+    missing = sorted(set(key for key in keys if key not in record_set_cache), key=lambda key: record_set_list_order(*key[1:]))
+    while missing:
+        start = missing[0]
+        _, start_name, start_type = start
+        max_items = 1 if len(missing) == 1 else RECORD_SET_BATCH_MAX_ITEMS  # just the one, if it exists at all
+        response = util.route53.list_resource_record_sets(HostedZoneId=hosted_zone_id, StartRecordName=start_name,
+                                                          StartRecordType=start_type, MaxItems=str(max_items))
+        found = {(hosted_zone_id, normalize_record_name(record_set['Name']), record_set['Type']): record_set
+                 for record_set in response['ResourceRecordSets']}
+        record_set_cache[start] = found.get(start)  # it's listed first, if it exists
+        for key in missing[1:]:
+            if key in found:
+                record_set_cache[key] = found[key]
+        missing = [key for key in missing[1:] if key not in found]
+    return [record_set_cache[key] for key in keys]
+
+
+def find_record_set(hosted_zone_id: str, record_set_name: str, util: EchoUtil, record_type: str = 'CNAME'):
+    """Look up just the one record set, see find_record_sets"""
+    return find_record_sets(hosted_zone_id, [(record_set_name, record_type)], util)[0]
+
+
+# record types we know how to point at a cluster endpoint
+RECORD_TYPES = ('CNAME', 'TXT')
+
+
+def parse_record_set(spec: str):
+    """
+    Parse NAME[:TTL[:TYPE]], e.g. dev-db.mycompany.com, dev-db.mycompany.com:300 or dev-db.mycompany.com:300:TXT
+
+    :return: (name, ttl, type); ttl is None if not given, to use --ttl
+    """
+    name, _, rest = spec.partition(':')
+    ttl, _, record_type = rest.partition(':')
+    if not name:
+        raise click.BadParameter('no record set name in {}'.format(spec))
+    if ttl != '':
+        try:
+            ttl = int(ttl)
+        except ValueError:
+            ttl = -1
+        if ttl < 0:
+            raise click.BadParameter('TTL must be a whole number of seconds in {}'.format(spec))
+    else:
+        ttl = None
+    record_type = record_type.upper() or 'CNAME'
+    if record_type not in RECORD_TYPES:
+        raise click.BadParameter('type must be one of {} in {}'.format(', '.join(RECORD_TYPES), spec))
+    return name, ttl, record_type
+
+
+def validate_record_sets(ctx, param, value):
+    return [parse_record_set(spec) for spec in validate_input_param(ctx, param, value)]
+
+
+def longest_ttl(record_sets: list, default_ttl: int):
+    """:return: the longest any client may keep one of the record sets cached for"""
+    return max(default_ttl if record_ttl is None else record_ttl for _, record_ttl, _ in record_sets)
+
+
+def collect_dns_params(hosted_zone: str, record_sets: list, cluster_endpoint: str, ttl: int, util: EchoUtil):
+    """
+    :param record_sets: (name, ttl, type) as returned by parse_record_set
+    :return: the change_resource_record_sets params pointing every record set at cluster_endpoint in one batch, so they
+        all change together, and the record sets as they are now (None for any that don't exist yet)
+    """
+    current_record_sets = find_record_sets(hosted_zone, [(name, record_type) for name, _, record_type in record_sets], util)
+    changes = []
+    for record_set_name, record_ttl, record_type in record_sets:
+        changes.append({
+            'Action': 'UPSERT',
+            'ResourceRecordSet': {
+                'Name': record_set_name,
+                'Type': record_type,
+                'TTL': ttl if record_ttl is None else record_ttl,
+                'ResourceRecords': [
                     {
-                        'Action': 'UPSERT',
-                        'ResourceRecordSet': {
-                            'Name': record_set_name,
-                            'Type': 'CNAME',
-                            'TTL': ttl,
-                            'ResourceRecords': [
-                                {
-                                    'Value': cluster_endpoint
-                                },
-                            ],
-                        }
+                        # TXT records hold quoted strings
+                        'Value': '"{}"'.format(cluster_endpoint) if record_type == 'TXT' else cluster_endpoint
                     },
-                ]
+                ],
             }
+        })
+
+    params = {
+        'HostedZoneId': hosted_zone,
+        'ChangeBatch': {
+            'Comment': 'Modified by Aurora Echo',
+            'Changes': changes,
         }
+    }
+    return params, current_record_sets
+
+
+def describe_dns_change(params: dict, current_record_sets: list, interactive: bool):
+    hosted_zone = params['HostedZoneId']
+    for change, record_set in zip(params['ChangeBatch']['Changes'], current_record_sets):
+        if record_set and record_set.get('ResourceRecords'):
+            log.info('Found record set {} currently pointed at {}', record_set['Name'], record_set['ResourceRecords'][0]['Value'])
+        else:
+            log.info('Inserting new record set {} in hosted zone {}', change['ResourceRecordSet']['Name'], hosted_zone)
 
-        click.echo('{} Parameters:'.format(log_prefix()))
-        click.echo(json.dumps(params, indent=4, sort_keys=True))
+    log.payload('Parameters:', params, prompting=interactive)
 
-        if interactive:
-            click.confirm('{} Ready to update DNS record with these settings?'.format(log_prefix()), abort=True)  # exits entirely if no
 
-        # update to the found instance endpoint
-        route53.change_resource_record_sets(**params)
-        click.echo('{} Success! DNS updated in hosted zone {}'.format(log_prefix(), hosted_zone))
+def submit_dns_change(params: dict, util: EchoUtil):
+    """
+    :return: the Route 53 change ID, and when it was submitted
+    """
+    submitted = time.monotonic()
+    response = util.route53.change_resource_record_sets(**params)
+    for change in params['ChangeBatch']['Changes']:
+        record_set = change['ResourceRecordSet']
+        record_set_cache[(params['HostedZoneId'], normalize_record_name(record_set['Name']), record_set['Type'])] = record_set
+    log.info('DNS change submitted in hosted zone {}', params['HostedZoneId'])
+    return response['ChangeInfo']['Id'], submitted
+
+
+def update_dns(hosted_zone_ids: tuple, record_sets: list, cluster_endpoint: str, ttl: int, interactive: bool, util: EchoUtil,
+               sync_timeout: float = DEFAULT_WAIT_TIMEOUT_MINUTES * 60):
+    """
+    Point the record sets at cluster_endpoint in every hosted zone, with one change batch per zone, and wait until
+    Route 53 says all of them are INSYNC.
+
+    Interactively, each zone is shown and confirmed in turn. Otherwise the lookups and changes for all zones are made
+    at the same time, so split-horizon zones switch over together.
+    """
+    if interactive:
+        submitted = []
+        for hosted_zone in hosted_zone_ids:
+            params, current_record_sets = collect_dns_params(hosted_zone, record_sets, cluster_endpoint, ttl, util)
+            describe_dns_change(params, current_record_sets, interactive)
+            click.confirm('{} Ready to update DNS records with these settings?'.format(log.prefix()), abort=True)  # exits entirely if no
+            submitted.append(submit_dns_change(params, util))
+    else:
+        ensure_pool_connections(len(hosted_zone_ids))
+        with ThreadPoolExecutor(max_workers=len(hosted_zone_ids)) as executor:
+            changes = list(executor.map(lambda hosted_zone: collect_dns_params(hosted_zone, record_sets, cluster_endpoint, ttl, util),
+                                        hosted_zone_ids))
+            for params, current_record_sets in changes:
+                describe_dns_change(params, current_record_sets, interactive)
+            submitted = list(executor.map(lambda change: submit_dns_change(change[0], util), changes))
+
+    change_ids = [change_id for change_id, _ in submitted]
+    log.info('Waiting for {} DNS change(s) to be INSYNC...', len(change_ids))
+    wait_for_changes_insync(util, change_ids, sync_timeout, progress_reporter(log))
+    log.info('Success! DNS updated in hosted zone(s) {}. Cutover took {:.1f} seconds',
+             ', '.join(hosted_zone_ids), time.monotonic() - min(started for _, started in submitted))
 
 
 @root.command()
 @click.option('--aws-account-number', '-a', callback=validate_input_param, required=True)
 @click.option('--region', '-r', callback=validate_input_param, required=True)
+@click.option('--assume-role', '-ar', default=None)
 @click.option('--managed-name', '-n', callback=validate_input_param, required=True)
 @click.option('--hosted-zone-id', '-z', callback=validate_input_param, multiple=True, required=True)
-@click.option('--record-set', '-rs', callback=validate_input_param, required=True)
+@click.option('--record-set', '-rs', callback=validate_record_sets, multiple=True, required=True)
 @click.option('--ttl', default=60)
 @click.option('--interactive', '-i', default=True, type=bool)
-def promote(aws_account_number: str, region: str, managed_name: str, hosted_zone_id: tuple, record_set: str, ttl: str,
-            interactive: bool):
-    click.echo('{} Starting aurora-echo for {}'.format(log_prefix(), managed_name))
-    util = EchoUtil(region, aws_account_number)
+@click.option('--wait', is_flag=True)
+@click.option('--wait-timeout-minutes', default=DEFAULT_WAIT_TIMEOUT_MINUTES, type=click.FloatRange(min=0))
+@click.option('--tag-workers', '-w', default=DEFAULT_TAG_WORKERS, type=click.IntRange(min=1), envvar=TAG_WORKERS_ENVVAR)
+@click.option('--page-size', '-ps', default=DEFAULT_PAGE_SIZE, type=click.IntRange(20, 100), envvar=PAGE_SIZE_ENVVAR)
+@click.option('--cache-ttl', default=DEFAULT_CACHE_TTL, type=click.FloatRange(min=0), envvar=CACHE_TTL_ENVVAR)
+def promote(aws_account_number: str, region: str, assume_role: str, managed_name: str, hosted_zone_id: tuple, record_set: list,
+            ttl: int, interactive: bool, wait: bool, wait_timeout_minutes: float, tag_workers: int, page_size: int, cache_ttl: float):
+    util = EchoUtil(region, aws_account_number, tag_workers, page_size, cache_ttl, role_arn=assume_role)
+    return run_promote(util, managed_name, hosted_zone_id, record_set, ttl, interactive, wait, wait_timeout_minutes)
+
+
+def run_promote(util: EchoUtil, managed_name: str, hosted_zone_id: tuple, record_set: list, ttl: int, interactive: bool, wait: bool,
+                wait_timeout_minutes: float):
+    """
+    :return: True if an instance was promoted
+    """
+    log.info('Starting aurora-echo for {}', managed_name)
 
     # click doesn't allow mismatches between option and parameter names, so just for clarity, this is a tuple
     hosted_zone_ids = hosted_zone_id
+    record_sets = record_set
 
     found_instance = util.find_instance_in_stage(managed_name, ECHO_MODIFY_STAGE)
+    if found_instance and wait and found_instance['DBInstanceStatus'] != 'available':
+        log.info('Waiting for instance {} to be available...', found_instance['DBInstanceIdentifier'])
+        found_instance = wait_for_instance_available(util, found_instance['DBInstanceIdentifier'], wait_timeout_minutes * 60,
+                                                     progress_reporter(log))
     if found_instance and found_instance['DBInstanceStatus'] == 'available':
-        click.echo('{} Found promotable instance: {}'.format(log_prefix(), found_instance['DBInstanceIdentifier']))
+        log.info('Found promotable instance: {}', found_instance['DBInstanceIdentifier'])
         cluster_endpoint = found_instance['Endpoint']['Address']
 
-        update_dns(hosted_zone_ids, record_set, cluster_endpoint, ttl, interactive)
+        # tags only move once DNS is INSYNC everywhere, so a promote that times out here can just be run again
+        update_dns(hosted_zone_ids, record_sets, cluster_endpoint, ttl, interactive, util, wait_timeout_minutes * 60)
 
         old_promoted_instance = util.find_instance_in_stage(managed_name, ECHO_PROMOTE_STAGE)
         if old_promoted_instance:
-            click.echo('{} Retiring old instance: {}'.format(log_prefix(), old_promoted_instance['DBInstanceIdentifier']))
+            log.info('Retiring old instance: {}', old_promoted_instance['DBInstanceIdentifier'])
             util.add_stage_tag(managed_name, old_promoted_instance, ECHO_RETIRE_STAGE)
 
-        click.echo('{} Updating tag for promoted instance: {}'.format(log_prefix(), found_instance['DBInstanceIdentifier']))
+        log.info('Updating tag for promoted instance: {}', found_instance['DBInstanceIdentifier'])
         util.add_stage_tag(managed_name, found_instance, ECHO_PROMOTE_STAGE)
 
-        click.echo('{} Done!'.format(log_prefix()))
+        log.info('Done!')
+        return True
     else:
-        click.echo('{} No instance found in stage {} with status \'available\'. Not proceeding.'.format(log_prefix(), ECHO_MODIFY_STAGE))
+        log.info('No instance found in stage {} with status \'available\'. Not proceeding.', ECHO_MODIFY_STAGE)
@@ -0,0 +1,251 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+Client side rate limiting and a retry budget, shared by every thread and client in the process.
+
+Each attempt at a request, retries included, first takes a token from its bucket: the one for its service.Operation if
+that has a limit of its own, otherwise the one for its service. Limits apply to each region and account (role) on
+its own, or to the whole account for ACCOUNT_WIDE_SERVICES, so being throttled in one doesn't slow down the others. Buckets back off AIMD style: a throttling response
+halves the rate, at most once a second, and successful calls win it back at a request per second each second, up to
+the configured limit.
+
+Retries come out of one RetryBudget for the whole process. A needs-retry handler registered ahead of botocore's own
+retry handler vetoes the retry, by raising the error there and then, once the budget is spent or the request has had
+RETRY_MAX_ATTEMPTS attempts.
+"""
+
+import functools
+import logging
+import threading
+import time
+
+import click
+
+from aurora_echo import echo_clients
+from aurora_echo.echo_const import RETRY_MAX_ATTEMPTS, THROTTLE_ERROR_CODES
+
+logger = logging.getLogger(__name__)
+
+MINIMUM_RATE = 0.5  # requests per second, however much we're throttled
+RATE_DECREASE_FACTOR = 0.5
+RATE_INCREASE_PER_SECOND = 1.0
+RATE_DECREASE_INTERVAL = 1.0  # seconds. One burst of throttling should only slow us down once
+
+# services whose limits are per account rather than per region, e.g. Route 53 allows 5 requests per second per account
+ACCOUNT_WIDE_SERVICES = frozenset(['route53'])
+
+RETRY_BUDGET_MINIMUM_PER_SECOND = 1.0  # so a quiet process can still retry the odd failure
+RETRY_BUDGET_MAXIMUM = 10.0
+
+_lock = threading.Lock()
+_limiter = None
+
+
+class TokenBucket(object):
+    """
+    Hands out up to rate tokens a second, with bursts of up to a second's worth. Callers queue up in the order they
+    asked, each sleeping until its token is due.
+    """
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.rate = limit
+        self.tokens = limit
+        self.updated = time.monotonic()
+        self.decreased = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """:return: how long we waited"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(max(self.rate, 1), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1  # may go negative, which is the queue of callers ahead of us
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def succeeded(self):
+        with self._lock:
+            # each success adds 1/rate, so the rate climbs by RATE_INCREASE_PER_SECOND every second
+            self.rate = min(self.limit, self.rate + RATE_INCREASE_PER_SECOND / self.rate)
+
+    def throttled(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self.decreased >= RATE_DECREASE_INTERVAL:
+                self.rate = max(MINIMUM_RATE, self.rate * RATE_DECREASE_FACTOR)
+                self.decreased = now
+                logger.debug('Throttled, slowing down to %.1f requests per second', self.rate)
+
+
+class RetryBudget(object):
+    """
+    Each successful call earns ratio of a retry and each retry spends one, plus a trickle of
+    RETRY_BUDGET_MINIMUM_PER_SECOND. Savings are capped at RETRY_BUDGET_MAXIMUM.
+    """
+
+    def __init__(self, ratio: float):
+        self.ratio = ratio
+        self.balance = RETRY_BUDGET_MAXIMUM
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.balance = min(RETRY_BUDGET_MAXIMUM, self.balance + self.ratio)
+
+    def withdraw(self):
+        """:return: True if a retry is allowed"""
+        with self._lock:
+            now = time.monotonic()
+            self.balance = min(RETRY_BUDGET_MAXIMUM, self.balance + (now - self.updated) * RETRY_BUDGET_MINIMUM_PER_SECOND)
+            self.updated = now
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class RateLimiter(object):
+    """
+    The buckets and retry budget, and the botocore event handlers that use them.
+    """
+
+    def __init__(self, limits: dict, retry_budget: float):
+        """
+        :param limits: requests per second by service or service.Operation, e.g. {'rds': 20, 'route53.GetChange': 2}
+        :param retry_budget: retries allowed as a fraction of successful calls
+        """
+        self.limits = limits
+        self.buckets = {}  # (scope, key in limits) -> TokenBucket, see register for the scope
+        self.retry_budget = RetryBudget(retry_budget)
+        self._lock = threading.Lock()
+
+    def register(self, client, role_arn: str = None):
+        """
+        :param role_arn: the role the client was built for, i.e. which account it calls. None for our own credentials
+        """
+        service_name = client.meta.service_model.service_name
+        scope = (role_arn,) if service_name in ACCOUNT_WIDE_SERVICES else (client.meta.region_name, role_arn)
+        events = client.meta.events
+        # botocore's signer and retry handler are registered on the service's own events, which are emitted ahead of
+        # handlers for the bare event name. First in line there, so we wait for a token before the request is signed
+        # (a request that sat in the bucket after signing could go out with a stale signature), and veto retries
+        # before botocore schedules them
+        event_name = service_event_name(client)
+        events.register_first('request-created.' + event_name, functools.partial(self.before_attempt, scope, service_name),
+                              unique_id='aurora-echo-ratelimit-request-created')
+        events.register_first('needs-retry.' + event_name, functools.partial(self.needs_retry, scope, service_name),
+                              unique_id='aurora-echo-ratelimit-needs-retry')
+
+    def bucket(self, scope: tuple, service_name: str, operation_name: str):
+        """:return: the operation's bucket in scope, or None if neither it nor its service is limited"""
+        for key in ('{}.{}'.format(service_name, operation_name), service_name):
+            if self.limits.get(key):
+                with self._lock:
+                    bucket = self.buckets.get((scope, key))
+                    if bucket is None:
+                        bucket = self.buckets[(scope, key)] = TokenBucket(self.limits[key])
+                    return bucket
+        return None
+
+    def before_attempt(self, scope: tuple, service_name: str, operation_name: str, **kwargs):
+        bucket = self.bucket(scope, service_name, operation_name)
+        if bucket:
+            waited = bucket.acquire()
+            if waited:
+                logger.debug('Waited %.2f seconds to call %s.%s', waited, service_name, operation_name)
+
+    def needs_retry(self, scope: tuple, service_name: str, response, operation, attempts: int, caught_exception, **kwargs):
+        bucket = self.bucket(scope, service_name, operation.name)
+        if caught_exception is None and response[0].status_code < 300:
+            if bucket:
+                bucket.succeeded()
+            self.retry_budget.deposit()
+            return None
+
+        throttled = caught_exception is None and response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+        if throttled and bucket:
+            bucket.throttled()
+        if caught_exception is None and not throttled and response[0].status_code < 500:
+            return None  # a client error, botocore won't retry it either
+
+        if attempts >= RETRY_MAX_ATTEMPTS:
+            reason = 'after {} attempts'.format(attempts)
+        elif not self.retry_budget.withdraw():
+            reason = 'the retry budget is spent'
+        else:
+            return None  # leave it to botocore
+        logger.debug('Not retrying %s.%s, %s', service_name, operation.name, reason)
+        if caught_exception is not None:
+            raise caught_exception
+        from botocore.exceptions import ClientError
+        raise ClientError(response[1], operation.name)
+
+
+def service_event_name(client):
+    """
+    :return: what botocore's own handlers for the client's events are registered under, e.g. request-created.<this>:
+        the hyphenized service id, or the endpoint prefix for versions of botocore from before service ids
+    """
+    service_model = client.meta.service_model
+    service_id = getattr(service_model, 'service_id', None)
+    return service_id.hyphenize() if service_id else service_model.endpoint_prefix
+
+
+def parse_rate_limits(specs: tuple, defaults: dict):
+    """
+    :param specs: SERVICE[.OPERATION]=REQUESTS_PER_SECOND, e.g. rds=40 or rds.ListTagsForResource=10. 0 for no limit
+    :return: defaults updated with specs
+    """
+    limits = dict(defaults)
+    for spec in specs:
+        key, _, value = spec.partition('=')
+        try:
+            limit = float(value)
+        except ValueError:
+            limit = -1
+        if not key.strip() or limit < 0:
+            raise click.BadParameter('{!r} should be SERVICE[.OPERATION]=REQUESTS_PER_SECOND'.format(spec),
+                                     param_hint='--rate-limit')
+        limits[key.strip()] = limit
+    return limits
+
+
+def enable(limits: dict, retry_budget: float):
+    """
+    Limit every client from echo_clients, those already created included. Only the first call's settings count.
+
+    :return: the process's RateLimiter
+    """
+    global _limiter
+    with _lock:
+        if _limiter is None:
+            _limiter = RateLimiter(limits, retry_budget)
+            echo_clients.add_client_hook(_limiter.register)
+        return _limiter
@@ -22,60 +22,301 @@
 # THE SOFTWARE.
 ##
 
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
 import click
+from botocore.exceptions import ClientError
 
-from aurora_echo.echo_const import ECHO_RETIRE_COMMAND, ECHO_RETIRE_STAGE
-from aurora_echo.echo_util import EchoUtil, log_prefix_factory, validate_input_param
+from aurora_echo.echo_const import ECHO_RETIRE_COMMAND, ECHO_RETIRE_STAGE, DEFAULT_RETIRE_WORKERS, DEFAULT_TAG_WORKERS, \
+    TAG_WORKERS_ENVVAR, DEFAULT_PAGE_SIZE, PAGE_SIZE_ENVVAR, DEFAULT_CACHE_TTL, CACHE_TTL_ENVVAR, DEFAULT_WAIT_TIMEOUT_MINUTES, EXIT_RESUMABLE
+from aurora_echo.echo_clients import ensure_pool_connections
+from aurora_echo.echo_log import CommandLogger
+from aurora_echo.echo_util import EchoUtil, validate_input_param
+from aurora_echo.echo_wait import WaitTimeout, describe_cluster, describe_instance, progress_reporter, wait_for_cluster_deleted, \
+    wait_for_instance_deleted
 from aurora_echo.entry import root
 
-rds = boto3.client('rds')
+log = CommandLogger(ECHO_RETIRE_COMMAND)
 
-log_prefix = log_prefix_factory(ECHO_RETIRE_COMMAND)
 
-
-def delete_instance(instance: dict, interactive: bool):
-    instance_identifier = instance['DBInstanceIdentifier']
+def collect_delete_params(instance: dict):
+    """
+    :return: params for deleting the instance, and for deleting its cluster
+    """
     instance_params = {
-        'DBInstanceIdentifier': instance_identifier,
+        'DBInstanceIdentifier': instance['DBInstanceIdentifier'],
         'SkipFinalSnapshot': True,
     }
+    return instance_params, collect_cluster_delete_params(instance['DBClusterIdentifier'])
+
 
-    cluster_identifier = instance['DBClusterIdentifier']
-    cluster_params = {
+def collect_cluster_delete_params(cluster_identifier: str):
+    return {
         'DBClusterIdentifier': cluster_identifier,
         'SkipFinalSnapshot': True,
     }
 
-    click.echo('{} Parameters:'.format(log_prefix()))
-    click.echo(json.dumps(instance_params, indent=4, sort_keys=True))
-    click.echo(json.dumps(cluster_params, indent=4, sort_keys=True))
+
+def start_instance_delete(instance: dict, instance_params: dict, util: EchoUtil, managed_name: str):
+    """
+    Delete the instance, unless a run that was stopped or timed out already has. RDS refuses a second delete while the
+    first is under way, and once it's done the instance is gone altogether.
+    """
+    instance_identifier = instance_params['DBInstanceIdentifier']
+    if instance.get('DBInstanceStatus') == 'deleting':
+        log.info('Instance {} is already being deleted', instance_identifier)
+        return
+
+    try:
+        util.rds.delete_db_instance(**instance_params)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'InvalidDBInstanceState':
+            current = describe_instance(util, instance_identifier)
+            if current is not None and current['DBInstanceStatus'] != 'deleting':
+                raise  # busy with something else, e.g. a backup
+        elif code != 'DBInstanceNotFound':
+            raise
+        log.info('Instance {} is already being deleted', instance_identifier)
+    finally:
+        util.invalidate_inventory(managed_name)
+
+
+def start_cluster_delete(cluster_params: dict, util: EchoUtil):
+    """
+    Delete the cluster, unless a run that was stopped or timed out already has
+    """
+    cluster_identifier = cluster_params['DBClusterIdentifier']
+    try:
+        util.rds.delete_db_cluster(**cluster_params)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'InvalidDBClusterStateFault':
+            current = describe_cluster(util, cluster_identifier)
+            if current is not None and current['Status'] != 'deleting':
+                raise
+        elif code != 'DBClusterNotFoundFault':
+            raise
+        log.info('Cluster {} is already being deleted', cluster_identifier)
+
+
+def delete_instance(instance: dict, interactive: bool, util: EchoUtil, managed_name: str,
+                    wait_timeout: float = DEFAULT_WAIT_TIMEOUT_MINUTES * 60, wait_for_cluster: bool = False):
+    """
+    Delete the instance and then its cluster. Safe to run again after a timeout or being stopped part way: whatever
+    was already deleted, or is being deleted, is waited for rather than deleted again.
+
+    :param wait_timeout: how long to wait for the instance to be gone before deleting the cluster, which RDS refuses
+        to do while the instance is still deleting
+    :param wait_for_cluster: also wait, as long again, for the cluster to be gone
+    """
+    instance_params, cluster_params = collect_delete_params(instance)
+    instance_identifier = instance_params['DBInstanceIdentifier']
+    cluster_identifier = cluster_params['DBClusterIdentifier']
+
+    log.payload('Instance parameters:', instance_params, prompting=interactive)
+    log.payload('Cluster parameters:', cluster_params, prompting=interactive)
 
     if interactive:
         click.confirm('{} Ready to DELETE/DESTROY/REMOVE this database instance and cluster '
-                      'along with ALL AUTOMATED BACKUPS?'.format(log_prefix()), abort=True)  # exits entirely if no
+                      'along with ALL AUTOMATED BACKUPS?'.format(log.prefix()), abort=True)  # exits entirely if no
+
+    # delete the instance first so the cluster is empty, otherwise it'll fail. Once the instance is gone the cluster
+    # can only be found by its own tag, see find_orphaned_clusters
+    util.add_cluster_stage_tag(managed_name, cluster_identifier, ECHO_RETIRE_STAGE)
+    start_instance_delete(instance, instance_params, util, managed_name)
+    log.info('Waiting for instance {} to be deleted...', instance_identifier)
+    wait_for_instance_deleted(util, instance_identifier, wait_timeout, progress_reporter(log))
+    delete_cluster(cluster_params, util, wait_timeout, wait_for_cluster)
+
+
+def delete_cluster(cluster_params: dict, util: EchoUtil, wait_timeout: float, wait_for_cluster: bool):
+    start_cluster_delete(cluster_params, util)
+    if wait_for_cluster:
+        log.info('Waiting for cluster {} to be deleted...', cluster_params['DBClusterIdentifier'])
+        wait_for_cluster_deleted(util, cluster_params['DBClusterIdentifier'], wait_timeout, progress_reporter(log))
+
+
+def find_orphaned_clusters(util: EchoUtil, managed_name: str, instances: list = ()):
+    """
+    :param instances: retired instances already found, whose clusters will go along with them
+    :return: the retired clusters whose instance is already gone, left behind by a run stopped between deleting the
+        instance and deleting the cluster
+    """
+    known = set(instance['DBClusterIdentifier'] for instance in instances)
+    orphans = []
+    for cluster_identifier in util.find_clusters_in_stage(managed_name, ECHO_RETIRE_STAGE):
+        if cluster_identifier in known:
+            continue
+        cluster = describe_cluster(util, cluster_identifier)
+        if cluster is not None and not cluster.get('DBClusterMembers'):
+            orphans.append(cluster)
+    return orphans
+
+
+def delete_orphaned_clusters(clusters: list, interactive: bool, util: EchoUtil,
+                             wait_timeout: float = DEFAULT_WAIT_TIMEOUT_MINUTES * 60, wait_for_cluster: bool = False):
+    for cluster in clusters:
+        cluster_params = collect_cluster_delete_params(cluster['DBClusterIdentifier'])
+        log.payload('Cluster parameters:', cluster_params, prompting=interactive)
+        if interactive:
+            click.confirm('{} Ready to DELETE/DESTROY/REMOVE this database cluster, whose instance is already gone, '
+                          'along with ALL AUTOMATED BACKUPS?'.format(log.prefix()), abort=True)  # exits entirely if no
+        delete_cluster(cluster_params, util, wait_timeout, wait_for_cluster)
+
+
+def run_delete_steps(steps: list):
+    """
+    Carry out (resource, identifier, delete, wait) steps in order, stopping at the first that fails
+
+    :return: a result for each of the resources that we got to: what happened, how long it took and the error if it
+        failed
+    """
+    results = []
+    for resource, identifier, delete, wait in steps:
+        started = time.monotonic()
+        try:
+            delete()
+            wait()
+            log.info('Deleted {} {}', resource, identifier)
+            error = None
+        except Exception as e:
+            error = e
+        results.append({'resource': resource, 'identifier': identifier, 'elapsed': time.monotonic() - started, 'error': error})
+        if error:
+            break  # the cluster can't go while its instance is still there
+    return results
 
-    # delete the instance first so the cluster is empty, otherwise it'll fail
-    rds.delete_db_instance(**instance_params)
-    rds.delete_db_cluster(**cluster_params)
+
+def cluster_delete_step(cluster_params: dict, util: EchoUtil, timeout: float):
+    cluster_identifier = cluster_params['DBClusterIdentifier']
+    return ('cluster', cluster_identifier, lambda: start_cluster_delete(cluster_params, util),
+            lambda: wait_for_cluster_deleted(util, cluster_identifier, timeout))
+
+
+def delete_instance_pipeline(instance: dict, util: EchoUtil, managed_name: str, timeout: float):
+    """
+    Delete the instance, wait for it to be gone, then delete its cluster and wait for that to be gone too. Each
+    instance being retired gets one of these, so every cluster goes as soon as its own instance has.
+    """
+    instance_params, cluster_params = collect_delete_params(instance)
+    instance_identifier = instance_params['DBInstanceIdentifier']
+
+    def delete():
+        util.add_cluster_stage_tag(managed_name, cluster_params['DBClusterIdentifier'], ECHO_RETIRE_STAGE)
+        start_instance_delete(instance, instance_params, util, managed_name)
+
+    return run_delete_steps([
+        ('instance', instance_identifier, delete, lambda: wait_for_instance_deleted(util, instance_identifier, timeout)),
+        cluster_delete_step(cluster_params, util, timeout),
+    ])
+
+
+def delete_all_instances(instances: list, interactive: bool, util: EchoUtil, managed_name: str, timeout: float,
+                         orphaned_clusters: list = (), max_workers: int = DEFAULT_RETIRE_WORKERS):
+    """
+    Retire the instances, each one's instance and then cluster in its own pipeline, along with any orphaned clusters,
+    up to max_workers pipelines at a time, and report how long each resource took or why it failed.
+
+    :raises click.ClickException: if anything couldn't be deleted, with exit status EXIT_RESUMABLE if that was only
+        down to waiting too long
+    """
+    orphan_params = [collect_cluster_delete_params(cluster['DBClusterIdentifier']) for cluster in orphaned_clusters]
+    log.payload('Parameters:', [params for instance in instances for params in collect_delete_params(instance)] + orphan_params,
+                prompting=interactive)
+
+    if interactive:
+        click.confirm('{} Ready to DELETE/DESTROY/REMOVE these {} database instances and {} clusters '
+                      'along with ALL AUTOMATED BACKUPS?'.format(log.prefix(), len(instances), len(instances) + len(orphan_params)),
+                      abort=True)  # exits entirely if no
+
+    pipelines = [lambda instance=instance: delete_instance_pipeline(instance, util, managed_name, timeout) for instance in instances]
+    pipelines += [lambda params=params: run_delete_steps([cluster_delete_step(params, util, timeout)]) for params in orphan_params]
+    if not pipelines:
+        return
+    workers = min(max_workers, len(pipelines))
+    ensure_pool_connections(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = [result for pipeline in executor.map(lambda pipeline: pipeline(), pipelines) for result in pipeline]
+
+    log.info('Retirement summary:')
+    for result in results:
+        log.info('  {:<8}  {:<40}  {:<7}  {:>7.1f}s{}', result['resource'], result['identifier'],
+                 'failed' if result['error'] else 'deleted', result['elapsed'],
+                 '  {}'.format(result['error']) if result['error'] else '')
+
+    failures = [result for result in results if result['error']]
+    if failures:
+        error = click.ClickException('{} of {} instances and clusters could not be retired'.format(len(failures), len(pipelines)))
+        if all(isinstance(result['error'], WaitTimeout) for result in failures):
+            error.exit_code = EXIT_RESUMABLE
+        raise error
 
 
 @root.command()
 @click.option('--aws-account-number', '-a', callback=validate_input_param, required=True)
 @click.option('--region', '-r', callback=validate_input_param, required=True)
+@click.option('--assume-role', '-ar', default=None)
 @click.option('--managed-name', '-n', callback=validate_input_param, required=True)
 @click.option('--interactive', '-i', default=True, type=bool)
-def retire(aws_account_number: str, region: str, managed_name: str, interactive: bool):
-    click.echo('{} Starting aurora-echo for {}'.format(log_prefix(), managed_name))
-    util = EchoUtil(region, aws_account_number)
+@click.option('--all', 'retire_all', is_flag=True)
+@click.option('--wait', is_flag=True, help='Also wait for the cluster to be deleted.')
+@click.option('--wait-timeout-minutes', default=DEFAULT_WAIT_TIMEOUT_MINUTES, type=click.FloatRange(min=0), show_default=True,
+              help='How long to wait for the instance to be deleted before deleting its cluster, which always happens, '
+                   'and with --wait for the cluster too. Exits with status 3 when it runs out; run again to carry on.')
+@click.option('--max-workers', '-j', default=DEFAULT_RETIRE_WORKERS, type=click.IntRange(min=1), show_default=True,
+              help='With --all, how many instances and clusters to delete and wait for at the same time.')
+@click.option('--tag-workers', '-w', default=DEFAULT_TAG_WORKERS, type=click.IntRange(min=1), envvar=TAG_WORKERS_ENVVAR)
+@click.option('--page-size', '-ps', default=DEFAULT_PAGE_SIZE, type=click.IntRange(20, 100), envvar=PAGE_SIZE_ENVVAR)
+@click.option('--cache-ttl', default=DEFAULT_CACHE_TTL, type=click.FloatRange(min=0), envvar=CACHE_TTL_ENVVAR)
+def retire(aws_account_number: str, region: str, assume_role: str, managed_name: str, interactive: bool, retire_all: bool,
+           wait: bool, wait_timeout_minutes: float, max_workers: int, tag_workers: int, page_size: int, cache_ttl: float):
+    util = EchoUtil(region, aws_account_number, tag_workers, page_size, cache_ttl, role_arn=assume_role)
+    return run_retire(util, managed_name, interactive, retire_all, wait, wait_timeout_minutes, max_workers)
+
+
+def run_retire(util: EchoUtil, managed_name: str, interactive: bool, retire_all: bool, wait: bool, wait_timeout_minutes: float,
+               max_workers: int = DEFAULT_RETIRE_WORKERS):
+    """
+    :param retire_all: retire every instance in the retired stage, rather than just the newest
+    :param max_workers: with retire_all, how many instances and clusters to retire at the same time
+    :return: True if an instance, or a cluster left behind by an earlier run, was retired
+    """
+    log.info('Starting aurora-echo for {}', managed_name)
+
+    if retire_all:
+        found_instances = util.find_instances_in_stage(managed_name, ECHO_RETIRE_STAGE)
+        orphaned_clusters = find_orphaned_clusters(util, managed_name, found_instances)
+        if found_instances or orphaned_clusters:
+            log.info('Found {} instances ready for retirement: {}', len(found_instances),
+                     ', '.join(instance['DBInstanceIdentifier'] for instance in found_instances))
+            if orphaned_clusters:
+                log.info('Found {} clusters whose instance was already retired: {}', len(orphaned_clusters),
+                         ', '.join(cluster['DBClusterIdentifier'] for cluster in orphaned_clusters))
+            delete_all_instances(found_instances, interactive, util, managed_name, wait_timeout_minutes * 60, orphaned_clusters,
+                                 max_workers)
+
+            log.info('Done!')
+            return True
+        log.info('No instances found in stage {}. Not proceeding.', ECHO_RETIRE_STAGE)
+        return False
 
     found_instance = util.find_instance_in_stage(managed_name, ECHO_RETIRE_STAGE)
     if found_instance:
-        click.echo('{} Found instance ready for retirement: {}'.format(log_prefix(), found_instance['DBInstanceIdentifier']))
-        delete_instance(found_instance, interactive)
+        log.info('Found instance ready for retirement: {}', found_instance['DBInstanceIdentifier'])
+        delete_instance(found_instance, interactive, util, managed_name, wait_timeout_minutes * 60, wait_for_cluster=wait)
+
+        log.info('Done!')
+        return True
+
+    orphaned_clusters = find_orphaned_clusters(util, managed_name)
+    if orphaned_clusters:
+        log.info('Found {} clusters whose instance was already retired: {}', len(orphaned_clusters),
+                 ', '.join(cluster['DBClusterIdentifier'] for cluster in orphaned_clusters))
+        delete_orphaned_clusters(orphaned_clusters, interactive, util, wait_timeout_minutes * 60, wait_for_cluster=wait)
+
+        log.info('Done!')
+        return True
 
-        click.echo('{} Done!'.format(log_prefix()))
-    else:
-        click.echo('{} No instance found in stage {}. Not proceeding.'.format(log_prefix(), ECHO_RETIRE_STAGE))
+    log.info('No instance found in stage {}. Not proceeding.', ECHO_RETIRE_STAGE)
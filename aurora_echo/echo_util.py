@@ -22,22 +22,23 @@
 # THE SOFTWARE.
 ##
 
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
-import boto3
 import click
 from botocore.exceptions import ClientError
 from dateutil.relativedelta import relativedelta
 
-from aurora_echo.echo_const import ECHO_MANAGEMENT_TAG_INDICATOR
+from aurora_echo.echo_cache import InventoryCache
+from aurora_echo.echo_clients import get_client, ensure_pool_connections
+from aurora_echo.echo_const import ECHO_MANAGEMENT_TAG_INDICATOR, DEFAULT_TAG_WORKERS, DISCOVERY_TAGGING, DISCOVERY_SCAN, \
+    DEFAULT_PAGE_SIZE, DEFAULT_CACHE_TTL
 
-rds = boto3.client('rds')
+logger = logging.getLogger(__name__)
 
-
-def log_prefix_factory(command_name: str):
-    def log_prefix():
-        return '{0:%Y-%m-%d %H:%M:%S %Z} [{1}]'.format(datetime.now(timezone.utc), command_name)
-    return log_prefix
+# describe_db_instances accepts at most this many values per filter
+DESCRIBE_FILTER_MAX_VALUES = 100
 
 
 def validate_input_param(ctx, param, value):
@@ -50,15 +51,54 @@ class EchoUtil(object):
     """
      General utilities, such as constructing tags, finding DB instances under a given managed name or stage,
      and verifying age of existing instances. Initialize with account number and region.
+
+     Managed instances are discovered through the Resource Groups Tagging API by default, which only returns the
+     instances carrying our stage tag. If that isn't available (e.g. missing tag:GetResources permission) we fall back
+     to scanning every instance in the account and looking up its tags.
+
+     Either way instances are read a page (page_size records) at a time and handed out as each page arrives, so
+     callers that only need the first match don't pay for the rest of the account. Tags are looked up concurrently
+     with up to tag_workers threads, so the RDS client's connection pool is sized to match; otherwise the workers would
+     just queue up on HTTP connections.
+
+     Whatever a search turns up is remembered for the life of this object, i.e. one command run, so every stage lookup
+     after the first costs nothing. Stage changes made through add_stage_tag are applied to that snapshot as well.
+     With a cache_ttl (seconds), searches are also shared between runs through an InventoryCache; see
+     invalidate_inventory. discover_inventory searches for many managed names in one go, after which threads can
+     share the one EchoUtil as long as each managed name is only handled by one of them.
     """
 
-    def __init__(self, region: str, account_number: str):
+    def __init__(self, region: str, account_number: str, tag_workers: int = DEFAULT_TAG_WORKERS,
+                 page_size: int = DEFAULT_PAGE_SIZE, cache_ttl: float = DEFAULT_CACHE_TTL,
+                 discovery: str = DISCOVERY_TAGGING, role_arn: str = None):
         self.region = region
         self.account_number = account_number
+        self.role_arn = role_arn  # assumed for every call, when the account isn't the one our credentials are for
+        self.tag_workers = tag_workers
+        self.page_size = page_size
+        self.cache = InventoryCache(cache_ttl) if cache_ttl else None
+        self.discovery = discovery
+        self.inventory = {}  # managed name -> [(instance, current_stage_of_instance)], filled in by completed searches
+        ensure_pool_connections(tag_workers)
+
+    @property
+    def rds(self):
+        return get_client('rds', self.region, self.role_arn)
+
+    @property
+    def tagging(self):
+        return get_client('resourcegroupstaggingapi', self.region, self.role_arn)
+
+    @property
+    def route53(self):
+        return get_client('route53', role_arn=self.role_arn)
 
     def construct_rds_arn(self, db_instance_identifier: str):
         return 'arn:aws:rds:{}:{}:db:{}'.format(self.region, self.account_number, db_instance_identifier)
 
+    def construct_rds_cluster_arn(self, db_cluster_identifier: str):
+        return 'arn:aws:rds:{}:{}:cluster:{}'.format(self.region, self.account_number, db_cluster_identifier)
+
     def construct_iam_arn(self, iam_role_name: str):
         return 'arn:aws:iam::{}:role/{}'.format(self.account_number, iam_role_name)
 
@@ -89,49 +129,255 @@ class EchoUtil(object):
         tags = [
             {'Key': self.construct_stage_tag(managed_name), 'Value': next_stage},
         ]
-        response = rds.add_tags_to_resource(ResourceName=resource_arn, Tags=tags)
+        try:
+            response = self.rds.add_tags_to_resource(ResourceName=resource_arn, Tags=tags)
+        finally:
+            self.invalidate_inventory(managed_name, forget=False)
+        self.update_inventory_stage(managed_name, instance, next_stage)
         return response
 
-    def find_managed_instances(self, managed_name: str):
-        stage_tag = self.construct_stage_tag(managed_name)
-        managed_instances_and_tags = []
+    def add_cluster_stage_tag(self, managed_name: str, cluster_identifier: str, next_stage: str):
+        """
+        Tag the cluster itself with the stage, e.g. so a retired cluster can still be found once its instance is gone
+        """
+        tags = [
+            {'Key': self.construct_stage_tag(managed_name), 'Value': next_stage},
+        ]
+        return self.rds.add_tags_to_resource(ResourceName=self.construct_rds_cluster_arn(cluster_identifier), Tags=tags)
+
+    def invalidate_inventory(self, managed_name: str, forget: bool = True):
+        """
+        Call after anything that creates, deletes or re-tags a managed instance (whether or not it succeeded), so no
+        later run acts on a stage that is no longer true.
+
+        :param forget: also drop what this run remembers. Not needed when the change was applied to it in place
+        """
+        if forget:
+            self.inventory.pop(managed_name, None)
+        if self.cache:
+            self.cache.invalidate(self.account_number, self.region, self.construct_stage_tag(managed_name))
+
+    def update_inventory_stage(self, managed_name: str, instance: dict, next_stage: str):
+        managed_instances_and_tags = self.inventory.get(managed_name)
+        if managed_instances_and_tags is None:
+            return  # nothing remembered yet, the next search will see the new tag
+
+        for i, (known_instance, _) in enumerate(managed_instances_and_tags):
+            if known_instance['DBInstanceIdentifier'] == instance['DBInstanceIdentifier']:
+                managed_instances_and_tags[i] = (known_instance, next_stage)
+                break
+        else:
+            managed_instances_and_tags.append((instance, next_stage))
+
+    def fetch_tags(self, instance: dict):
+        return self.fetch_resource_tags(self.construct_rds_arn(instance['DBInstanceIdentifier']))
+
+    def fetch_cluster_tags(self, cluster: dict):
+        return self.fetch_resource_tags(self.construct_rds_cluster_arn(cluster['DBClusterIdentifier']))
+
+    def fetch_resource_tags(self, arn: str):
+        try:
+            tags = self.rds.list_tags_for_resource(ResourceName=arn)
+        except ClientError:
+            raise click.UsageError('Unable to list tags for resource at {!r}. Check your account number and region and try again.'.format(arn))
+        return tags['TagList']
+
+    def iter_managed_instances(self, managed_name: str):
+        """
+        Lazily yield (instance, current_stage_of_instance) for every instance managed under the given name.
+
+        The first search that runs to completion is remembered and replayed for later calls. A search abandoned part
+        way (e.g. instance_too_new finding an answer early) isn't, since it hasn't seen everything.
+        """
+        managed_instances_and_tags = self.inventory.get(managed_name)
+        if managed_instances_and_tags is not None:
+            logger.debug('Inventory cache hit for %r: %d managed instances', managed_name, len(managed_instances_and_tags))
+            yield from list(managed_instances_and_tags)  # copy, add_stage_tag may change it while we're iterating
+            return
+
+        if self.cache:
+            yield from self.load_or_discover_managed_instances(managed_name)
+            return
+
+        logger.debug('Inventory cache miss for %r, searching', managed_name)
+        discovered = []
+        for instance_and_stage in self.discover_managed_instances(managed_name):
+            discovered.append(instance_and_stage)
+            yield instance_and_stage
+
+        logger.debug('Remembering %d managed instances for %r', len(discovered), managed_name)
+        self.inventory[managed_name] = discovered
+
+    def load_or_discover_managed_instances(self, managed_name: str):
+        """
+        Read the search result from the on-disk cache, or search and store it there. The entry stays locked until the
+        search finishes, so parallel runs wait for it instead of all searching. That means we can't stop part way.
+        """
+        path = self.cache.entry_path(self.account_number, self.region, self.construct_stage_tag(managed_name))
+        with self.cache.locked(path):
+            managed_instances_and_tags = self.cache.load(path)
+            if managed_instances_and_tags is not None:
+                logger.debug('Inventory disk cache hit for %r: %d managed instances', managed_name, len(managed_instances_and_tags))
+            else:
+                logger.debug('Inventory disk cache miss for %r, searching', managed_name)
+                managed_instances_and_tags = list(self.discover_managed_instances(managed_name))
+                self.cache.store(path, managed_instances_and_tags)
+
+        self.inventory[managed_name] = managed_instances_and_tags
+        yield from list(managed_instances_and_tags)
 
-        # get list of instances
-        response = rds.describe_db_instances()
+    def discover_managed_instances(self, managed_name: str):
+        for instance, _, stage in self.discover_tagged_instances([self.construct_stage_tag(managed_name)]):
+            yield instance, stage
 
-        # get all their tags
-        for instance in response['DBInstances']:
+    def discover_tagged_instances(self, stage_tags: list):
+        """
+        Yield (instance, stage_tag, current_stage_of_instance) for every instance carrying one of the stage tags.
+        """
+        if self.discovery == DISCOVERY_TAGGING:
+            yielded = False
             try:
-                arn = self.construct_rds_arn(instance['DBInstanceIdentifier'])
-                tags = rds.list_tags_for_resource(ResourceName=arn)
-            except ClientError:
-                raise click.UsageError('Unable to list tags for resource at {!r}. Check your account number and region and try again.'.format(arn))
-            tag_list = tags['TagList']
-            for tag in tag_list:
-                # does it have our managed tag?
-                if tag['Key'] == stage_tag:
-                    # (instance, current_stage_of_instance)
-                    managed_instances_and_tags.append((instance, tag['Value']))
-                    break  # don't keep iterating through the tag list, we're done with this instance
-
-        return managed_instances_and_tags
+                for instance_and_stage in self.iter_instances_by_tag(stage_tags):
+                    yielded = True
+                    yield instance_and_stage
+                return
+            except ClientError as e:
+                if yielded or e.operation_name != 'GetResources':
+                    raise  # too late to start over without handing out duplicates, or RDS itself failing
+                logger.warning('Unable to search resource tags (%s). Falling back to scanning all instances.', e.response['Error']['Code'])
+                self.discovery = DISCOVERY_SCAN  # don't bother trying again for the rest of this run
 
-    def find_instance_in_stage(self, managed_name: str, desired_stage: str):
-        managed_instances_and_tags = self.find_managed_instances(managed_name)
-        # filter on the stage we want
-        instances_in_stage = [instance for instance, tag in managed_instances_and_tags if tag == desired_stage]
+        yield from self.scan_instances(stage_tags)
+
+    def find_managed_instances(self, managed_name: str):
+        return list(self.iter_managed_instances(managed_name))
+
+    def discover_inventory(self, managed_names: list):
+        """
+        Search for the instances of all of the managed names in one pass, rather than one search each, and remember
+        them just as separate searches would have been.
+        """
+        stage_tags = {self.construct_stage_tag(managed_name): managed_name for managed_name in managed_names}
+        found = {managed_name: [] for managed_name in managed_names}
+        for instance, stage_tag, stage in self.discover_tagged_instances(list(stage_tags)):
+            found[stage_tags[stage_tag]].append((instance, stage))
+
+        for stage_tag, managed_name in stage_tags.items():
+            logger.debug('Remembering %d managed instances for %r', len(found[managed_name]), managed_name)
+            self.inventory[managed_name] = found[managed_name]
+            if self.cache:
+                path = self.cache.entry_path(self.account_number, self.region, stage_tag)
+                with self.cache.locked(path):
+                    self.cache.store(path, found[managed_name])
+        return found
+
+    def iter_instances_by_tag(self, stage_tags: list):
+        """
+        Ask the tagging API which instances carry one of our stage tags, then describe only those.
+
+        The tagging API's view of tag values can lag behind, so the stage of each match is read back from RDS rather
+        than trusted from the search results.
+        """
+        params = {'ResourceTypeFilters': ['rds:db'], 'ResourcesPerPage': self.page_size}
+        if len(stage_tags) == 1:
+            params['TagFilters'] = [{'Key': stage_tags[0]}]  # separate tag filters must all match, so only for one
+        wanted = set(stage_tags)
+        while True:
+            response = self.tagging.get_resources(**params)
+
+            # arn:aws:rds:<region>:<account>:db:<identifier>
+            identifiers = [resource['ResourceARN'].split(':', 6)[6] for resource in response['ResourceTagMappingList']
+                           if any(tag['Key'] in wanted for tag in resource.get('Tags', []))]
+            for i in range(0, len(identifiers), DESCRIBE_FILTER_MAX_VALUES):
+                filters = [{'Name': 'db-instance-id', 'Values': identifiers[i:i + DESCRIBE_FILTER_MAX_VALUES]}]
+                for instances in self.iter_instance_pages(Filters=filters):
+                    yield from self.match_stage_tags(instances, stage_tags)
+
+            if not response.get('PaginationToken'):
+                break
+            params['PaginationToken'] = response['PaginationToken']
+
+    def scan_instances(self, stage_tags: list):
+        """
+        Look at the tags of every instance in the account to find the ones carrying one of our stage tags.
+        """
+        for instances in self.iter_instance_pages():
+            yield from self.match_stage_tags(instances, stage_tags)
 
+    def iter_instance_pages(self, **kwargs):
+        paginator = self.rds.get_paginator('describe_db_instances')
+        for page in paginator.paginate(PaginationConfig={'PageSize': self.page_size}, **kwargs):
+            yield page['DBInstances']
+
+    def match_stage_tags(self, instances: list, stage_tags: list, fetch_tags=None):
+        """
+        :param fetch_tags: looks up the tags of one of the instances, fetch_tags by default. fetch_cluster_tags to match
+            clusters instead
+        """
+        # get all their tags. map() hands results back in submission order, so the output order is deterministic
+        # no matter which lookups finish first, and the first failed lookup is re-raised here
+        wanted = set(stage_tags)
+        with ThreadPoolExecutor(max_workers=self.tag_workers) as executor:
+            for instance, tag_list in zip(instances, executor.map(fetch_tags or self.fetch_tags, instances)):
+                for tag in tag_list:
+                    # does it have one of our managed tags? An instance only ever belongs to one managed name
+                    if tag['Key'] in wanted:
+                        # (instance, stage tag, current_stage_of_instance)
+                        yield instance, tag['Key'], tag['Value']
+                        break  # don't keep iterating through the tag list, we're done with this instance
+
+    def find_instance_in_stage(self, managed_name: str, desired_stage: str):
         # TODO complain about too many managed instances?
-        if instances_in_stage:
-            # choose most recent created time. Fun fact: instances only have the InstanceCreateTime field after creation
-            sorted_instances = sorted(instances_in_stage, key=lambda inst: inst.get('InstanceCreateTime'), reverse=True)
-            chosen_instance = sorted_instances[0]
-            click.echo('Found instance in stage {}: {}'.format(desired_stage, chosen_instance['DBInstanceIdentifier']))
+        chosen_instance = None
+        for instance, stage in self.iter_managed_instances(managed_name):
+            # filter on the stage we want, keeping the most recent created time.
+            # Fun fact: instances only have the InstanceCreateTime field after creation, so one without it is the newest
+            if stage == desired_stage and (chosen_instance is None or is_newer_instance(instance, chosen_instance)):
+                chosen_instance = instance
+
+        if chosen_instance:
+            logger.info('Found instance in stage %s: %s', desired_stage, chosen_instance['DBInstanceIdentifier'])
             return chosen_instance
 
+    def find_clusters_in_stage(self, managed_name: str, desired_stage: str):
+        """
+        Clusters are only tagged with their stage once they're retired (see add_cluster_stage_tag), and never searched
+        often, so unlike instances they aren't remembered.
+
+        :return: the identifiers of every cluster whose own stage tag is desired_stage
+        """
+        stage_tag = self.construct_stage_tag(managed_name)
+        if self.discovery == DISCOVERY_TAGGING:
+            try:
+                params = {'ResourceTypeFilters': ['rds:cluster'], 'TagFilters': [{'Key': stage_tag, 'Values': [desired_stage]}],
+                          'ResourcesPerPage': self.page_size}
+                identifiers = []
+                while True:
+                    response = self.tagging.get_resources(**params)
+                    # arn:aws:rds:<region>:<account>:cluster:<identifier>
+                    identifiers.extend(resource['ResourceARN'].split(':', 6)[6] for resource in response['ResourceTagMappingList'])
+                    if not response.get('PaginationToken'):
+                        return identifiers
+                    params['PaginationToken'] = response['PaginationToken']
+            except ClientError as e:
+                logger.warning('Unable to search resource tags (%s). Falling back to scanning all clusters.', e.response['Error']['Code'])
+                self.discovery = DISCOVERY_SCAN
+
+        identifiers = []
+        paginator = self.rds.get_paginator('describe_db_clusters')
+        for page in paginator.paginate(PaginationConfig={'PageSize': self.page_size}):
+            for cluster, _, stage in self.match_stage_tags(page['DBClusters'], [stage_tag], self.fetch_cluster_tags):
+                if stage == desired_stage:
+                    identifiers.append(cluster['DBClusterIdentifier'])
+        return identifiers
+
+    def find_instances_in_stage(self, managed_name: str, desired_stage: str):
+        """:return: every instance in the stage, in the order they were found"""
+        return [instance for instance, stage in self.iter_managed_instances(managed_name) if stage == desired_stage]
+
     def instance_too_new(self, managed_name: str, min_age_in_hours: float):
         """
-        Have we already made a database in the last n hours?
+        Have we already made a database in the last n hours? Stops looking at the first instance that is.
 
         :param managed_name: managed name
         :param min_age_in_hours: how many hours old is too old?
@@ -141,16 +387,23 @@ class EchoUtil(object):
         today = datetime.now(timezone.utc)
         newest_allowed_date = today - relativedelta(hours=min_age_in_hours)
 
-        instance_list = self.find_managed_instances(managed_name)
-        if instance_list:
-            instances = [x[0] for x in instance_list]  # we don't care about tags, but we got tags
-            for instance in instances:
-                if instance['DBInstanceStatus'] == 'creating':
-                    return True  # an instance that is still spinning up falls under the category of "too new"
-                if instance['InstanceCreateTime'] > newest_allowed_date:
-                    return True  # instance was created too recently
+        found_any = False
+        for instance, _ in self.iter_managed_instances(managed_name):  # we don't care about tags, but we got tags
+            found_any = True
+            if instance['DBInstanceStatus'] == 'creating':
+                return True  # an instance that is still spinning up falls under the category of "too new"
+            if instance['InstanceCreateTime'] > newest_allowed_date:
+                return True  # instance was created too recently
 
-        else:
-            click.echo('No managed instances found under name {!r}.'.format(managed_name))
+        if not found_any:
+            logger.info('No managed instances found under name %r.', managed_name)
 
         return False
+
+
+def is_newer_instance(instance: dict, other: dict):
+    create_time = instance.get('InstanceCreateTime')
+    other_create_time = other.get('InstanceCreateTime')
+    if create_time is None:
+        return other_create_time is not None
+    return other_create_time is not None and create_time > other_create_time
@@ -0,0 +1,166 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+Waiting for RDS to finish doing something.
+
+Polls back off exponentially from DEFAULT_INITIAL_DELAY up to DEFAULT_MAX_DELAY seconds, with jitter so that many runs
+started by the same cron tick don't all poll at the same moment, and give up with WaitTimeout after the timeout.
+"""
+
+import logging
+import random
+import time
+
+import click
+from botocore.exceptions import ClientError
+
+from aurora_echo.echo_const import EXIT_RESUMABLE
+from aurora_echo.echo_util import EchoUtil
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INITIAL_DELAY = 5
+DEFAULT_MAX_DELAY = 60
+
+# Route 53 changes usually go INSYNC within a minute, so check on them more often
+DNS_INITIAL_DELAY = 2
+DNS_MAX_DELAY = 10
+
+
+class WaitTimeout(click.ClickException):
+    """Gave up waiting for a resource to get into the state we want. Exits with EXIT_RESUMABLE"""
+
+    exit_code = EXIT_RESUMABLE
+
+    def __init__(self, description: str, timeout: float):
+        super().__init__('Timed out after {:.0f} seconds waiting for {}. Run the command again to resume.'
+                         .format(timeout, description))
+        self.description = description
+        self.timeout = timeout
+
+
+def backoff_delays(initial_delay: float, max_delay: float):
+    """Exponentially growing delays, each picked at random from the upper half of the current step"""
+    delay = initial_delay
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * 2, max_delay)
+
+
+def progress_reporter(log):
+    """:return: a progress callback for wait_until that logs through the command's CommandLogger"""
+    def report(description: str, status: str, elapsed: float):
+        log.info('Still waiting for {} ({}, {:.0f} seconds so far)', description, status, elapsed)
+    return report
+
+
+def wait_until(description: str, poll, timeout: float, progress=None, initial_delay: float = DEFAULT_INITIAL_DELAY,
+               max_delay: float = DEFAULT_MAX_DELAY):
+    """
+    Call poll() until it says it's done, backing off in between.
+
+    :param poll: returns (result, status). The wait is over as soon as result is not None, and status describes
+        where things are at for progress reports
+    :param progress: called with (description, status, elapsed seconds) after every poll that wasn't done yet
+    :return: the result
+    :raises WaitTimeout: if it's not done within timeout seconds
+    """
+    started = time.monotonic()
+    for delay in backoff_delays(initial_delay, max_delay):
+        result, status = poll()
+        elapsed = time.monotonic() - started
+        if result is not None:
+            logger.debug('Done waiting for %s after %.1f seconds', description, elapsed)
+            return result
+        if elapsed >= timeout:
+            raise WaitTimeout(description, timeout)
+        if progress:
+            progress(description, status, elapsed)
+        time.sleep(min(delay, timeout - elapsed))
+
+
+def describe_instance(util: EchoUtil, instance_identifier: str):
+    """:return: the instance, or None if it doesn't exist (any more)"""
+    try:
+        return util.rds.describe_db_instances(DBInstanceIdentifier=instance_identifier)['DBInstances'][0]
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'DBInstanceNotFound':
+            return None
+        raise
+
+
+def describe_cluster(util: EchoUtil, cluster_identifier: str):
+    """:return: the cluster, or None if it doesn't exist (any more)"""
+    try:
+        return util.rds.describe_db_clusters(DBClusterIdentifier=cluster_identifier)['DBClusters'][0]
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'DBClusterNotFoundFault':
+            return None
+        raise
+
+
+def wait_for_instance_available(util: EchoUtil, instance_identifier: str, timeout: float, progress=None):
+    """:return: the instance as soon as it's available, including its Endpoint"""
+    def poll():
+        instance = describe_instance(util, instance_identifier)
+        if instance is None:
+            return None, 'not found'
+        return (instance if instance['DBInstanceStatus'] == 'available' else None), instance['DBInstanceStatus']
+    return wait_until('instance {} to be available'.format(instance_identifier), poll, timeout, progress)
+
+
+def wait_for_cluster_available(util: EchoUtil, cluster_identifier: str, timeout: float, progress=None):
+    """:return: the cluster as soon as it's available"""
+    def poll():
+        cluster = describe_cluster(util, cluster_identifier)
+        if cluster is None:
+            return None, 'not found'
+        return (cluster if cluster['Status'] == 'available' else None), cluster['Status']
+    return wait_until('cluster {} to be available'.format(cluster_identifier), poll, timeout, progress)
+
+
+def wait_for_instance_deleted(util: EchoUtil, instance_identifier: str, timeout: float, progress=None):
+    def poll():
+        instance = describe_instance(util, instance_identifier)
+        return (True, 'deleted') if instance is None else (None, instance['DBInstanceStatus'])
+    wait_until('instance {} to be deleted'.format(instance_identifier), poll, timeout, progress)
+
+
+def wait_for_cluster_deleted(util: EchoUtil, cluster_identifier: str, timeout: float, progress=None):
+    def poll():
+        cluster = describe_cluster(util, cluster_identifier)
+        return (True, 'deleted') if cluster is None else (None, cluster['Status'])
+    wait_until('cluster {} to be deleted'.format(cluster_identifier), poll, timeout, progress)
+
+
+def wait_for_changes_insync(util: EchoUtil, change_ids: list, timeout: float, progress=None):
+    """Wait for every one of the Route 53 changes to be INSYNC, checking only the ones that aren't yet"""
+    pending = list(change_ids)
+
+    def poll():
+        pending[:] = [change_id for change_id in pending if util.route53.get_change(Id=change_id)['ChangeInfo']['Status'] != 'INSYNC']
+        return (True if not pending else None), '{} of {} still PENDING'.format(len(pending), len(change_ids))
+    wait_until('DNS changes {} to be INSYNC'.format(', '.join(change_ids)), poll, timeout, progress,
+               DNS_INITIAL_DELAY, DNS_MAX_DELAY)
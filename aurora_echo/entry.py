@@ -22,10 +22,85 @@
 # THE SOFTWARE.
 ##
 
+import importlib
+import logging
+
 import click
 
+from aurora_echo.echo_const import ECHO_NEW_COMMAND, ECHO_CLONE_COMMAND, ECHO_MODIFY_COMMAND, ECHO_PROMOTE_COMMAND, \
+    ECHO_RETIRE_COMMAND, ECHO_CYCLE_COMMAND, ECHO_FLEET_COMMAND, METRICS_OUT_ENVVAR, DEFAULT_RATE_LIMITS, RATE_LIMIT_ENVVAR, \
+    DEFAULT_RETRY_BUDGET, RETRY_BUDGET_ENVVAR, LOG_LEVELS, DEFAULT_LOG_LEVEL, LOG_LEVEL_ENVVAR, LOG_FORMATS, LOG_FORMAT_TEXT, \
+    LOG_FORMAT_ENVVAR, QUIET_ENVVAR
+
+# command name -> module that registers it on root when imported. Apart from fleet, each module also has a
+# run_<command>(util, ...) taking the command's options other than those EchoUtil is built from, which fleet calls
+LAZY_COMMANDS = {
+    ECHO_NEW_COMMAND: 'aurora_echo.echo_new',
+    ECHO_CLONE_COMMAND: 'aurora_echo.echo_clone',
+    ECHO_MODIFY_COMMAND: 'aurora_echo.echo_modify',
+    ECHO_PROMOTE_COMMAND: 'aurora_echo.echo_promote',
+    ECHO_RETIRE_COMMAND: 'aurora_echo.echo_retire',
+    ECHO_CYCLE_COMMAND: 'aurora_echo.echo_cycle',
+    ECHO_FLEET_COMMAND: 'aurora_echo.echo_fleet',
+}
+
+
+class LazyGroup(click.Group):
+    """
+    A group that only imports a command's module once that command is actually asked for, so running one command (or
+    just --help) doesn't pay for importing all the others and everything they pull in.
+    """
+
+    def __init__(self, *args, lazy_commands: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            importlib.import_module(self.lazy_commands[cmd_name])
+        return self.commands.get(cmd_name)
 
-@click.group()
+    def format_commands(self, ctx, formatter):
+        # list the names without importing every command just to print an (empty) help line for each
+        rows = [(cmd_name, (self.commands[cmd_name].short_help or '') if cmd_name in self.commands else '')
+                for cmd_name in self.list_commands(ctx)]
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_commands=LAZY_COMMANDS)
+@click.option('--debug', is_flag=True, envvar='AURORA_ECHO_DEBUG')
+@click.option('--log-level', default=DEFAULT_LOG_LEVEL, type=click.Choice(LOG_LEVELS), envvar=LOG_LEVEL_ENVVAR)
+@click.option('--log-format', default=LOG_FORMAT_TEXT, type=click.Choice(LOG_FORMATS), envvar=LOG_FORMAT_ENVVAR)
+@click.option('--quiet', '-q', is_flag=True, envvar=QUIET_ENVVAR)
+@click.option('--metrics-out', type=click.Path(dir_okay=False), envvar=METRICS_OUT_ENVVAR)
+@click.option('--metrics-table', is_flag=True)
+@click.option('--rate-limit', multiple=True, envvar=RATE_LIMIT_ENVVAR)
+@click.option('--retry-budget', default=DEFAULT_RETRY_BUDGET, type=click.FloatRange(min=0), envvar=RETRY_BUDGET_ENVVAR)
 @click.pass_context
-def root(*args, **kwargs):
-    pass
+def root(ctx, debug: bool, log_level: str, log_format: str, quiet: bool, metrics_out: str, metrics_table: bool,
+         rate_limit: tuple, retry_budget: float):
+    # only needed once a command actually runs
+    from aurora_echo import echo_log, echo_ratelimit
+
+    # only our own loggers, botocore's debug output would drown everything else
+    echo_log.configure(logging.DEBUG if debug else getattr(logging, log_level.upper()), log_format, quiet)
+    echo_ratelimit.enable(echo_ratelimit.parse_rate_limits(rate_limit, DEFAULT_RATE_LIMITS), retry_budget)
+
+    if metrics_out or metrics_table:
+        # imported here so that commands run without metrics never load it
+        from aurora_echo import echo_metrics
+        metrics = echo_metrics.enable()
+        ctx.call_on_close(lambda: report_metrics(metrics, ctx.invoked_subcommand, metrics_out, metrics_table))
+
+
+def report_metrics(metrics, command: str, metrics_out: str, metrics_table: bool):
+    """Runs as the command exits, whether or not it succeeded"""
+    if metrics_out:
+        metrics.write(metrics_out, command)
+    if metrics_table:
+        metrics.echo_table(command)
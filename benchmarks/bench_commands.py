@@ -0,0 +1,177 @@
+#!/usr/bin/python
+
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+How many AWS calls, and how much time, managed instance discovery, record set lookups and each command take as the
+account grows, run against the in-memory fakes in fake_aws rather than AWS.
+
+    python benchmarks/bench_commands.py
+    python benchmarks/bench_commands.py --sizes 10 5000 --latency-ms 20 --throttle-rate 0.05 --json bench.json
+
+Call counts don't depend on the machine, so they're the thing to compare between versions; wall time is only
+meaningful with --latency-ms standing in for the network.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+
+from fake_aws import ACCOUNT_NUMBER, REGION, FakeAWS, FakeEchoUtil
+
+from aurora_echo import echo_promote
+from aurora_echo.echo_const import DISCOVERY_SCAN, DISCOVERY_TAGGING, SNAPSHOT_POLICY_NEWEST
+from aurora_echo.echo_cycle import run_cycle
+from aurora_echo.echo_modify import run_modify
+from aurora_echo.echo_new import run_new
+from aurora_echo.echo_promote import find_record_set, run_promote
+from aurora_echo.echo_retire import run_retire
+
+MANAGED_NAME = 'bench'
+SOURCE_CLUSTER = 'bench-source'
+HOSTED_ZONE_ID = 'ZBENCH'
+DOMAIN = 'example.com'
+RECORD_SETS = [('bench-db.{}'.format(DOMAIN), None, 'CNAME')]  # as validate_record_sets hands them to the commands
+WAIT_TIMEOUT_MINUTES = 1
+
+
+def make_api(args, size: int, zone_size: int = 100):
+    api = FakeAWS(latency=args.latency_ms / 1000, throttle_rate=args.throttle_rate)
+    api.add_fleet(size, managed_names=[MANAGED_NAME])
+    api.add_cluster(SOURCE_CLUSTER, snapshots=35, manual_snapshots=50)
+    api.add_hosted_zone(HOSTED_ZONE_ID, DOMAIN, zone_size)
+    return api
+
+
+def make_util(api: FakeAWS, discovery: str = DISCOVERY_TAGGING):
+    echo_promote.record_set_cache.clear()  # one command run per process, so nothing carries over
+    return FakeEchoUtil(api, REGION, ACCOUNT_NUMBER, discovery=discovery)
+
+
+def measure(api: FakeAWS, action, runs: int = 1, setup=None):
+    """
+    Run action quietly, runs times, starting each from setup() if given.
+
+    :return: wall times in seconds, and the counters of the last run
+    """
+    timings = []
+    for _ in range(runs):
+        state = setup() if setup else None
+        api.reset_counters()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            action(state)
+            timings.append(time.perf_counter() - start)
+    return timings, {
+        'calls': dict(api.calls),
+        'attempts': sum(api.attempts.values()),
+        'throttles': sum(api.throttles.values()),
+    }
+
+
+def bench_discovery(args):
+    for size in args.sizes:
+        for discovery in (DISCOVERY_TAGGING, DISCOVERY_SCAN):
+            api = make_api(args, size)
+            yield 'discovery ({})'.format(discovery), size, measure(
+                api, lambda util: util.find_managed_instances(MANAGED_NAME), args.runs, lambda: make_util(api, discovery))
+
+
+def bench_record_set(args):
+    for zone_size in args.zone_sizes:
+        api = make_api(args, 10, zone_size)
+        name = 'record-{}.{}'.format(zone_size // 2, DOMAIN)
+        yield 'find_record_set', zone_size, measure(
+            api, lambda util: find_record_set(HOSTED_ZONE_ID, name, util), args.runs, lambda: make_util(api))
+
+
+def bench_commands(args):
+    """Every command in turn, each with its own EchoUtil as if run separately, then cycle doing the lot"""
+    commands = [
+        ('new', lambda util: run_new(util, MANAGED_NAME, SOURCE_CLUSTER, 'subnets', 'db.r4.large', 'aurora', None, (), (),
+                                     20, SNAPSHOT_POLICY_NEWEST, 0, False, None)),
+        ('modify', lambda util: run_modify(util, MANAGED_NAME, ('bench-role',), False, False, WAIT_TIMEOUT_MINUTES)),
+        ('promote', lambda util: run_promote(util, MANAGED_NAME, (HOSTED_ZONE_ID,), RECORD_SETS, 60, False, False,
+                                             WAIT_TIMEOUT_MINUTES)),
+        ('retire --all', lambda util: run_retire(util, MANAGED_NAME, False, True, False, WAIT_TIMEOUT_MINUTES)),
+    ]
+    for size in args.sizes:
+        api = make_api(args, size, args.zone_sizes[0])
+        for command_name, command in commands:
+            yield command_name, size, measure(api, command, setup=lambda: make_util(api))
+
+        api = make_api(args, size, args.zone_sizes[0])
+        yield 'cycle', size, measure(api, lambda util: run_cycle(
+            util, MANAGED_NAME, SOURCE_CLUSTER, SNAPSHOT_POLICY_NEWEST, 0, None, 'subnets', 'db.r4.large', 'aurora', None,
+            (), (), 20, None, None, ('bench-role',), (HOSTED_ZONE_ID,), RECORD_SETS, 0, WAIT_TIMEOUT_MINUTES, False),
+            setup=lambda: make_util(api))
+
+
+SCENARIOS = {
+    'discovery': bench_discovery,
+    'record-set': bench_record_set,
+    'commands': bench_commands,
+}
+
+
+def report(name: str, size: int, timings: list, counters: dict):
+    calls = counters['calls']
+    busiest = ', '.join('{} {}'.format(operation.split('.', 1)[1], count)
+                        for operation, count in sorted(calls.items(), key=lambda item: item[1], reverse=True)[:3])
+    print('{:<22} {:>7} {:>10.1f} ms {:>6} calls {:>6} throttled  {}'.format(
+        name, size, statistics.median(timings) * 1000, sum(calls.values()), counters['throttles'], busiest))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Count the AWS calls commands make against fake accounts of growing size.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='what to run; may be repeated. Defaults to all of them')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000], help='instances in the account')
+    parser.add_argument('--zone-sizes', type=int, nargs='+', default=[100, 10000, 100000], help='record sets in the zone')
+    parser.add_argument('--runs', type=int, default=3, help='times to repeat the lookups, reporting the median')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every API call')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='fraction of API calls throttled')
+    parser.add_argument('--json', help='also write every result to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    print('{:<22} {:>7} {:>13} {:>12} {:>16}  {}'.format('scenario', 'size', 'wall', 'API calls', '', 'busiest'))
+    for scenario in args.scenario or sorted(SCENARIOS):
+        for name, size, (timings, counters) in SCENARIOS[scenario](args):
+            report(name, size, timings, counters)
+            results.append(dict(counters, scenario=name, size=size, wall_seconds=statistics.median(timings)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
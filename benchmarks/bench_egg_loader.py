@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+Micro-benchmark for boto_monkey's egg loader: how long creating clients takes from inside a built eggsecutable with
+the indexed lookups, compared to the linear scans over EGG.namelist() they replaced.
+
+    python benchmarks/bench_egg_loader.py build/aurora-echo
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+
+def legacy_loader_functions(boto_monkey):
+    """The namelist-scanning versions of the loader methods, as they were before the index"""
+    import botocore.loaders
+    from botocore.exceptions import DataNotFoundError
+
+    egg = boto_monkey.EGG
+    egg_dirs = set([os.path.split(x)[0] for x in egg.namelist() if '/' in x])
+    egg_api_paths = [x for x in egg_dirs if 'botocore/data/' in x]
+    egg_api_paths.extend([x for x in egg_dirs if 'boto3/data/' in x])
+
+    class LegacyJSONFileLoader(boto_monkey.JSONFileLoader2):
+        def exists(self, file_path):
+            return any(x.startswith("%s" % file_path) for x in egg.namelist())
+
+    @botocore.loaders.instance_cache
+    def list_available_services(self, type_name):
+        services = set()
+        for api_path in egg_api_paths:
+            api_version = api_path.replace('botocore/data/', '').replace('boto3/data/', '').split('/')
+            if len(api_version) == 2:
+                if self.file_loader.exists(os.path.join(api_path, type_name)):
+                    services.add(api_version[0])
+        return sorted(services)
+
+    @botocore.loaders.instance_cache
+    def list_api_versions(self, service_name, type_name):
+        known_api_versions = set()
+        for api_path in egg_api_paths:
+            if service_name in api_path.split('/'):
+                api_version = api_path.replace('botocore/data/', '').replace('boto3/data/', '').split('/')
+                if len(api_version) == 2:
+                    if self.file_loader.exists(os.path.join(api_path, type_name)):
+                        known_api_versions.add(api_version[1])
+        if not known_api_versions:
+            raise DataNotFoundError(data_path=service_name)
+        return sorted(known_api_versions)
+
+    return {
+        'FILE_LOADER_CLASS': LegacyJSONFileLoader,
+        'list_available_services': list_available_services,
+        'list_api_versions': list_api_versions,
+    }
+
+
+def time_client_creation(services, runs):
+    import boto3.session
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        session = boto3.session.Session(region_name='us-east-1')  # a fresh session has a fresh loader cache
+        for service_name in services:
+            session.client(service_name)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    print('{:<10} median {:>8.1f} ms  min {:>8.1f} ms  max {:>8.1f} ms'.format(
+        label, statistics.median(timings) * 1000, min(timings) * 1000, max(timings) * 1000))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time client creation from inside an eggsecutable.')
+    parser.add_argument('egg', help='path to a built eggsecutable, e.g. build/aurora-echo')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--service', action='append', help='service to create a client for; may be repeated')
+    args = parser.parse_args(argv)
+    services = args.service or ['rds', 'route53']
+
+    # load everything from the egg, just like the executable does
+    sys.path.insert(0, os.path.abspath(args.egg))
+    import botocore.loaders
+    from aurora_echo import boto_monkey
+    if not boto_monkey.EGG:
+        sys.stderr.write('{} does not look like an eggsecutable\n'.format(args.egg))
+        return 1
+
+    print('{} names in {}, creating {} clients {} times'.format(len(boto_monkey.EGG_NAMES), args.egg, ', '.join(services), args.runs))
+    time_client_creation(services, 1)  # warm up, so neither side pays for importing boto3/botocore
+    report('indexed', time_client_creation(services, args.runs))
+
+    indexed = {name: getattr(botocore.loaders.Loader, name) for name in ('FILE_LOADER_CLASS', 'list_available_services', 'list_api_versions')}
+    for name, value in legacy_loader_functions(boto_monkey).items():
+        setattr(botocore.loaders.Loader, name, value)
+    try:
+        report('scanning', time_client_creation(services, args.runs))
+    finally:
+        for name, value in indexed.items():
+            setattr(botocore.loaders.Loader, name, value)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
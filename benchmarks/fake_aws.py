@@ -0,0 +1,486 @@
+#!/usr/bin/python
+
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+In-memory stand-ins for the RDS, Resource Groups Tagging and Route 53 clients, covering just the operations
+aurora_echo calls, so commands can be run against made-up accounts of any size without AWS.
+
+Every call is counted, can be slowed down by a fixed latency, and can be throttled at random. A throttled attempt is
+retried with exponential backoff, as botocore would, and only fails once max_attempts are used up; the backoff is
+scaled by backoff_base so runs stay short. Resources change state instantly: created instances and clusters are
+available on the next describe, deleted ones are gone, and Route 53 changes are INSYNC straight away. For testing what
+happens in between, delete_lag keeps deleted instances and clusters deleting for that many describes of them,
+insync_after keeps changes PENDING for that many get_change calls, and errors makes operations fail.
+
+    api = FakeAWS(latency=0.005, throttle_rate=0.05)
+    api.add_fleet(1000, managed_names=['dev'])
+    util = FakeEchoUtil(api, 'us-east-1', '123456789012')
+"""
+
+import random
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from aurora_echo.echo_const import ECHO_MANAGEMENT_TAG_INDICATOR, ECHO_PROMOTE_STAGE
+from aurora_echo.echo_util import EchoUtil
+
+REGION = 'us-east-1'
+ACCOUNT_NUMBER = '123456789012'
+
+
+def client_error(code: str, operation_name: str, message: str = ''):
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation_name)
+
+
+def operation_name(operation: str):
+    """:return: the API's name for one of our 'service.method' call names, e.g. DescribeDBInstances"""
+    return ''.join(word.upper() if word == 'db' else word.title() for word in operation.split('.', 1)[1].split('_'))
+
+
+def stage_tag(managed_name: str):
+    return '{}:{}:stage'.format(ECHO_MANAGEMENT_TAG_INDICATOR, managed_name)
+
+
+def record_name(name: str):
+    """
+    A name as Route 53 keeps and lists it: lower case, fully qualified with a trailing dot, and anything other than
+    a-z, 0-9, -, _ and the dots between labels escaped as \\ooo octal, e.g. *.Example.com is \\052.example.com.
+    """
+    name = re.sub(r'\\[0-7]{3}|[^a-z0-9\-_.]', lambda match: match.group() if len(match.group()) == 4 else
+                  '\\{:03o}'.format(ord(match.group())), name.lower())
+    return name if name.endswith('.') else name + '.'
+
+
+def record_sort_key(name: str, record_type: str):
+    """
+    Route 53 lists record sets "first by DNS name with the labels reversed, for example com.example.www.", trailing dot
+    included, compared as strings, "then by record type". So dev-db.example.com comes before dev.example.com, '-'
+    being before '.'
+    """
+    return '.'.join(reversed(record_name(name).rstrip('.').split('.'))) + '.', record_type
+
+
+class FakeAWS(object):
+    """
+    The state of one fake account and region, and the counters for every call made to it.
+    """
+
+    def __init__(self, latency: float = 0, throttle_rate: float = 0, max_attempts: int = 5,
+                 backoff_base: float = 0.001, seed: int = 0, region: str = REGION,
+                 account_number: str = ACCOUNT_NUMBER):
+        self.region = region
+        self.account_number = account_number
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.random = random.Random(seed)
+        self.delete_lag = 0
+        self.insync_after = 0
+        self.errors = {}  # 'service.operation' -> error code every call to it fails with
+
+        self._lock = threading.Lock()
+        self.calls = Counter()  # 'service.operation' -> calls
+        self.attempts = Counter()  # 'service.operation' -> attempts, throttled ones included
+        self.throttles = Counter()  # 'service.operation' -> throttled attempts
+
+        self.instances = {}  # identifier -> instance, ordered as RDS lists them
+        self.clusters = {}  # identifier -> cluster
+        self.snapshots = {}  # cluster identifier -> [snapshot]
+        self.tags = {}  # instance or cluster ARN -> {key: value}
+        self.record_sets = {}  # hosted zone id -> sorted [(sort key, record set)]
+        self.changes = {}  # change id -> get_change calls left until it's INSYNC
+        self.deleting = {}  # ('instance' or 'cluster', identifier) -> describes left until it's gone
+
+        self.rds = FakeRDS(self)
+        self.tagging = FakeTagging(self)
+        self.route53 = FakeRoute53(self)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.attempts.clear()
+            self.throttles.clear()
+
+    def call(self, operation: str, action):
+        """
+        Make one API call: pay the latency for every attempt and retry throttled ones with backoff.
+        """
+        with self._lock:
+            self.calls[operation] += 1
+        for attempt in range(1, self.max_attempts + 1):
+            if self.latency:
+                time.sleep(self.latency)
+            with self._lock:
+                self.attempts[operation] += 1
+                throttled = self.random.random() < self.throttle_rate
+                if throttled:
+                    self.throttles[operation] += 1
+                    backoff = self.backoff_base * self.random.random() * 2 ** (attempt - 1)
+            if not throttled:
+                with self._lock:
+                    if operation in self.errors:
+                        raise client_error(self.errors[operation], operation_name(operation))
+                    return action()
+            if attempt < self.max_attempts:
+                time.sleep(backoff)
+        raise client_error('Throttling', operation_name(operation), 'Rate exceeded')
+
+    def arn(self, instance_identifier: str):
+        return 'arn:aws:rds:{}:{}:db:{}'.format(self.region, self.account_number, instance_identifier)
+
+    def cluster_arn(self, cluster_identifier: str):
+        return 'arn:aws:rds:{}:{}:cluster:{}'.format(self.region, self.account_number, cluster_identifier)
+
+    def describe_cluster(self, cluster_identifier: str):
+        members = [{'DBInstanceIdentifier': identifier} for identifier, instance in self.instances.items()
+                   if instance['DBClusterIdentifier'] == cluster_identifier]
+        return dict(self.clusters[cluster_identifier], DBClusterMembers=members)
+
+    def start_deleting(self, resource: str, identifier: str):
+        """:return: False if it should just go, straight away"""
+        if not self.delete_lag:
+            return False
+        self.deleting[(resource, identifier)] = self.delete_lag
+        return True
+
+    def gone(self, resource: str, identifier: str):
+        """Count a describe of something being deleted, :return: True once that has made it go"""
+        key = (resource, identifier)
+        if key not in self.deleting:
+            return False
+        self.deleting[key] -= 1
+        if self.deleting[key] > 0:
+            return False
+        del self.deleting[key]
+        if resource == 'instance':
+            self.instances.pop(identifier, None)
+            self.tags.pop(self.arn(identifier), None)
+        else:
+            self.clusters.pop(identifier, None)
+            self.tags.pop(self.cluster_arn(identifier), None)
+        return True
+
+    def finish_deleting(self, describes: int = 0):
+        """Have everything being deleted go after that many more describes of it, or now"""
+        for key in list(self.deleting):
+            self.deleting[key] = max(describes, 1)
+            if not describes:
+                self.gone(*key)
+
+    def add_cluster(self, identifier: str, snapshots: int = 0, manual_snapshots: int = 0):
+        self.clusters[identifier] = {'DBClusterIdentifier': identifier, 'Status': 'available'}
+        now = datetime.now(timezone.utc)
+        self.snapshots[identifier] = [
+            {
+                'DBClusterSnapshotIdentifier': '{}-{}-{}'.format(identifier, snapshot_type, i),
+                'DBClusterIdentifier': identifier,
+                'SnapshotCreateTime': now - timedelta(days=i + 1),
+                'SnapshotType': snapshot_type,
+                'Status': 'available',
+            }
+            for snapshot_type, count in (('automated', snapshots), ('manual', manual_snapshots)) for i in range(count)
+        ]
+
+    def add_instance(self, identifier: str, cluster_identifier: str = None, tags: dict = None, age_days: float = 30):
+        cluster_identifier = cluster_identifier or identifier
+        if cluster_identifier not in self.clusters:
+            self.add_cluster(cluster_identifier)
+        self.instances[identifier] = {
+            'DBInstanceIdentifier': identifier,
+            'DBClusterIdentifier': cluster_identifier,
+            'DBInstanceStatus': 'available',
+            'InstanceCreateTime': datetime.now(timezone.utc) - timedelta(days=age_days),
+            'Endpoint': {'Address': '{}.cluster-fake.{}.rds.amazonaws.com'.format(identifier, self.region),
+                         'Port': 3306},
+        }
+        self.tags[self.arn(identifier)] = dict(tags or {})
+
+    def add_fleet(self, size: int, managed_names: list = (), instances_per_name: int = 2):
+        """
+        size instances in all, of which instances_per_name for each managed name are ours: the newest one promoted,
+        the rest retired. Everything else is untagged.
+        """
+        for managed_name in managed_names:
+            for i in range(instances_per_name):
+                stage = ECHO_PROMOTE_STAGE if i == 0 else 'retired'
+                self.add_instance('{}-{}'.format(managed_name, i), tags={stage_tag(managed_name): stage}, age_days=i + 1)
+        for i in range(size - len(self.instances)):
+            self.add_instance('unmanaged-{}'.format(i), tags={'team': 'other'})
+
+    def add_hosted_zone(self, hosted_zone_id: str, domain: str, size: int):
+        """A zone with size CNAMEs, record-0.domain up to record-<size - 1>.domain"""
+        self.record_sets[hosted_zone_id] = []
+        for i in range(size):
+            self.put_record_set(hosted_zone_id, {
+                'Name': 'record-{}.{}.'.format(i, domain), 'Type': 'CNAME', 'TTL': 300,
+                'ResourceRecords': [{'Value': 'target-{}.{}'.format(i, domain)}],
+            })
+
+    def put_record_set(self, hosted_zone_id: str, record_set: dict):
+        record_set = dict(record_set, Name=record_name(record_set['Name']))
+        records = self.record_sets[hosted_zone_id]
+        key = record_sort_key(record_set['Name'], record_set['Type'])
+        i = bisect_left(records, (key,))
+        if i < len(records) and records[i][0] == key:
+            records[i] = (key, record_set)
+        else:
+            insort(records, (key, record_set))
+
+
+class FakePaginator(object):
+    """Pages through a fake describe_* operation by Marker, as botocore's paginators do"""
+
+    def __init__(self, method, result_key: str):
+        self.method = method
+        self.result_key = result_key
+
+    def paginate(self, PaginationConfig: dict = None, **params):
+        page_size = (PaginationConfig or {}).get('PageSize')
+        if page_size:
+            params['MaxRecords'] = page_size
+        while True:
+            page = self.method(**params)
+            yield page
+            if not page.get('Marker'):
+                break
+            params['Marker'] = page['Marker']
+
+
+def page(items: list, result_key: str, max_records: int = None, marker: str = None):
+    start = int(marker or 0)
+    max_records = max_records or 100
+    response = {result_key: items[start:start + max_records]}
+    if start + max_records < len(items):
+        response['Marker'] = str(start + max_records)
+    return response
+
+
+class FakeRDS(object):
+
+    PAGINATED = {'describe_db_instances': 'DBInstances', 'describe_db_clusters': 'DBClusters',
+                 'describe_db_cluster_snapshots': 'DBClusterSnapshots'}
+
+    def __init__(self, api: FakeAWS):
+        self.api = api
+
+    def get_paginator(self, operation_name: str):
+        return FakePaginator(getattr(self, operation_name), self.PAGINATED[operation_name])
+
+    def describe_db_instances(self, DBInstanceIdentifier: str = None, Filters: list = None, MaxRecords: int = None,
+                              Marker: str = None):
+        def action():
+            if DBInstanceIdentifier:
+                if self.api.gone('instance', DBInstanceIdentifier) or DBInstanceIdentifier not in self.api.instances:
+                    raise client_error('DBInstanceNotFound', 'DescribeDBInstances')
+                return {'DBInstances': [dict(self.api.instances[DBInstanceIdentifier])]}
+            instances = list(self.api.instances.values())
+            for instance_filter in Filters or []:
+                if instance_filter['Name'] == 'db-instance-id':
+                    wanted = set(instance_filter['Values'])
+                    instances = [instance for instance in instances if instance['DBInstanceIdentifier'] in wanted]
+            return page([dict(instance) for instance in instances], 'DBInstances', MaxRecords, Marker)
+        return self.api.call('rds.describe_db_instances', action)
+
+    def describe_db_clusters(self, DBClusterIdentifier: str = None, MaxRecords: int = None, Marker: str = None):
+        def action():
+            if not DBClusterIdentifier:
+                return page([self.api.describe_cluster(identifier) for identifier in self.api.clusters], 'DBClusters',
+                            MaxRecords, Marker)
+            if self.api.gone('cluster', DBClusterIdentifier) or DBClusterIdentifier not in self.api.clusters:
+                raise client_error('DBClusterNotFoundFault', 'DescribeDBClusters')
+            return {'DBClusters': [self.api.describe_cluster(DBClusterIdentifier)]}
+        return self.api.call('rds.describe_db_clusters', action)
+
+    def describe_db_cluster_snapshots(self, DBClusterIdentifier: str, SnapshotType: str = None, MaxRecords: int = None,
+                                      Marker: str = None):
+        def action():
+            snapshots = [snapshot for snapshot in self.api.snapshots.get(DBClusterIdentifier, [])
+                         if SnapshotType is None or snapshot['SnapshotType'] == SnapshotType]
+            return page(snapshots, 'DBClusterSnapshots', MaxRecords, Marker)
+        return self.api.call('rds.describe_db_cluster_snapshots', action)
+
+    def list_tags_for_resource(self, ResourceName: str):
+        def action():
+            # arn:aws:rds:<region>:<account>:<db or cluster>:<identifier>
+            _, _, _, _, _, resource_type, identifier = ResourceName.split(':', 6)
+            if resource_type == 'cluster' and identifier not in self.api.clusters:
+                raise client_error('DBClusterNotFoundFault', 'ListTagsForResource')
+            if resource_type == 'db' and identifier not in self.api.instances:
+                raise client_error('DBInstanceNotFound', 'ListTagsForResource')
+            tags = self.api.tags.get(ResourceName, {})
+            return {'TagList': [{'Key': key, 'Value': value} for key, value in tags.items()]}
+        return self.api.call('rds.list_tags_for_resource', action)
+
+    def add_tags_to_resource(self, ResourceName: str, Tags: list):
+        def action():
+            self.api.tags.setdefault(ResourceName, {}).update((tag['Key'], tag['Value']) for tag in Tags)
+            return {}
+        return self.api.call('rds.add_tags_to_resource', action)
+
+    def restore_cluster(self, operation: str, DBClusterIdentifier: str):
+        def action():
+            if DBClusterIdentifier in self.api.clusters:
+                raise client_error('DBClusterAlreadyExistsFault', operation)
+            self.api.add_cluster(DBClusterIdentifier)
+            return {'DBCluster': {'DBClusterIdentifier': DBClusterIdentifier, 'Status': 'creating'}}
+        return self.api.call('rds.' + operation, action)
+
+    def restore_db_cluster_from_snapshot(self, DBClusterIdentifier: str, **params):
+        return self.restore_cluster('restore_db_cluster_from_snapshot', DBClusterIdentifier)
+
+    def restore_db_cluster_to_point_in_time(self, DBClusterIdentifier: str, **params):
+        return self.restore_cluster('restore_db_cluster_to_point_in_time', DBClusterIdentifier)
+
+    def create_db_instance(self, DBInstanceIdentifier: str, DBClusterIdentifier: str, Tags: list = (), **params):
+        def action():
+            if DBInstanceIdentifier in self.api.instances:
+                raise client_error('DBInstanceAlreadyExists', 'CreateDBInstance')
+            self.api.add_instance(DBInstanceIdentifier, DBClusterIdentifier, {tag['Key']: tag['Value'] for tag in Tags},
+                                  age_days=0)
+            return {'DBInstance': {'DBInstanceIdentifier': DBInstanceIdentifier, 'DBClusterIdentifier': DBClusterIdentifier,
+                                   'DBInstanceStatus': 'creating'}}
+        return self.api.call('rds.create_db_instance', action)
+
+    def add_role_to_db_cluster(self, DBClusterIdentifier: str, RoleArn: str):
+        return self.api.call('rds.add_role_to_db_cluster', lambda: {})
+
+    def delete_db_instance(self, DBInstanceIdentifier: str, SkipFinalSnapshot: bool):
+        def action():
+            instance = self.api.instances.get(DBInstanceIdentifier)
+            if instance is None:
+                raise client_error('DBInstanceNotFound', 'DeleteDBInstance')
+            if instance['DBInstanceStatus'] == 'deleting':
+                raise client_error('InvalidDBInstanceState', 'DeleteDBInstance', 'Instance is already being deleted')
+            if self.api.start_deleting('instance', DBInstanceIdentifier):
+                instance['DBInstanceStatus'] = 'deleting'
+            else:
+                del self.api.instances[DBInstanceIdentifier]
+                self.api.tags.pop(self.api.arn(DBInstanceIdentifier), None)
+            return {'DBInstance': dict(instance, DBInstanceStatus='deleting')}
+        return self.api.call('rds.delete_db_instance', action)
+
+    def delete_db_cluster(self, DBClusterIdentifier: str, SkipFinalSnapshot: bool):
+        def action():
+            if any(instance['DBClusterIdentifier'] == DBClusterIdentifier for instance in self.api.instances.values()):
+                raise client_error('InvalidDBClusterStateFault', 'DeleteDBCluster', 'Cluster still has instances')
+            cluster = self.api.clusters.get(DBClusterIdentifier)
+            if cluster is None:
+                raise client_error('DBClusterNotFoundFault', 'DeleteDBCluster')
+            if cluster['Status'] == 'deleting':
+                raise client_error('InvalidDBClusterStateFault', 'DeleteDBCluster', 'Cluster is already being deleted')
+            if self.api.start_deleting('cluster', DBClusterIdentifier):
+                cluster['Status'] = 'deleting'
+            else:
+                del self.api.clusters[DBClusterIdentifier]
+                self.api.tags.pop(self.api.cluster_arn(DBClusterIdentifier), None)
+            return {'DBCluster': dict(cluster, Status='deleting')}
+        return self.api.call('rds.delete_db_cluster', action)
+
+
+class FakeTagging(object):
+
+    def __init__(self, api: FakeAWS):
+        self.api = api
+
+    def get_resources(self, ResourceTypeFilters: list = None, TagFilters: list = (), ResourcesPerPage: int = 50,
+                      PaginationToken: str = None):
+        def matches(arn: str, tags: dict):
+            # arn:aws:rds:<region>:<account>:<db or cluster>:<identifier>
+            resource_type = 'rds:' + arn.split(':')[5]
+            if ResourceTypeFilters and resource_type not in ResourceTypeFilters:
+                return False
+            return all(tag_filter['Key'] in tags and ('Values' not in tag_filter or tags[tag_filter['Key']] in tag_filter['Values'])
+                       for tag_filter in TagFilters)
+
+        def action():
+            resources = [{'ResourceARN': arn, 'Tags': [{'Key': key, 'Value': value} for key, value in tags.items()]}
+                         for arn, tags in self.api.tags.items() if matches(arn, tags)]
+            response = page(resources, 'ResourceTagMappingList', ResourcesPerPage, PaginationToken)
+            response['PaginationToken'] = response.pop('Marker', '')
+            return response
+        return self.api.call('tagging.get_resources', action)
+
+
+class FakeRoute53(object):
+
+    def __init__(self, api: FakeAWS):
+        self.api = api
+
+    def list_resource_record_sets(self, HostedZoneId: str, StartRecordName: str = None, StartRecordType: str = None,
+                                  MaxItems: str = '300'):
+        def action():
+            records = self.api.record_sets[HostedZoneId]
+            start = bisect_left(records, (record_sort_key(StartRecordName, StartRecordType or ''),)) if StartRecordName else 0
+            max_items = int(MaxItems)
+            response = {'ResourceRecordSets': [record_set for _, record_set in records[start:start + max_items]],
+                        'IsTruncated': start + max_items < len(records), 'MaxItems': MaxItems}
+            if response['IsTruncated']:
+                response['NextRecordName'] = records[start + max_items][1]['Name']
+                response['NextRecordType'] = records[start + max_items][1]['Type']
+            return response
+        return self.api.call('route53.list_resource_record_sets', action)
+
+    def change_resource_record_sets(self, HostedZoneId: str, ChangeBatch: dict):
+        def action():
+            for change in ChangeBatch['Changes']:
+                self.api.put_record_set(HostedZoneId, change['ResourceRecordSet'])
+            change_id = '/change/C{}'.format(len(self.api.changes))
+            self.api.changes[change_id] = self.api.insync_after
+            return {'ChangeInfo': {'Id': change_id, 'Status': 'PENDING', 'SubmittedAt': datetime.now(timezone.utc)}}
+        return self.api.call('route53.change_resource_record_sets', action)
+
+    def get_change(self, Id: str):
+        def action():
+            self.api.changes[Id] -= 1
+            return {'ChangeInfo': {'Id': Id, 'Status': 'INSYNC' if self.api.changes[Id] < 0 else 'PENDING'}}
+        return self.api.call('route53.get_change', action)
+
+
+class FakeEchoUtil(EchoUtil):
+    """An EchoUtil whose clients are a FakeAWS"""
+
+    def __init__(self, api: FakeAWS, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.api = api
+
+    @property
+    def rds(self):
+        return self.api.rds
+
+    @property
+    def tagging(self):
+        return self.api.tagging
+
+    @property
+    def route53(self):
+        return self.api.route53
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+Import time regression check.
+
+Runs a command with PYTHONPROFILEIMPORTTIME=1 (the environment form of python -X importtime, so it also works for
+console scripts and the eggsecutable), then fails if any forbidden module got imported, or if given a budget, the total
+import time is over it. The time is always reported, but depends too much on the machine to fail on by default. e.g.
+
+    python check_importtime.py --forbid boto3 --budget-ms 150 -- build/aurora-echo retire --help
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+def parse_importtime(stderr: str):
+    """Return {module: (self_us, cumulative_us)} from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def profile(command: list):
+    env = dict(os.environ, PYTHONPROFILEIMPORTTIME='1')
+    result = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError('{!r} exited with {}:\n{}'.format(command, result.returncode, result.stderr))
+    return parse_importtime(result.stderr)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Fail if a command imports too much, or takes too long doing it.')
+    parser.add_argument('--forbid', action='append', default=[],
+                        help='module that must not be imported (submodules included); may be repeated')
+    parser.add_argument('--budget-ms', type=float, help='maximum total import time in milliseconds (median of runs)')
+    parser.add_argument('--runs', type=int, default=5, help='how many times to run the command')
+    parser.add_argument('--top', type=int, default=10, help='how many of the slowest imports to list')
+    parser.add_argument('command', nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('no command given')
+
+    runs = [profile(command) for _ in range(args.runs)]
+    totals_ms = [sum(self_us for self_us, _ in modules.values()) / 1000 for modules in runs]
+    total_ms = statistics.median(totals_ms)
+    modules = runs[-1]
+
+    print('{}: {} modules, {:.1f} ms total import time (median of {})'.format(' '.join(command), len(modules), total_ms, args.runs))
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print('  {:>8.1f} ms self {:>8.1f} ms cumulative  {}'.format(self_us / 1000, cumulative_us / 1000, name))
+
+    failures = []
+    for forbidden in args.forbid:
+        imported = sorted(name for name in modules if name == forbidden or name.startswith(forbidden + '.'))
+        if imported:
+            failures.append('imported forbidden module(s): {}'.format(', '.join(imported)))
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        failures.append('import time {:.1f} ms is over the {:.1f} ms budget'.format(total_ms, args.budget_ms))
+
+    for failure in failures:
+        sys.stderr.write('FAIL: {}\n'.format(failure))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
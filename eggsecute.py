@@ -15,9 +15,29 @@
 ## limitations under the License.
 
 import os
+import py_compile
+import re
+import shutil
+import statistics
+import subprocess
 import sys
+import tempfile
+import time
 import zipfile
 
+# model data lives under these paths as <prefix><service>/<api version>/<type>.json
+MODEL_DATA_PREFIXES = ('botocore/data/', 'boto3/data/')
+
+# services needed by botocore itself rather than by our code, e.g. to assume roles for credentials
+CREDENTIAL_SERVICES = {'sts'}
+
+# what a typical run does at startup: import boto from the package, then build a client (loading its model)
+STARTUP_PROBE = "import sys; sys.path.insert(0, sys.argv[1]); " \
+                "from aurora_echo.echo_clients import get_client; get_client('rds', 'us-east-1')"
+
+# how our code asks for a client, see aurora_echo.echo_clients
+GET_CLIENT_PATTERN = re.compile(r"""get_client\(\s*['"]([\w-]+)['"]""")
+
 
 def collect_single_module_file(module_name):
     """Return a list of tuples of (absolute_file_path, zip_target_path) for a single module file, like six"""
@@ -47,23 +67,126 @@ def collect_module_files(module_name, relative_path_in_module):
             file_data.append((file_path, target_path))
     return file_data
 
-def main(script_path, output_path):
-    if os.path.exists(output_path):
-        sys.stderr.write("output path '%s' exists; refusing to overwrite\n" % output_path)
-        return 1
 
-    # tack Python header onto a file, zip file parsers ignore everything up until PK magic string
-    outfile = open(output_path, 'w+b')
-    outfile.write(b"#!/usr/bin/env python3\n")
+def find_used_services(module_files):
+    """Return the set of service names our code creates clients for"""
+    services = set()
+    for source_path, target_path in module_files:
+        if target_path.startswith('aurora_echo/') and target_path.endswith('.py'):
+            with open(source_path) as f:
+                services.update(GET_CLIENT_PATTERN.findall(f.read()))
+    return services
+
+
+def model_service(target_path):
+    """Return the service a model data file belongs to, or None if it isn't per-service model data (e.g. _retry)"""
+    for prefix in MODEL_DATA_PREFIXES:
+        if target_path.startswith(prefix):
+            parts = target_path[len(prefix):].split('/')
+            if len(parts) > 1:
+                return parts[0]
+    return None
+
+
+def filter_services(module_files, services):
+    """Drop the model data of every service not in services. Shared data like _endpoints and _retry is kept."""
+    return [x for x in module_files if model_service(x[1]) in (None,) + tuple(services)]
+
+
+def total_size(module_files):
+    return sum(os.path.getsize(source_path) for source_path, _ in module_files)
+
+
+def compile_bytecode(source_path, target_path, build_dir):
+    """
+    Compile a module for the running interpreter, returning where the .pyc ended up. zipimport can't write bytecode
+    back into the package, so without this every run compiles everything it imports from scratch. The package never
+    changes after it's built, so the .pyc isn't checked against its source.
+    """
+    cfile = os.path.join(build_dir, target_path + 'c')
+    kwargs = {}
+    if hasattr(py_compile, 'PycInvalidationMode'):
+        kwargs['invalidation_mode'] = py_compile.PycInvalidationMode.UNCHECKED_HASH
+    py_compile.compile(source_path, cfile=cfile, dfile=target_path, doraise=True, **kwargs)
+    return cfile
+
+
+def write_package(script_path, output_path, packaged_files, optimized=True):
+    """
+    Write the executable zip. Optimized, modules get precompiled .pyc's alongside their sources and both those and the
+    JSON models are stored rather than deflated, so a run reads them straight out of the zip. Otherwise everything is
+    deflated source, as it used to be.
+    """
+    # __main__ is special, it's the first thing that Python finds to run
+    entries = [(script_path, "__main__.py")] + sorted(set(packaged_files), key=lambda x: x[1])
+
+    build_dir = tempfile.mkdtemp(prefix='eggsecute')
+    try:
+        # tack Python header onto a file, zip file parsers ignore everything up until PK magic string
+        outfile = open(output_path, 'w+b')
+        outfile.write(b"#!/usr/bin/env python3\n")
+
+        # make sure we flush, since we'll be writing zip data right after this
+        outfile.flush()
+
+        # create the zip file stream
+        outzip = zipfile.ZipFile(outfile, 'a', zipfile.ZIP_DEFLATED)
+
+        # sorted so the same inputs always give the same package
+        for source_path, relative_destination_path in entries:
+            if optimized and relative_destination_path.endswith('.py'):
+                outzip.write(compile_bytecode(source_path, relative_destination_path, build_dir),
+                             relative_destination_path + 'c', zipfile.ZIP_STORED)
+            if optimized and relative_destination_path.endswith('.json'):
+                outzip.write(source_path, relative_destination_path, zipfile.ZIP_STORED)
+            else:
+                outzip.write(source_path, relative_destination_path)
+        outzip.close()
+        outfile.close()
+    finally:
+        shutil.rmtree(build_dir)
 
-    # make sure we flush, since we'll be writing zip data right after this
-    outfile.flush()
+    os.chmod(output_path, 0o755)
 
-    # create the zip file stream
-    outzip = zipfile.ZipFile(outfile, 'a', zipfile.ZIP_DEFLATED)
 
-    # this is the first thing that Python finds to run, __main__ is special
-    outzip.write(script_path, "__main__.py")
+def time_startup(package_path, runs):
+    """Median seconds for a fresh interpreter to import boto from the package and build a client"""
+    env = dict(os.environ, AWS_DEFAULT_REGION='us-east-1', PYTHONDONTWRITEBYTECODE='1')
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', STARTUP_PROBE, package_path], env=env)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def report_startup(script_path, output_path, packaged_files, runs):
+    """Compare startup of the package we just built against the old all-deflated, source-only layout"""
+    report_dir = tempfile.mkdtemp(prefix='eggsecute-report')
+    try:
+        legacy_path = os.path.join(report_dir, 'legacy')
+        write_package(script_path, legacy_path, packaged_files, optimized=False)
+        legacy_size = os.path.getsize(legacy_path)
+        legacy_seconds = time_startup(legacy_path, runs)
+        optimized_seconds = time_startup(output_path, runs)
+    finally:
+        shutil.rmtree(report_dir)
+
+    sys.stdout.write("startup (import boto, build an rds client), median of %d runs:\n" % runs)
+    sys.stdout.write("  deflated source:          %7.1f ms  %5.1f MB\n" % (legacy_seconds * 1000, legacy_size / 1e6))
+    sys.stdout.write("  stored bytecode and json: %7.1f ms  %5.1f MB  (%.0f%% faster)\n" % (
+        optimized_seconds * 1000, os.path.getsize(output_path) / 1e6, (1 - optimized_seconds / legacy_seconds) * 100))
+
+
+def main(script_path, output_path, services=None, report_runs=0):
+    """
+    :param services: the only services whose model data gets packaged. Defaults to the ones our code creates clients
+        for plus what botocore needs for credentials. The build fails if our code uses a service not in the list.
+    :param report_runs: if set, also time startup against the old package layout, median of this many runs
+    """
+    if os.path.exists(output_path):
+        sys.stderr.write("output path '%s' exists; refusing to overwrite\n" % output_path)
+        return 1
 
     # hack to explicitly add everything
     module_files = []
@@ -78,21 +201,51 @@ def main(script_path, output_path):
     # filter out everything but .py's
     filtered_files = [x for x in module_files if x[1].endswith(".py") or x[1].endswith(".json") or x[1].endswith(".pem")]
 
-    for source_path, relative_destination_path in set(filtered_files):
-        outzip.write(source_path, relative_destination_path)
-    outzip.close()
-    outfile.close()
+    # only package the service models we actually use
+    used_services = find_used_services(filtered_files)
+    if services is None:
+        services = used_services | CREDENTIAL_SERVICES
+    missing_services = used_services - set(services)
+    if missing_services:
+        sys.stderr.write("aurora_echo creates clients for %s which the service allowlist leaves out\n" % ', '.join(sorted(missing_services)))
+        return 1
+    available_services = set(model_service(x[1]) for x in filtered_files)
+    unknown_services = set(services) - available_services
+    if unknown_services:
+        sys.stderr.write("no model data found for service(s) %s\n" % ', '.join(sorted(unknown_services)))
+        return 1
+    packaged_files = filter_services(filtered_files, services)
+
+    write_package(script_path, output_path, packaged_files)
 
-    os.chmod(output_path, 0o755)
+    sys.stdout.write("packaged models for %s\n" % ', '.join(sorted(services)))
+    sys.stdout.write("%d files, %.1f MB uncompressed (everything would be %d files, %.1f MB); executable is %.1f MB\n" % (
+        len(packaged_files), total_size(packaged_files) / 1e6, len(filtered_files), total_size(filtered_files) / 1e6,
+        os.path.getsize(output_path) / 1e6))
+
+    # this is what boto_monkey pays on every start
+    start = time.perf_counter()
+    with zipfile.ZipFile(output_path) as egg:
+        name_count = len(egg.namelist())
+    sys.stdout.write("opening it and listing its %d names takes %.1f ms\n" % (name_count, (time.perf_counter() - start) * 1000))
+
+    if report_runs:
+        report_startup(script_path, output_path, packaged_files, report_runs)
 
     return 0
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        sys.stderr.write("eggsecute <main_function_file> <output_package_file>\n")
+    args = sys.argv[1:]
+    report_runs = 0
+    if args[:1] == ['--report']:
+        report_runs = 5
+        args = args[1:]
+    if len(args) < 2:
+        sys.stderr.write("eggsecute [--report] <main_function_file> <output_package_file> [service ...]\n")
         sys.exit(1)
-    script_path = sys.argv[1]
-    output_path = sys.argv[2]
+    script_path = args[0]
+    output_path = args[1]
+    services = set(args[2:]) or None
 
-    sys.exit(main(script_path, output_path))
+    sys.exit(main(script_path, output_path, services, report_runs))
@@ -0,0 +1,67 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+"""
+The tests run the commands against the in-memory fakes the benchmarks use, see benchmarks/fake_aws.py
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_aws import FakeAWS, FakeEchoUtil  # noqa: E402
+
+from aurora_echo import echo_promote  # noqa: E402
+
+# what the api fixture's account holds
+MANAGED_NAME = 'orders'  # orders-0 promoted, orders-1 retired
+HOSTED_ZONE_ID = 'ZORDERS'
+DOMAIN = 'example.com'  # record-0.example.com up to record-9.example.com
+
+
+@pytest.fixture(autouse=True)
+def no_sleeping(monkeypatch):
+    """Waits poll again straight away, the fakes don't need time to change"""
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+
+
+@pytest.fixture
+def api():
+    api = FakeAWS()
+    api.add_fleet(0, managed_names=[MANAGED_NAME])
+    api.add_hosted_zone(HOSTED_ZONE_ID, DOMAIN, 10)
+    return api
+
+
+@pytest.fixture
+def make_util():
+    """:return: a function making a fresh EchoUtil for a FakeAWS, as each run of a command would"""
+    def make(api: FakeAWS, **kwargs):
+        echo_promote.record_set_cache.clear()
+        return FakeEchoUtil(api, api.region, api.account_number, **kwargs)
+    return make
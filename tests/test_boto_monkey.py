@@ -0,0 +1,106 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+import os
+import zipfile
+
+import pytest
+
+from aurora_echo import boto_monkey
+from aurora_echo.echo_const import CACHE_DIR_ENVVAR
+
+BUNDLE_NAME = 'botocore/cacert.pem'
+BUNDLE = b'-----BEGIN CERTIFICATE-----\nnot really\n-----END CERTIFICATE-----\n'
+
+
+@pytest.fixture
+def egg(tmp_path, monkeypatch):
+    """An executable with just a CA bundle in it, and a cache dir of our own"""
+    path = str(tmp_path / 'aurora-echo')
+    with zipfile.ZipFile(path, 'w') as egg:
+        egg.writestr(BUNDLE_NAME, BUNDLE)
+    egg = zipfile.ZipFile(path)
+    monkeypatch.setattr(boto_monkey, 'EGG', egg)
+    monkeypatch.setenv(CACHE_DIR_ENVVAR, str(tmp_path / 'cache'))
+    os.makedirs(str(tmp_path / 'cache'), mode=0o700)
+    monkeypatch.delenv('REQUESTS_CA_BUNDLE', raising=False)
+    return egg
+
+
+def read(path: str):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_ca_bundle_is_extracted_once(egg):
+    cert_file = boto_monkey.extract_ca_certs(BUNDLE_NAME)
+    assert read(cert_file) == BUNDLE
+    modified = os.stat(cert_file).st_mtime_ns
+
+    assert boto_monkey.extract_ca_certs(BUNDLE_NAME) == cert_file
+    assert os.stat(cert_file).st_mtime_ns == modified
+
+
+def test_ca_bundle_that_differs_from_the_egg_is_replaced(egg):
+    cert_file = boto_monkey.extract_ca_certs(BUNDLE_NAME)
+    with open(cert_file, 'wb') as f:
+        f.write(BUNDLE.replace(b'not really', b'planted!!!'))  # same size
+
+    assert boto_monkey.extract_ca_certs(BUNDLE_NAME) == cert_file
+    assert read(cert_file) == BUNDLE
+
+
+def test_ca_bundle_others_can_write_to_is_replaced(egg):
+    cert_file = boto_monkey.extract_ca_certs(BUNDLE_NAME)
+    os.chmod(cert_file, 0o666)
+
+    assert boto_monkey.extract_ca_certs(BUNDLE_NAME) == cert_file
+    assert not os.stat(cert_file).st_mode & 0o022
+
+
+def test_ca_bundle_is_not_kept_in_a_cache_dir_others_can_write_to(egg, monkeypatch):
+    os.chmod(os.environ[CACHE_DIR_ENVVAR], 0o777)
+    assert boto_monkey.extract_ca_certs(BUNDLE_NAME) is None
+
+    cleanups = []
+    monkeypatch.setattr(boto_monkey.atexit, 'register', lambda *args: cleanups.append(args))
+    boto_monkey.patch_ca_certs()
+    cert_file = os.environ['REQUESTS_CA_BUNDLE']
+    assert not cert_file.startswith(os.environ[CACHE_DIR_ENVVAR])
+    assert read(cert_file) == BUNDLE
+
+    for function, *args in cleanups:
+        function(*args)
+    assert not os.path.exists(cert_file)
+
+
+def test_egg_without_a_ca_bundle_is_left_to_botocore(tmp_path, monkeypatch):
+    path = str(tmp_path / 'aurora-echo')
+    with zipfile.ZipFile(path, 'w') as egg:
+        egg.writestr('aurora_echo/__init__.py', b'')
+    monkeypatch.setattr(boto_monkey, 'EGG', zipfile.ZipFile(path))
+    monkeypatch.delenv('REQUESTS_CA_BUNDLE', raising=False)
+
+    boto_monkey.patch_ca_certs()
+    assert 'REQUESTS_CA_BUNDLE' not in os.environ
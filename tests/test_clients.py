@@ -0,0 +1,56 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+import pytest
+
+from aurora_echo import echo_clients
+from aurora_echo.echo_clients import BOTOCORE_DEFAULT_POOL_CONNECTIONS, ensure_pool_connections, get_client
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Clients of our own, rather than the process's"""
+    monkeypatch.setattr(echo_clients, '_clients', {})
+    monkeypatch.setattr(echo_clients, '_config_kwargs', {})
+    monkeypatch.setattr(echo_clients, '_client_hooks', [])
+
+
+def test_growing_the_pool_keeps_clients_already_built():
+    hooked = []
+    echo_clients.add_client_hook(lambda client, role_arn: hooked.append(client))
+    before = get_client('rds', 'us-east-1')
+
+    ensure_pool_connections(BOTOCORE_DEFAULT_POOL_CONNECTIONS * 2)
+    assert get_client('rds', 'us-east-1') is before
+    assert before.meta.config.max_pool_connections == BOTOCORE_DEFAULT_POOL_CONNECTIONS
+
+    after = get_client('rds', 'us-west-2')
+    assert after.meta.config.max_pool_connections == BOTOCORE_DEFAULT_POOL_CONNECTIONS * 2
+    assert hooked == [before, after]
+
+
+def test_ensure_pool_connections_never_shrinks():
+    ensure_pool_connections(BOTOCORE_DEFAULT_POOL_CONNECTIONS * 2)
+    ensure_pool_connections(1)
+    assert get_client('rds', 'us-east-1').meta.config.max_pool_connections == BOTOCORE_DEFAULT_POOL_CONNECTIONS * 2
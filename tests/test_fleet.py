@@ -0,0 +1,151 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+import importlib
+import json
+
+import pytest
+from click.testing import CliRunner
+from fake_aws import ACCOUNT_NUMBER, FakeAWS, FakeEchoUtil
+
+from aurora_echo import echo_fleet
+from aurora_echo.echo_const import EXIT_RESUMABLE
+from aurora_echo.entry import LAZY_COMMANDS, root
+
+REGIONS = ['us-east-1', 'us-west-2']
+MANAGED_NAMES = ['orders', 'users']
+
+
+@pytest.fixture
+def apis(monkeypatch):
+    """:return: a FakeAWS for each region, which fleet's EchoUtils for that region call"""
+    apis = {}
+    for region in REGIONS:
+        apis[region] = FakeAWS(region=region)
+        apis[region].add_fleet(0, managed_names=MANAGED_NAMES)
+    monkeypatch.setattr(echo_fleet, 'EchoUtil',
+                        lambda region, *args, **kwargs: FakeEchoUtil(apis[region], region, *args, **kwargs))
+    return apis
+
+
+@pytest.fixture
+def write_config(tmp_path):
+    """:return: a function writing a fleet config, the databases and their defaults, and returning its path"""
+    def write(databases: list = None, **defaults):
+        path = tmp_path / 'fleet.json'
+        path.write_text(json.dumps({
+            'defaults': dict({'aws-account-number': ACCOUNT_NUMBER, 'region': REGIONS, 'retire': {'wait-timeout-minutes': 0}},
+                             **defaults),
+            'databases': [{'managed-name': managed_name} for managed_name in MANAGED_NAMES] if databases is None else databases,
+        }))
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def config(write_config):
+    return write_config()
+
+
+def fleet(command_name: str, config: str):
+    return CliRunner().invoke(root, ['--quiet', 'fleet', command_name, '-f', config])
+
+
+def test_fleet_retires_everything(apis, config):
+    result = fleet('retire', config)
+    assert result.exit_code == 0, result.output
+    for api in apis.values():
+        assert sorted(api.instances) == ['orders-0', 'users-0']
+
+
+def test_fleet_timing_out_everywhere_is_resumable(apis, config):
+    for api in apis.values():
+        api.delete_lag = 5
+
+    result = fleet('retire', config)
+    assert result.exit_code == EXIT_RESUMABLE, result.output
+    assert '4 of 4 managed names failed' in result.output
+
+    for api in apis.values():
+        api.delete_lag = 0
+        api.finish_deleting()
+    result = fleet('retire', config)
+    assert result.exit_code == 0, result.output
+    for api in apis.values():
+        assert sorted(api.clusters) == ['orders-0', 'users-0']
+
+
+def test_fleet_failing_for_any_other_reason_is_not_resumable(apis, config):
+    apis['us-east-1'].delete_lag = 5
+    apis['us-west-2'].errors['rds.delete_db_instance'] = 'AccessDenied'
+
+    result = fleet('retire', config)
+    assert result.exit_code == 1, result.output
+    assert '4 of 4 managed names failed' in result.output
+
+
+@pytest.mark.parametrize('databases', [[], [{'managed-name': 'orders', 'region': []}]])
+def test_fleet_with_nothing_to_run(apis, write_config, databases):
+    result = fleet('retire', write_config(databases))
+    assert result.exit_code == 0, result.output
+
+
+def test_fleet_takes_options_by_long_name(apis, write_config):
+    for api in apis.values():
+        api.add_fleet(0, managed_names=MANAGED_NAMES, instances_per_name=3)
+
+    result = fleet('retire', write_config(retire={'all': True}))
+    assert result.exit_code == 0, result.output
+    for api in apis.values():
+        assert sorted(api.instances) == ['orders-0', 'users-0']
+
+
+@pytest.mark.parametrize('databases, message', [
+    ([{'managed-name': 'orders', 'wait-timeout-minute': 0}], 'orders has wait-timeout-minute, which no command takes'),
+    ([{'managed-name': 'orders', 'retire': {'ttl': 60}}], 'orders for retire has ttl, which retire doesn\'t take'),
+])
+def test_fleet_rejects_options_it_would_ignore(apis, write_config, databases, message):
+    result = fleet('retire', write_config(databases))
+    assert result.exit_code == 2
+    assert message in result.output
+
+
+def commands():
+    return {name: getattr(importlib.import_module(LAZY_COMMANDS[name]), name) for name in echo_fleet.FLEET_COMMANDS}
+
+
+def test_collect_entry_options_layers_command_sections():
+    defaults = {'region': 'us-east-1', 'ttl': 60, 'promote': {'ttl': 30}}
+    entry = {'managed-name': 'orders', 'wait_timeout_minutes': 5, 'promote': {'wait-timeout-minutes': 10}}
+
+    assert echo_fleet.collect_entry_options(defaults, entry, 'promote', commands()) == {
+        'region': 'us-east-1', 'ttl': 30, 'managed_name': 'orders', 'wait_timeout_minutes': 10}
+    assert echo_fleet.collect_entry_options(defaults, entry, 'retire', commands()) == {
+        'region': 'us-east-1', 'managed_name': 'orders', 'wait_timeout_minutes': 5}
+
+
+def test_collect_entry_options_maps_long_names_to_params():
+    entry = {'managed-name': 'orders', 'all': True, 'wait-timeout-minutes': 5, 'cluster-snapshot-name': 'orders-prod'}
+    assert echo_fleet.collect_entry_options({}, entry, 'retire', commands()) == {
+        'managed_name': 'orders', 'retire_all': True, 'wait_timeout_minutes': 5}
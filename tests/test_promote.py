@@ -0,0 +1,144 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+import click
+import pytest
+from conftest import DOMAIN, HOSTED_ZONE_ID, MANAGED_NAME
+from fake_aws import stage_tag
+
+from aurora_echo.echo_const import ECHO_MODIFY_STAGE, ECHO_PROMOTE_STAGE, ECHO_RETIRE_STAGE
+from aurora_echo.echo_promote import collect_dns_params, find_record_sets, longest_ttl, parse_record_set, run_promote
+from aurora_echo.echo_wait import WaitTimeout
+
+RECORD_SETS = [('orders-db.{}'.format(DOMAIN), None, 'CNAME')]  # as validate_record_sets hands them to the commands
+
+
+@pytest.fixture(autouse=True)
+def modified_instance(api):
+    api.add_instance('orders-2', tags={stage_tag(MANAGED_NAME): ECHO_MODIFY_STAGE}, age_days=0)
+    api.insync_after = 3
+
+
+def promote(api, make_util, wait_timeout_minutes=1.0):
+    return run_promote(make_util(api), MANAGED_NAME, (HOSTED_ZONE_ID,), RECORD_SETS, 60, False, False, wait_timeout_minutes)
+
+
+def stages(api):
+    return {identifier: api.tags[api.arn(identifier)][stage_tag(MANAGED_NAME)] for identifier in api.instances}
+
+
+def cname(api):
+    for _, record_set in api.record_sets[HOSTED_ZONE_ID]:
+        if record_set['Name'].rstrip('.') == 'orders-db.{}'.format(DOMAIN):
+            return record_set['ResourceRecords'][0]['Value']
+    return None
+
+
+def test_promote_moves_tags_only_once_dns_is_insync(api, make_util, monkeypatch):
+    before = stages(api)
+    seen = []
+    get_change = api.route53.get_change
+
+    def check_tags(Id):
+        response = get_change(Id=Id)
+        if response['ChangeInfo']['Status'] != 'INSYNC':
+            seen.append(stages(api))
+        return response
+    monkeypatch.setattr(api.route53, 'get_change', check_tags)
+
+    assert promote(api, make_util)
+    assert seen == [before] * 3
+    assert stages(api) == {'orders-0': ECHO_RETIRE_STAGE, 'orders-1': ECHO_RETIRE_STAGE, 'orders-2': ECHO_PROMOTE_STAGE}
+    assert cname(api) == api.instances['orders-2']['Endpoint']['Address']
+
+
+def test_promote_timing_out_leaves_the_tags_alone(api, make_util):
+    before = stages(api)
+    with pytest.raises(WaitTimeout):
+        promote(api, make_util, wait_timeout_minutes=0)
+    assert stages(api) == before
+
+    # run again, it's still the modified instance that gets promoted
+    assert promote(api, make_util)
+    assert stages(api)['orders-2'] == ECHO_PROMOTE_STAGE
+    assert cname(api) == api.instances['orders-2']['Endpoint']['Address']
+
+
+def test_find_record_sets_shares_listings(api, make_util):
+    wanted = [('record-1.{}'.format(DOMAIN), 'CNAME'), ('record-2.{}'.format(DOMAIN), 'CNAME'),
+              ('missing.{}'.format(DOMAIN), 'CNAME')]
+    record_1, record_2, missing = find_record_sets(HOSTED_ZONE_ID, wanted, make_util(api))
+
+    assert record_1['ResourceRecords'] == [{'Value': 'target-1.{}'.format(DOMAIN)}]
+    assert record_2['ResourceRecords'] == [{'Value': 'target-2.{}'.format(DOMAIN)}]
+    assert missing is None
+    assert api.calls['route53.list_resource_record_sets'] == 1
+
+
+def test_find_record_sets_only_trusts_what_was_listed(api, make_util):
+    wanted = [('record-1.{}'.format(DOMAIN), 'CNAME'), ('record-1a.{}'.format(DOMAIN), 'CNAME')]
+    record_1, record_1a = find_record_sets(HOSTED_ZONE_ID, wanted, make_util(api))
+
+    assert record_1['ResourceRecords'] == [{'Value': 'target-1.{}'.format(DOMAIN)}]
+    assert record_1a is None
+    assert api.calls['route53.list_resource_record_sets'] == 2  # record-1a's absence is checked, not inferred
+
+
+def test_find_record_sets_follows_route53_order(api, make_util):
+    # Route 53 compares com.example.orders-db. with com.example.orders. as strings, so orders-db comes first
+    for name in ('orders', 'orders-db', 'orders-db-ro'):
+        api.put_record_set(HOSTED_ZONE_ID, {'Name': '{}.{}'.format(name, DOMAIN), 'Type': 'CNAME', 'TTL': 60,
+                                            'ResourceRecords': [{'Value': '{}.target'.format(name)}]})
+    listed = api.route53.list_resource_record_sets(HostedZoneId=HOSTED_ZONE_ID, MaxItems='3')['ResourceRecordSets']
+    assert [record_set['Name'] for record_set in listed] == ['orders-db-ro.{}.'.format(DOMAIN), 'orders-db.{}.'.format(DOMAIN),
+                                                             'orders.{}.'.format(DOMAIN)]
+    api.reset_counters()
+
+    wanted = [('orders.{}'.format(DOMAIN), 'CNAME'), ('orders-db.{}'.format(DOMAIN), 'CNAME')]
+    found = find_record_sets(HOSTED_ZONE_ID, wanted, make_util(api))
+    assert [record_set['ResourceRecords'][0]['Value'] for record_set in found] == ['orders.target', 'orders-db.target']
+    assert api.calls['route53.list_resource_record_sets'] == 1
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('orders-db.example.com', ('orders-db.example.com', None, 'CNAME')),
+    ('orders-db.example.com:300', ('orders-db.example.com', 300, 'CNAME')),
+    ('orders-db.example.com:0:txt', ('orders-db.example.com', 0, 'TXT')),
+    ('orders-db.example.com::TXT', ('orders-db.example.com', None, 'TXT')),
+])
+def test_parse_record_set(spec, expected):
+    assert parse_record_set(spec) == expected
+
+
+@pytest.mark.parametrize('spec', ['orders-db.example.com:-1', 'orders-db.example.com:soon', ':300'])
+def test_parse_record_set_rejects(spec):
+    with pytest.raises(click.BadParameter):
+        parse_record_set(spec)
+
+
+def test_ttl_of_zero_is_kept(api, make_util):
+    record_sets = [parse_record_set('orders-db.{}:0'.format(DOMAIN)), parse_record_set('orders-ro.{}'.format(DOMAIN))]
+    params, _ = collect_dns_params(HOSTED_ZONE_ID, record_sets, 'orders-2.example.com', 60, make_util(api))
+    assert [change['ResourceRecordSet']['TTL'] for change in params['ChangeBatch']['Changes']] == [0, 60]
+    assert longest_ttl(record_sets[:1], 60) == 0
@@ -0,0 +1,126 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+from aurora_echo import echo_ratelimit
+from aurora_echo.echo_const import RETRY_MAX_ATTEMPTS
+from aurora_echo.echo_ratelimit import RATE_DECREASE_FACTOR, RETRY_BUDGET_MAXIMUM, RateLimiter, RetryBudget
+
+
+@pytest.fixture(autouse=True)
+def no_trickle(monkeypatch):
+    """Retries are only earned by successful calls, not by the clock"""
+    monkeypatch.setattr(echo_ratelimit, 'RETRY_BUDGET_MINIMUM_PER_SECOND', 0)
+
+
+class FakeEvents(object):
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register_first(self, event_name, handler, unique_id=None):
+        self.handlers[event_name] = handler
+
+
+def fake_client(service_name: str, region: str):
+    """Just enough of a botocore client for RateLimiter.register"""
+    service_model = SimpleNamespace(service_name=service_name, service_id=None, endpoint_prefix=service_name)
+    return SimpleNamespace(meta=SimpleNamespace(service_model=service_model, region_name=region, events=FakeEvents()))
+
+
+def response(status_code: int, code: str = None):
+    return SimpleNamespace(status_code=status_code), {'Error': {'Code': code}} if code else {}
+
+
+def needs_retry(limiter: RateLimiter, status_code: int, code: str = None, attempts: int = 1, service_name: str = 'rds',
+                scope: tuple = ('us-east-1', None)):
+    return limiter.needs_retry(scope, service_name, response(status_code, code), SimpleNamespace(name='DescribeDBInstances'),
+                               attempts, None)
+
+
+def test_retry_budget_runs_out():
+    budget = RetryBudget(0.5)
+    assert all(budget.withdraw() for _ in range(int(RETRY_BUDGET_MAXIMUM)))
+    assert not budget.withdraw()
+
+    budget.deposit()
+    assert not budget.withdraw()  # half a retry isn't one
+    budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_retries_stop_once_the_budget_is_spent():
+    limiter = RateLimiter({}, 0)
+    for _ in range(int(RETRY_BUDGET_MAXIMUM)):
+        assert needs_retry(limiter, 500) is None  # left to botocore to retry
+
+    with pytest.raises(ClientError) as e:
+        needs_retry(limiter, 400, 'Throttling')
+    assert e.value.response['Error']['Code'] == 'Throttling'
+
+
+def test_retries_stop_after_max_attempts():
+    limiter = RateLimiter({}, 0)
+    with pytest.raises(ClientError):
+        needs_retry(limiter, 500, 'InternalFailure', attempts=RETRY_MAX_ATTEMPTS)
+    assert limiter.retry_budget.balance == RETRY_BUDGET_MAXIMUM
+
+
+def test_client_errors_are_not_retried_or_charged():
+    limiter = RateLimiter({}, 0)
+    assert needs_retry(limiter, 400, 'DBInstanceNotFound') is None
+    assert limiter.retry_budget.balance == RETRY_BUDGET_MAXIMUM
+
+
+def test_throttling_slows_down_only_its_region():
+    limiter = RateLimiter({'rds': 20}, 0.1)
+    needs_retry(limiter, 400, 'Throttling', scope=('us-east-1', None))
+
+    assert limiter.bucket(('us-east-1', None), 'rds', 'DescribeDBInstances').rate == 20 * RATE_DECREASE_FACTOR
+    assert limiter.bucket(('us-west-2', None), 'rds', 'DescribeDBInstances').rate == 20
+
+
+def test_buckets_are_per_region_and_account_or_per_account():
+    limiter = RateLimiter({'rds': 20, 'route53': 5}, 0.1)
+    role_arn = 'arn:aws:iam::123456789012:role/aurora-echo'
+    clients = [(fake_client(service_name, region), role) for service_name in ('rds', 'route53')
+               for region in ('us-east-1', 'us-west-2') for role in (None, role_arn)]
+    for client, role in clients:
+        limiter.register(client, role)
+        event_name = 'request-created.' + client.meta.service_model.endpoint_prefix
+        client.meta.events.handlers[event_name](operation_name='ListThings')
+
+    assert sorted(limiter.buckets, key=repr) == sorted([
+        (('us-east-1', None), 'rds'),
+        (('us-east-1', role_arn), 'rds'),
+        (('us-west-2', None), 'rds'),
+        (('us-west-2', role_arn), 'rds'),
+        ((None,), 'route53'),
+        ((role_arn,), 'route53'),
+    ], key=repr)
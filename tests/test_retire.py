@@ -0,0 +1,152 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import pytest
+from botocore.exceptions import ClientError
+from conftest import MANAGED_NAME
+from fake_aws import stage_tag
+
+from aurora_echo import echo_retire
+from aurora_echo.echo_const import ECHO_RETIRE_STAGE, EXIT_RESUMABLE
+from aurora_echo.echo_retire import delete_all_instances, run_retire, start_instance_delete
+from aurora_echo.echo_wait import WaitTimeout
+
+
+@pytest.fixture(autouse=True)
+def slow_deletes(api):
+    api.delete_lag = 5
+
+
+def retire(api, make_util, retire_all=False, wait=False, wait_timeout_minutes=1.0, **kwargs):
+    return run_retire(make_util(api), MANAGED_NAME, False, retire_all, wait, wait_timeout_minutes, **kwargs)
+
+
+def test_retire_deletes_the_instance_then_its_cluster(api, make_util):
+    assert retire(api, make_util, wait=True)
+    assert 'orders-1' not in api.instances and 'orders-1' not in api.clusters
+    assert 'orders-0' in api.instances and 'orders-0' in api.clusters
+
+
+def test_retire_times_out_waiting_for_the_instance(api, make_util):
+    with pytest.raises(WaitTimeout) as e:
+        retire(api, make_util, wait_timeout_minutes=0)
+
+    assert e.value.exit_code == EXIT_RESUMABLE
+    assert api.instances['orders-1']['DBInstanceStatus'] == 'deleting'
+    assert api.clusters['orders-1']['Status'] == 'available'
+    assert api.tags[api.cluster_arn('orders-1')][stage_tag(MANAGED_NAME)] == ECHO_RETIRE_STAGE
+
+
+def test_retire_resumes_while_the_instance_is_still_deleting(api, make_util):
+    with pytest.raises(WaitTimeout):
+        retire(api, make_util, wait_timeout_minutes=0)
+
+    assert retire(api, make_util, wait=True)
+    assert 'orders-1' not in api.instances and 'orders-1' not in api.clusters
+    assert api.calls['rds.delete_db_instance'] == 1
+
+
+def test_retire_resumes_once_the_instance_is_gone(api, make_util):
+    with pytest.raises(WaitTimeout):
+        retire(api, make_util, wait_timeout_minutes=0)
+    api.finish_deleting()
+    assert 'orders-1' not in api.instances and 'orders-1' in api.clusters
+
+    assert retire(api, make_util, wait=True)
+    assert 'orders-1' not in api.clusters
+    assert 'orders-0' in api.clusters
+
+
+def test_retire_resumes_while_the_cluster_is_deleting(api, make_util):
+    # as left by a run stopped just after it started deleting the cluster
+    make_util(api).add_cluster_stage_tag(MANAGED_NAME, 'orders-1', ECHO_RETIRE_STAGE)
+    api.rds.delete_db_instance(DBInstanceIdentifier='orders-1', SkipFinalSnapshot=True)
+    api.finish_deleting()
+    api.rds.delete_db_cluster(DBClusterIdentifier='orders-1', SkipFinalSnapshot=True)
+
+    assert retire(api, make_util, wait=True)
+    assert 'orders-1' not in api.clusters
+    assert api.calls['rds.delete_db_cluster'] == 2
+
+
+def test_instance_delete_already_under_way_is_not_an_error(api, make_util):
+    util = make_util(api)
+    instance = dict(api.instances['orders-1'])
+    params = {'DBInstanceIdentifier': 'orders-1', 'SkipFinalSnapshot': True}
+    api.rds.delete_db_instance(**params)
+
+    start_instance_delete(instance, params, util, MANAGED_NAME)  # still thinks it's available, RDS says otherwise
+    api.finish_deleting()
+    start_instance_delete(instance, params, util, MANAGED_NAME)
+
+
+def test_instance_delete_refused_for_another_reason_fails(api, make_util):
+    api.errors['rds.delete_db_instance'] = 'InvalidDBInstanceState'
+    util = make_util(api)
+    with pytest.raises(ClientError) as e:
+        start_instance_delete(api.instances['orders-1'], {'DBInstanceIdentifier': 'orders-1', 'SkipFinalSnapshot': True},
+                              util, MANAGED_NAME)
+    assert e.value.response['Error']['Code'] == 'InvalidDBInstanceState'
+
+
+def test_retire_all_times_out_resumably(api, make_util):
+    api.add_instance('orders-2', tags={stage_tag(MANAGED_NAME): ECHO_RETIRE_STAGE}, age_days=3)
+    with pytest.raises(click.ClickException) as e:
+        retire(api, make_util, retire_all=True, wait_timeout_minutes=0)
+    assert e.value.exit_code == EXIT_RESUMABLE
+    assert all(api.instances[identifier]['DBInstanceStatus'] == 'deleting' for identifier in ('orders-1', 'orders-2'))
+
+    api.finish_deleting()
+    assert retire(api, make_util, retire_all=True)
+    assert set(api.instances) == {'orders-0'} and set(api.clusters) == {'orders-0'}
+
+
+def test_retire_all_fails_outright_on_anything_else(api, make_util):
+    api.errors['rds.delete_db_instance'] = 'AccessDenied'
+    with pytest.raises(click.ClickException) as e:
+        retire(api, make_util, retire_all=True, wait_timeout_minutes=0)
+    assert e.value.exit_code == 1
+
+
+def test_retire_all_runs_at_most_max_workers_at_once(api, make_util, monkeypatch):
+    for i in range(2, 6):
+        api.add_instance('orders-{}'.format(i), tags={stage_tag(MANAGED_NAME): ECHO_RETIRE_STAGE}, age_days=3)
+    pool_sizes = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def __init__(self, max_workers):
+            pool_sizes.append(max_workers)
+            super().__init__(max_workers=max_workers)
+
+    monkeypatch.setattr(echo_retire, 'ThreadPoolExecutor', RecordingExecutor)
+    assert retire(api, make_util, retire_all=True, max_workers=2)
+    assert pool_sizes == [2]
+    assert set(api.instances) == {'orders-0'}
+
+
+def test_retire_all_with_nothing_to_delete_does_not_build_a_pool(api, make_util):
+    delete_all_instances([], False, make_util(api), MANAGED_NAME, 60)
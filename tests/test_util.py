@@ -0,0 +1,68 @@
+##
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 BlackLocus
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##
+
+import pytest
+from botocore.exceptions import ClientError
+from conftest import MANAGED_NAME
+from fake_aws import stage_tag
+
+from aurora_echo.echo_const import DISCOVERY_SCAN, DISCOVERY_TAGGING, ECHO_RETIRE_STAGE
+
+
+@pytest.fixture(autouse=True)
+def retired_clusters(api):
+    api.add_fleet(20, managed_names=['users'])
+    for managed_name in (MANAGED_NAME, 'users'):
+        api.tags[api.cluster_arn('{}-1'.format(managed_name))] = {stage_tag(managed_name): ECHO_RETIRE_STAGE}
+
+
+@pytest.mark.parametrize('discovery', [DISCOVERY_TAGGING, DISCOVERY_SCAN])
+def test_find_clusters_in_stage(api, make_util, discovery):
+    util = make_util(api, discovery=discovery)
+    assert util.find_clusters_in_stage(MANAGED_NAME, ECHO_RETIRE_STAGE) == ['orders-1']
+
+
+def test_find_clusters_in_stage_scans_when_tagging_is_denied(api, make_util):
+    api.errors['tagging.get_resources'] = 'AccessDenied'
+    util = make_util(api)
+    assert util.find_clusters_in_stage(MANAGED_NAME, ECHO_RETIRE_STAGE) == ['orders-1']
+    assert util.discovery == DISCOVERY_SCAN
+
+
+def test_discovery_scans_when_tagging_is_denied(api, make_util):
+    api.errors['tagging.get_resources'] = 'AccessDenied'
+    util = make_util(api)
+    assert sorted(instance['DBInstanceIdentifier'] for instance, _ in util.find_managed_instances(MANAGED_NAME)) == \
+        ['orders-0', 'orders-1']
+    assert util.discovery == DISCOVERY_SCAN
+    assert api.calls['rds.list_tags_for_resource'] == 20
+
+
+def test_discovery_does_not_scan_when_rds_fails(api, make_util):
+    api.errors['rds.describe_db_instances'] = 'InternalFailure'
+    util = make_util(api)
+    with pytest.raises(ClientError):
+        util.find_managed_instances(MANAGED_NAME)
+    assert util.discovery == DISCOVERY_TAGGING
+    assert not api.calls['rds.list_tags_for_resource']